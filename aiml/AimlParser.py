@@ -4,6 +4,7 @@ A parser for AIML files
 
 from __future__ import print_function
 
+from xml.parsers import expat
 from xml.sax.handler import ContentHandler
 from xml.sax.xmlreader import Locator
 import sys
@@ -101,13 +102,14 @@ class AimlHandler(ContentHandler):
         stack element is duplicated.
         """
         assert len(self._whitespaceBehaviorStack) > 0, "Whitespace behavior stack should never be empty!"
-        try:
-            if attr["xml:space"] == "default" or attr["xml:space"] == "preserve":
-                self._whitespaceBehaviorStack.append(attr["xml:space"])
-            else:
-                raise AimlParserError( "Invalid value for xml:space attribute "+self._location() )
-        except KeyError:
+        # (most elements have no such attribute: get() spares a KeyError)
+        space = attr.get("xml:space")
+        if space is None:
             self._whitespaceBehaviorStack.append(self._whitespaceBehaviorStack[-1])
+        elif space == "default" or space == "preserve":
+            self._whitespaceBehaviorStack.append(space)
+        else:
+            raise AimlParserError( "Invalid value for xml:space attribute "+self._location() )
 
     def startElementNS(self, name, qname, attr):
         print( "QNAME:", qname )
@@ -546,10 +548,93 @@ class AimlHandler(ContentHandler):
         # All is well!
         return True
 
-def create_parser():
-    """Create and return an AIML parser object."""
-    parser = xml.sax.make_parser()
+class ExpatAimlParser(object):
+    """
+    An AIML parser driving an AimlHandler straight from the callbacks of
+    xml.parsers.expat, without the generic xml.sax reader in between
+    (which wraps every callback, and the attributes of every element).
+    Character data is not buffered: the handler locates the errors it
+    finds in text where the text starts, as with the SAX parser.
+
+    It behaves like the SAX parser create_parser('sax') returns, as far as
+    AIML files are concerned: parse() fills the handler's categories, the
+    handler reports its errors with the same locations, and files that
+    are not well-formed XML raise xml.sax.SAXParseException.
+    """
+
+    def __init__(self, handler):
+        self._handler = handler
+        self._parser = None
+        self._systemId = None
+
+    def getContentHandler(self):
+        return self._handler
+
+    def setContentHandler(self, handler):
+        self._handler = handler
+
+    # The xml.sax.xmlreader.Locator interface, for the handler and errors
+    def getColumnNumber(self):
+        if self._parser is None:
+            return None
+        return self._parser.ErrorColumnNumber
+
+    def getLineNumber(self):
+        if self._parser is None:
+            return 1
+        return self._parser.ErrorLineNumber
+
+    def getPublicId(self):
+        return None
+
+    def getSystemId(self):
+        return self._systemId
+
+    def parse(self, source):
+        """Parse source, the name of an AIML file or a binary file object."""
+        handler = self._handler
+        if hasattr(source, "read"):
+            self._systemId = getattr(source, "name", None)
+            data = source.read()
+        else:
+            self._systemId = source
+            with open(source, "rb") as f:
+                data = f.read()
+        parser = self._parser = expat.ParserCreate()
+        parser.buffer_text = False
+        parser.StartElementHandler = handler.startElement
+        parser.EndElementHandler = handler.endElement
+        parser.CharacterDataHandler = handler.characters
+        handler.setDocumentLocator(self)
+        try:
+            parser.Parse(data, True)
+        except expat.ExpatError as e:
+            raise xml.sax.SAXParseException(expat.ErrorString(e.code), e, self)
+        finally:
+            self._parser = None
+
+
+# The parser backends create_parser() knows
+_backends = {
+    "sax": None,
+    "expat": ExpatAimlParser,
+}
+
+
+def create_parser(backend="sax"):
+    """Create and return an AIML parser object.
+
+    backend is "sax", the default, for a parser built by
+    xml.sax.make_parser(), or "expat", for an ExpatAimlParser (see
+    Kernel.setParserBackend()).  Both fill the categories of the same
+    AimlHandler.
+    """
+    if backend not in _backends:
+        raise ValueError("Unknown AIML parser backend %r" % (backend,))
     handler = AimlHandler("UTF-8")
+    if _backends[backend] is not None:
+        return _backends[backend](handler)
+    parser = xml.sax.make_parser()
     parser.setContentHandler(handler)
     #parser.setFeature(xml.sax.handler.feature_namespaces, True)
     return parser
@@ -0,0 +1,122 @@
+"""
+An asyncio front end for the Kernel (Python 3.7 and later).
+
+    from aiml.AsyncKernel import AsyncKernel
+
+    bot = AsyncKernel()
+    bot.kernel.learn("std-startup.xml")
+    ...
+    response = await bot.respond(u"hello", sessionID)
+
+Responses are computed in an executor, so that they do not stall the
+event loop, with the Kernel in its 'session' locking mode; the commands
+of <system> elements are run by the event loop, through
+asyncio.create_subprocess_shell(), with a time limit.
+"""
+
+import asyncio
+import locale
+import os
+import signal
+import threading
+
+from .Kernel import Kernel
+
+
+class AsyncKernel(object):
+    """Answers inputs for an asyncio application.
+
+    kernel is the Kernel to use (a new one if not given), executor the
+    concurrent.futures executor that computes the responses (the event
+    loop's default one if None).  At most maxSessions sessions get a
+    response computed at a time; respond() waits for a turn.  The
+    responses of a session are computed one at a time, in the order
+    respond() was called.  <system> commands are killed after
+    systemTimeout seconds.
+
+    Once wrapped, the kernel must not be used synchronously from the
+    event loop's thread while a response runs elsewhere.
+    """
+
+    def __init__(self, kernel=None, executor=None, maxSessions=16, systemTimeout=10.0):
+        if maxSessions < 1:
+            raise ValueError("maxSessions must be positive")
+        self.kernel = kernel if kernel is not None else Kernel()
+        self.kernel.setLockingMode('session')
+        self.kernel._runSystem = self._runSystem
+        self.maxSessions = maxSessions
+        self.systemTimeout = systemTimeout
+        self._executor = executor
+        self._loop = None
+        self._loopThread = None
+        self._slots = None
+        self._inFlight = 0
+        # sessionID -> [asyncio.Lock, number of calls using it]
+        self._sessions = {}
+
+    @property
+    def inFlight(self):
+        """The number of sessions whose response is being computed."""
+        return self._inFlight
+
+    async def respond(self, input_, sessionID=Kernel._globalSessionID):
+        """Return the Kernel's response to the input string."""
+        self._bind()
+        entry = self._sessions.setdefault(sessionID, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._slots:
+                    self._inFlight += 1
+                    try:
+                        return await self._loop.run_in_executor(
+                            self._executor, self.kernel.respond, input_, sessionID)
+                    finally:
+                        self._inFlight -= 1
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._sessions[sessionID]
+
+    def _bind(self):
+        """Remember the event loop, on the first call of respond()."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._loopThread = threading.current_thread()
+            self._slots = asyncio.Semaphore(self.maxSessions)
+
+    def _runSystem(self, command):
+        """Kernel._runSystem(), for the executor's threads: has the event
+        loop run command."""
+        if self._loop is None or threading.current_thread() is self._loopThread:
+            # not called through respond(): waiting would block the loop
+            return Kernel._runSystem(self.kernel, command)
+        future = asyncio.run_coroutine_threadsafe(self._system(command), self._loop)
+        return future.result()
+
+    async def _system(self, command):
+        kernel = self.kernel
+        command = kernel._systemCommand(command)
+        try:
+            # (in a process group of its own, to be killed as a whole)
+            process = await asyncio.create_subprocess_shell(
+                command, stdout=asyncio.subprocess.PIPE,
+                start_new_session=hasattr(os, 'killpg'))
+        except OSError as msg:
+            return kernel._systemError("OSError", msg)
+        try:
+            out, err = await asyncio.wait_for(process.communicate(), self.systemTimeout)
+        except asyncio.TimeoutError:
+            try:
+                if hasattr(os, 'killpg'):
+                    os.killpg(process.pid, signal.SIGKILL)
+                else:
+                    process.kill()
+            except ProcessLookupError:
+                # it exited meanwhile
+                pass
+            await process.wait()
+            return kernel._systemError("Timeout", command)
+        out = out.decode(locale.getpreferredencoding(False), 'replace')
+        return kernel._systemOutput(out.splitlines())
@@ -0,0 +1,85 @@
+"""
+A cache of the categories parsed from AIML files, for incremental builds
+of brain files (see the aiml-build-brain script).
+
+Each entry holds the categories of a file as Kernel.learnParallel() gets
+them from its workers: a marshal dump of the list of ((pattern, that,
+topic), template) pairs, in the order of the file.  Entries are named by
+a hash of the contents of the file (and of the text encoding, and of the
+version of the entries), so a file whose contents did not change is not
+parsed again, wherever it moved, and a changed one gets a new entry.
+
+Kernel.learnParallel(globs, cache=BrainCache(directory)) learns every
+file from its marshal dump, parsed or not, so brains saved after learning
+the same files with the same cache, however full, are identical byte for
+byte.
+"""
+
+import hashlib
+import os
+import os.path
+
+# Change when the parser returns different categories from the same files.
+CACHE_VERSION = 1
+
+
+class BrainCache:
+    def __init__(self, directory):
+        """Keep the entries in directory, created if need be."""
+        self._directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._used = set()
+        self._hits = 0
+        self._misses = 0
+
+    def _filename(self, key):
+        return os.path.join(self._directory, key + ".cat")
+
+    def key(self, filename, encoding):
+        """Return the key of the entry for the AIML file filename, as
+        parsed for the text encoding."""
+        digest = hashlib.sha1(("%d %s\n" % (CACHE_VERSION, encoding)).encode("ascii"))
+        with open(filename, "rb") as f:
+            digest.update(f.read())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the marshalled categories of the entry key, or None if
+        there is no such entry."""
+        self._used.add(key)
+        try:
+            with open(self._filename(key), "rb") as f:
+                categories = f.read()
+        except (IOError, OSError):
+            self._misses += 1
+            return None
+        self._hits += 1
+        return categories
+
+    def put(self, key, categories):
+        """Store the marshalled categories as the entry key."""
+        self._used.add(key)
+        filename = self._filename(key)
+        # written aside first, so that an interrupted build leaves no
+        # truncated entry behind
+        temp = "%s.%d.tmp" % (filename, os.getpid())
+        with open(temp, "wb") as f:
+            f.write(categories)
+        os.rename(temp, filename)
+
+    def prune(self):
+        """Remove the entries that were neither asked for nor stored since
+        the cache was opened; return how many were removed."""
+        removed = 0
+        for name in os.listdir(self._directory):
+            key, ext = os.path.splitext(name)
+            if ext == ".cat" and key not in self._used:
+                os.remove(os.path.join(self._directory, name))
+                removed += 1
+        return removed
+
+    def stats(self):
+        """Return a dictionary of counters: entries found ('hits') and
+        missing ('misses') since the cache was opened."""
+        return {'hits': self._hits, 'misses': self._misses}
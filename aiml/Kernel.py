@@ -3,8 +3,13 @@
 
 from __future__ import print_function
 
+import bisect
 import copy
+import functools
 import glob
+import itertools
+import marshal
+import multiprocessing
 import os
 import random
 import re
@@ -12,20 +17,90 @@ import string
 import sys
 import time
 import threading
+import traceback
 import xml.sax
-from collections import namedtuple
+from collections import OrderedDict, deque, namedtuple
 try:
     from ConfigParser import ConfigParser
 except ImportError:
     from configparser import ConfigParser
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
 
 from .constants import *
 from . import DefaultSubs
 from . import Utils
 from .AimlParser import create_parser
+from .LRUCache import LRUCache
+from .MappedBrain import isMappedBrain
 from .PatternMgr import PatternMgr
-from .WordSub import WordSub
-
+from .ReadWriteLock import ReadWriteLock
+from .SessionStore import MemorySessionStore, SessionSnapshot
+from .TemplateAnalysis import TemplateAnalyzer
+from .TemplateCompiler import TemplateCompiler
+from .WordSub import TrieWordSub, WordSub
+
+
+
+# in the entries of the caches: the result holds whatever template the
+# input matches
+_ANY_TEMPLATE = object()
+
+
+class _SraiRecord(object):
+    """What the result of a <srai> depends on: filled in while it is
+    computed, and merged into the record of the enclosing <srai>."""
+    __slots__ = ('names', 'context', 'cacheable', 'depth', 'match')
+
+    def __init__(self, depth):
+        self.match = None       # the MatchContext of the <srai> input
+        self.names = set()      # predicates read by the templates
+        self.context = False    # depends on the words of 'that' or topic
+        self.cacheable = True   # no impure template, no recursion cut
+        self.depth = depth      # deepest input stack reached
+
+    def merge(self, names, context, cacheable, depth):
+        self.names.update(names)
+        self.context = self.context or context
+        self.cacheable = self.cacheable and cacheable
+        self.depth = max(self.depth, depth)
+
+
+def _exclusive(method):
+    """Make method wait for the responses in progress (all of them, or in
+    the 'session' locking mode those of every session), and hold them off
+    while it changes the brain or the configuration."""
+    @functools.wraps(method)
+    def exclusive(self, *args, **kwargs):
+        lock = self._writeLock
+        lock.acquire()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            lock.release()
+    return exclusive
+
+
+def _parseAimlFile(job):
+    """Parse the AIML file of job, a (filename, text encoding, parser
+    backend, marshalled) tuple, for Kernel.learnParallel(): return its
+    categories as a list of ((pattern, that, topic), template) pairs in
+    the order of the file (marshalled, to be sent back by a worker
+    process), or None and the parse error, and the time taken."""
+    filename, encoding, backend, marshalled = job
+    start = time.time()
+    parser = create_parser(backend)
+    handler = parser.getContentHandler()
+    handler.setEncoding(encoding)
+    try: parser.parse(filename)
+    except xml.sax.SAXParseException as msg:
+        return None, str(msg), time.time() - start
+    categories = list(handler.categories.items())
+    if marshalled:
+        categories = marshal.dumps(categories)
+    return categories, None, time.time() - start
 
 
 def msg_encoder(encoding=None):
@@ -47,11 +122,11 @@ def msg_encoder(encoding=None):
 class Kernel:
     # module constants
     _globalSessionID = "_global" # key of the global session (duh)
-    _maxHistorySize = 10 # maximum length of the _inputs and _responses lists
+    _maxHistorySize = 10 # maximum length of the _inputHistory and _outputHistory deques
     _maxRecursionDepth = 100 # maximum number of recursive <srai>/<sr> tags before the response is aborted.
     # special predicate keys
-    _inputHistory = "_inputHistory"     # keys to a queue (list) of recent user input
-    _outputHistory = "_outputHistory"   # keys to a queue (list) of recent responses.
+    _inputHistory = "_inputHistory"     # keys to a queue (deque) of recent user input
+    _outputHistory = "_outputHistory"   # keys to a queue (deque) of recent responses.
     _inputStack = "_inputStack"         # Should always be empty in between calls to respond()
 
     def __init__(self):
@@ -59,17 +134,54 @@ class Kernel:
         self._version = "python-aiml {}".format(VERSION)
         self._brain = PatternMgr()
         self._respondLock = threading.RLock()
+        self._lockingMode = 'global'
+        self._writeLock = self._respondLock
+        # in the 'session' mode: the brain's lock, and one lock per session
+        # with a response (or a copy) in progress, with the number of
+        # threads holding or waiting for it
+        self._brainLock = ReadWriteLock()
+        self._sessionLocks = {}
+        self._sessionLocksLock = threading.Lock()
         self.setTextEncoding(None if PY3 else "utf-8")
-
-        # set up the sessions
-        self._sessions = {}
+        # the marks that split inputs into sentences
+        self._sentenceTerminators = Utils.SENTENCE_TERMINATORS
+        self._parserBackend = "sax"
+
+        # set up the sessions, see setSessionStore(), and count the
+        # responses in progress in each (their sessions are kept)
+        self._sessions = MemorySessionStore()
+        self._sessions.setEvictable(self._evictable, self._sessionEvicted)
+        self._active = {}
+        # the checkpoints outstanding, and the sessions changed (or
+        # deleted) since the oldest, in the order of their last change:
+        # the tick of the clock of that change, and whether it was a
+        # deletion.  See sessionSnapshots().
+        self._sessionClock = itertools.count(1)
+        self._checkpoints = []
+        self._sessionChanges = OrderedDict()
+        self._sessionChangesLock = threading.Lock()
+        # per session: the normalized 'that' and topic, cached until they
+        # change, and a stack holding the MatchContext of each _respond()
+        # call in progress
+        self._normalized = {}
+        self._matchStack = {}
+        # results of <srai> and <sr>, see setSraiCacheSize(), whole
+        # responses, see setResponseCacheSize(), and per session the stack
+        # of _SraiRecords of those being computed; the caches rely on the
+        # analysis of the templates, see analyzeTemplates()
+        self._sraiCache = None
+        self._responseCache = None
+        self._sraiRecords = {}
+        self._analyzer = TemplateAnalyzer(self)
         self._addSession(self._globalSessionID)
 
         # Set up the bot predicates
         self._botPredicates = {}
         self.setBotPredicate("name", "Nameless")
 
-        # set up the word substitutors (subbers):
+        # set up the word substitutors (subbers), see
+        # setSubstitutionEngine():
+        self._wordSub = WordSub
         self._subbers = {}
         self._subbers['gender'] = WordSub(DefaultSubs.defaultGender)
         self._subbers['person'] = WordSub(DefaultSubs.defaultPerson)
@@ -111,6 +223,9 @@ class Kernel:
             "version":      self._processVersion,
         }
 
+        # templates are compiled on first use, see setTemplateEngine()
+        self._compiler = TemplateCompiler(self)
+
     def bootstrap(self, brainFile=None, learnFiles=[], commands=[],
                   chdir=None):
         """Prepare a Kernel object for use.
@@ -182,25 +297,57 @@ class Kernel:
         del(self._brain)
         self.__init__()
 
+    @_exclusive
     def loadBrain(self, filename):
         """Attempt to load a previously-saved 'brain' from the
         specified filename.
 
+        Both brain formats are understood: files written by
+        saveBrain(filename, mapped=True) are memory-mapped rather than
+        read into memory.  The tries of the substitution tables saved
+        with the brain (see saveBrain()) are not loaded as tables: they
+        only spare building those of the Kernel's tables that hold the
+        same entries, with the 'trie' substitution engine.
+
         NOTE: the current contents of the 'brain' will be discarded!
 
         """
         if self._verboseMode: print( "Loading brain from %s..." % filename, end="" )
         start = time.time()
-        self._brain.restore(filename)
+        if isMappedBrain(filename):
+            metadata = self._brain.restoreMapped(filename)
+        else:
+            metadata = self._brain.restore(filename)
+        self._restoreSubs(metadata.get(u"subs", {}))
+        self._templatesChanged()
         if self._verboseMode:
             end = time.time() - start
             print( "done (%d categories in %.2f seconds)" % (self._brain.numTemplates(), end) )
 
-    def saveBrain(self, filename):
-        """Dump the contents of the bot's brain to a file on disk."""
+    def saveBrain(self, filename, mapped=False):
+        """Dump the contents of the bot's brain to a file on disk.
+
+        If mapped is True the brain is written in the memory-mappable
+        format (see the MappedBrain module), which loads almost instantly
+        and whose pages are shared between processes that load it.
+
+        With the 'trie' substitution engine, the tries of the
+        substitution tables are saved too (see loadBrain()); a compiled
+        regex cannot be saved, so the 'regex' engine saves no tables.
+
+        """
         if self._verboseMode: print( "Saving brain to %s..." % filename, end="")
         start = time.time()
-        self._brain.save(filename)
+        metadata = {}
+        if self._wordSub is TrieWordSub:
+            states = [(name, subber.getState()) for name, subber in self._subbers.items()]
+            # (the tables that keep the regex have nothing worth saving)
+            metadata[u"subs"] = dict((name, state) for name, state in states
+                                     if state[1] is not None)
+        if mapped:
+            self._brain.saveMapped(filename, metadata)
+        else:
+            self._brain.save(filename, metadata)
         if self._verboseMode:
             print("done (%.2f seconds)" % (time.time() - start))
 
@@ -212,8 +359,10 @@ class Kernel:
         string is returned.
 
         """
-        try: return self._sessions[sessionID][name]
-        except KeyError: return ""
+        session = self._sessions.peek(sessionID)
+        if session is None:
+            return ""
+        return session.get(name, "")
 
     def setPredicate(self, name, value, sessionID = _globalSessionID):
         """Set the value of the predicate 'name' in the specified
@@ -224,8 +373,11 @@ class Kernel:
         created.
 
         """
-        self._addSession(sessionID)  # add the session, if it doesn't already exist.
-        self._sessions[sessionID][name] = value
+        if sessionID in self._sessions:
+            self._sessions[sessionID][name] = value
+        else:
+            self._addSession(sessionID)[name] = value  # add the session, if it doesn't already exist.
+        self._sessionChanged(sessionID)
 
     def getBotPredicate(self, name):
         """Retrieve the value of the specified bot predicate.
@@ -236,6 +388,7 @@ class Kernel:
         try: return self._botPredicates[name]
         except KeyError: return ""
 
+    @_exclusive
     def setBotPredicate(self, name, value):
         """Set the value of the specified bot predicate.
 
@@ -243,10 +396,255 @@ class Kernel:
 
         """
         self._botPredicates[name] = value
+        self._clearCaches()
         # Clumsy hack: if updating the bot name, we must update the
         # name in the brain as well
         if name == "name":
             self._brain.setBotName(self.getBotPredicate("name"))
+            # <srai> elements may now lead elsewhere
+            self._analyzer.clear()
+
+    @_exclusive
+    def setMatchEngine(self, engine):
+        """Select the pattern-matching engine used by the brain.
+
+        'recursive' (the default) is the original algorithm; 'iterative'
+        walks the pattern tree with an explicit stack, which avoids
+        copying the input word list at every level; 'memoized' remembers
+        the parts of the search that failed, which keeps patterns with
+        several wildcards from backtracking exponentially on long inputs.
+        All engines return the same responses.
+
+        """
+        self._brain.setMatchEngine(engine)
+
+    @_exclusive
+    def setMatchBudget(self, maxVisits=None, maxSeconds=None, fallback=u""):
+        """Bound the work of each match (see PatternMgr.setMatchBudget()):
+        a match that visits more than maxVisits nodes of the pattern
+        tree, or takes more than maxSeconds seconds, gives up, and its
+        input gets fallback as its response instead.  None, the default,
+        means no limit.
+
+        Long inputs can make the wildcards of some categories backtrack
+        for seconds, holding the locks of respond() all along; a budget
+        keeps every response short.  Responses that ran out of budget are
+        never cached.  profileMatch() tells how many nodes inputs visit.
+
+        """
+        template = [u"template", {}]
+        if fallback:
+            template.append([u"text", {u"xml:space": u"default"}, fallback])
+        self._brain.setMatchBudget(maxVisits, maxSeconds, template)
+
+    @_exclusive
+    def setSubstitutionEngine(self, engine):
+        """Select how the substitutions ('normal', 'person', 'gender'...)
+        find the words to replace.
+
+        'regex' (the default) scans the text with a regular expression
+        made of all the words of a substitution table; 'trie' splits the
+        text into words and looks them up in a trie, whose cost does not
+        grow with the size of the table.  Both make the same
+        substitutions.  The current tables are converted.
+
+        """
+        engines = {'regex': WordSub, 'trie': TrieWordSub}
+        if engine not in engines:
+            raise ValueError( "engine must be in ['regex', 'trie']" )
+        self._wordSub = engines[engine]
+        for name, subber in list(self._subbers.items()):
+            converted = self._wordSub()
+            # (the entries already have their three variants)
+            dict.update(converted, subber)
+            self._subbers[name] = converted
+
+    @_exclusive
+    def setTemplateEngine(self, engine):
+        """Select how templates are turned into responses.
+
+        'compiled' (the default) translates each template, the first
+        time it is used, into a tree of Python functions that is kept for
+        later responses; 'interpreted' walks the template's elements with
+        the _process*() methods every time.  Both produce the same
+        responses.
+
+        Compiled templates call the element processors that were
+        installed when they were compiled.  Calling this method again
+        discards them, along with the analysis of the templates (see
+        analyzeTemplates()), e.g. after changing the element processors.
+
+        """
+        if engine not in ('compiled', 'interpreted'):
+            raise ValueError( "engine must be in ['compiled', 'interpreted']" )
+        self._compiler = TemplateCompiler(self) if engine == 'compiled' else None
+        self._analyzer.clear()
+
+    @_exclusive
+    def setSraiCacheSize(self, size):
+        """Keep the results of up to size <srai> and <sr> elements for
+        reuse.  0, the default, disables the cache.
+
+        Sets of AIML like ALICE reduce many inputs to a few canonical
+        ones, whose responses then get computed over and over.  A
+        result is cached only if all the templates used to compute it
+        are deterministic and change nothing (see analyzeTemplates()):
+        no <random>, <set>, <date>, <system>, <learn>, <input>, <that> or
+        <id> elements, and no element processor replaced by the
+        application.  It is keyed on the normalized input, and reused
+        only while the predicates read by those templates (<get>,
+        <condition>) keep the values they had, as well as 'that' and the
+        topic if they could make a difference (see
+        PatternMgr.dependsOnContext(); <thatstar>, <topicstar>): results
+        are stored under those values, a cache entry each, with an entry
+        per input telling which predicates its results read.  The
+        least recently used entries are dropped first.
+
+        The cache is emptied whenever templates, bot predicates or
+        substitutions change.  After replacing element processors, call
+        setTemplateEngine() to have the templates examined again.
+
+        """
+        self._sraiCache = LRUCache(size) if size else None
+
+    @_exclusive
+    def setResponseCacheSize(self, size, ttl=None):
+        """Keep up to size responses to whole input sentences for
+        reuse, each for at most ttl seconds if ttl is given.  0, the
+        default, disables the cache.
+
+        Bots get asked the same few things ("hello", "what is your
+        name") over and over.  The response to a sentence is cached only
+        if the templates that produced it neither read predicates nor
+        are nondeterministic or have side effects (see
+        analyzeTemplates()); other inputs bypass the cache.  Like the
+        srai cache (see setSraiCacheSize()), it is keyed on the
+        normalized input (whose case matters, since <star/> gives the
+        words back as they were typed), and checks 'that' and the topic only when they
+        could make a difference.  The input and output histories of the
+        session are updated on hits as well, and the cache is emptied
+        under the same conditions as the srai cache.
+
+        """
+        self._responseCache = LRUCache(size, ttl) if size else None
+
+    def cacheStats(self):
+        """Return a dictionary mapping the name of each enabled cache
+        ('srai', 'response') to a dictionary of its size, limits and
+        hit and miss counts."""
+        stats = {}
+        if self._sraiCache is not None:
+            stats['srai'] = self._sraiCache.stats()
+        if self._responseCache is not None:
+            stats['response'] = self._responseCache.stats()
+        return stats
+
+    @_exclusive
+    def setSessionStore(self, store):
+        """Keep the sessions in store, a MemorySessionStore or a
+        SqliteSessionStore (see the SessionStore module).
+
+        The sessions of the Kernel are copied into the store, unless it
+        already holds a session of the same ID, e.g. saved by a previous
+        run.  The default store keeps every session in memory, for ever.
+
+        """
+        old, self._sessions = self._sessions, store
+        store.setEvictable(self._evictable, self._sessionEvicted)
+        for sessionID, session in old.items():
+            if store.peek(sessionID) is None:
+                store.add(sessionID, session)
+        for sessionID in list(self._matchStack):
+            self._sessionEvicted(sessionID)
+        self._addSession(self._globalSessionID)
+
+    def sessionStats(self):
+        """Return a dictionary of the number of sessions held, the limits
+        of the session store, and its counts of hits, misses and
+        evictions (and more, depending on the store)."""
+        return self._sessions.stats()
+
+    def setLockingMode(self, mode):
+        """Select how respond() keeps threads from stomping on each
+        other.
+
+        'global' (the default) lets a single response run at a time.
+        'session' only serializes the responses of each session, and runs
+        those of different sessions concurrently, sharing the brain.
+        Either way, the methods that change the brain or the
+        configuration (learn(), loadBrain(), loadSubs(),
+        setBotPredicate(), and <learn> elements) wait until they have
+        the Kernel to themselves.  In the 'session' mode the responses
+        then wait for them.
+
+        Call this before serving any request.  Note that threads only
+        answer faster together when they spend time outside of the
+        Python interpreter, e.g. waiting for <system> commands or in
+        element processors doing I/O.
+
+        """
+        if mode not in ('global', 'session'):
+            raise ValueError( "mode must be in ['global', 'session']" )
+        self._lockingMode = mode
+        self._writeLock = self._respondLock if mode == 'global' else self._brainLock.writer
+
+    def analyzeTemplates(self):
+        """Return a dictionary mapping the (pattern, that, topic) of
+        every category to the TemplateInfo of its template, which tells
+        whether it is pure, reads predicates (and which), is
+        nondeterministic or has side effects.  See the TemplateAnalysis
+        module.
+
+        The caches of the Kernel analyze the templates they use in the
+        same way, as they get matched.
+
+        """
+        analyze = self._analyzer.analyze
+        return dict((key, analyze(template))
+                    for key, template in self._brain.categories())
+
+    def templateInfo(self, input_, sessionID=_globalSessionID):
+        """Return the TemplateInfo of the template that input_ would
+        match in the specified session (created if needed), or None if
+        it matches nothing."""
+        try: input_ = self._cod.dec(input_)
+        except UnicodeError: pass
+        except AttributeError: pass
+        self._addSession(sessionID)
+        outputHistory = self.getPredicate(self._outputHistory, sessionID)
+        try: that = outputHistory[-1]
+        except IndexError: that = ""
+        template = self._brain.match(
+            self._brain.normalize(self._subbers['normal'].sub(input_)),
+            self._normalizedPredicate(sessionID, "that", that, self._brain._DUMMY_THAT),
+            self._normalizedPredicate(sessionID, "topic", self.getPredicate("topic", sessionID),
+                                      self._brain._DUMMY_TOPIC))
+        if template is None:
+            return None
+        return self._analyzer.analyze(template)
+
+    def profileMatch(self, input_, sessionID=_globalSessionID):
+        """Return a PatternMgr.MatchProfile for each sentence of input_,
+        matched as respond() would in the specified session (created if
+        needed): the number of nodes visited and of backtracks, the time
+        taken, and the category found.  Only the match of the input
+        itself is profiled, not those of the <srai> elements of its
+        template.  Nothing is changed: no response is computed.
+
+        """
+        try: input_ = self._cod.dec(input_)
+        except UnicodeError: pass
+        except AttributeError: pass
+        self._addSession(sessionID)
+        outputHistory = self.getPredicate(self._outputHistory, sessionID)
+        try: that = outputHistory[-1]
+        except IndexError: that = ""
+        subbedThat = self._normalizedPredicate(sessionID, "that", that, self._brain._DUMMY_THAT)
+        subbedTopic = self._normalizedPredicate(sessionID, "topic", self.getPredicate("topic", sessionID),
+                                                self._brain._DUMMY_TOPIC)
+        return [self._brain.profile(self._brain.normalize(self._subbers['normal'].sub(s)),
+                                    subbedThat, subbedTopic)
+                for s in Utils.iterSentences(input_, self._sentenceTerminators)]
 
     def setTextEncoding(self, encoding):
         """
@@ -260,7 +658,27 @@ class Kernel:
         self._textEncoding = encoding
         self._cod = msg_encoder(encoding)
 
+    @_exclusive
+    def setSentenceTerminators(self, terminators=Utils.SENTENCE_TERMINATORS):
+        """Set the marks that split inputs into sentences, each answered
+        in turn: a string of characters, ".?!" by default.  Marks that
+        open sentences count too, e.g. for a Spanish bot, ".?!" plus the
+        inverted question and exclamation marks.
+        """
+        self._sentenceTerminators = terminators
+
+    @_exclusive
+    def setParserBackend(self, backend="sax"):
+        """Set the parser learn() and learnParallel() read AIML files
+        with: "sax", the default, or "expat", which calls the AIML
+        handler from expat callbacks and loads brains faster (see
+        aiml.AimlParser.create_parser()).
+        """
+        create_parser(backend)
+        self._parserBackend = backend
 
+
+    @_exclusive
     def loadSubs(self, filename):
         """Load a substitutions file.
 
@@ -273,49 +691,202 @@ class Kernel:
         parser = ConfigParser()
         with open(filename) as inFile:
             parser.readfp(inFile, filename)
+        changed = False
         for s in parser.sections():
-            # Add a new WordSub instance for this section.  If one already
-            # exists, delete it.
-            if s in self._subbers:
-                del(self._subbers[s])
-            self._subbers[s] = WordSub()
+            # Make a new WordSub instance for this section.
+            subber = self._wordSub()
             # iterate over the key,value pairs and add them to the subber
             for k, v in parser.items(s):
-                self._subbers[s][k] = v
+                subber[k] = v
+            # Replace the existing one, unless it is the same (and
+            # already compiled).
+            old = self._subbers.get(s)
+            if old is None or list(old.items()) != list(subber.items()):
+                self._subbers[s] = subber
+                changed = True
+        if changed:
+            self._subsChanged()
+
+    def _restoreSubs(self, tables):
+        """Give the trie subbers holding the same entries as the tables
+        saved with a brain (see saveBrain()) the tries built from them."""
+        for name, state in tables.items():
+            subber = self._subbers.get(name)
+            if (isinstance(subber, TrieWordSub) and subber._regexIsDirty and
+                list(subber.items()) == [tuple(item) for item in state[0]]):
+                subber.setState(state)
+
+    def _subsChanged(self):
+        """Forget everything derived from the substitution tables."""
+        # the cached 'that' and topic may have been subbed differently
+        for cache in self._normalized.values():
+            cache.clear()
+        self._clearCaches()
+        # <srai> elements may now lead elsewhere
+        self._analyzer.clear()
+
+    def _templatesChanged(self):
+        """Forget everything derived from the templates of the brain."""
+        if self._compiler is not None:
+            self._compiler.clear()
+        self._analyzer.clear()
+        self._clearCaches()
+
+    def _clearCaches(self):
+        """Empty the srai and response caches."""
+        for cache in (self._sraiCache, self._responseCache):
+            if cache is not None:
+                cache.clear()
 
     def _addSession(self, sessionID):
-        """Create a new session with the specified ID string."""
-        if sessionID in self._sessions:
-            return
-        # Create the session.
-        self._sessions[sessionID] = {
+        """Create a new session with the specified ID string, unless it
+        exists.  Return the session, marked as used in the store."""
+        session = self._sessions.session(sessionID, self._newSession)
+        if sessionID not in self._matchStack:
+            self._normalized[sessionID] = {}
+            self._matchStack[sessionID] = []
+            self._sraiRecords[sessionID] = []
+        return session
+
+    def _newSession(self):
+        """Return the data of a new session."""
+        return {
             # Initialize the special reserved predicates
-            self._inputHistory: [],
-            self._outputHistory: [],
+            self._inputHistory: deque(maxlen=self._maxHistorySize),
+            self._outputHistory: deque(maxlen=self._maxHistorySize),
             self._inputStack: []
         }
 
+    def _evictable(self, sessionID):
+        """May the session store forget the session?"""
+        return sessionID != self._globalSessionID and sessionID not in self._active
+
+    def _sessionEvicted(self, sessionID):
+        """Forget what the Kernel keeps about a session the session store
+        forgot.  (Its lock goes when no thread holds or waits for it, see
+        _releaseLocks().)"""
+        self._normalized.pop(sessionID, None)
+        self._matchStack.pop(sessionID, None)
+        self._sraiRecords.pop(sessionID, None)
+
+    def _history(self, session, name):
+        """Return the history deque of the session, converting a list set
+        with setPredicate()."""
+        history = session.get(name, ())
+        if not isinstance(history, deque) or history.maxlen != self._maxHistorySize:
+            history = session[name] = deque(history, self._maxHistorySize)
+        return history
+
     def _deleteSession(self, sessionID):
         """Delete the specified session."""
-        if sessionID in self._sessions:
-            self._sessions.pop(sessionID)
+        self._sessions.delete(sessionID)
+        self._sessionEvicted(sessionID)
+        self._sessionChanged(sessionID, deleted=True)
 
     def getSessionData(self, sessionID=None):
         """Return a copy of the session data dictionary for the
         specified session.
 
         If no sessionID is specified, return a dictionary containing
-        *all* of the individual session dictionaries.
+        *all* of the individual session dictionaries.  See also
+        sessionSnapshots(), which does not build it.
 
         """
-        s = None
         if sessionID is not None:
-            try: s = self._sessions[sessionID]
-            except KeyError: s = {}
-        else:
-            s = self._sessions
-        return copy.deepcopy(s)
+            s = self._withSession(sessionID, self._copySession)
+            return s if s is not None else {}
+        s = {}
+        for sessionID in self._sessions.sessionIDs():
+            session = self._withSession(sessionID, self._copySession)
+            if session is not None:
+                s[sessionID] = session
+        return s
+
+    def _sessionChanged(self, sessionID, deleted=False):
+        """Record that a session changed, or was deleted, for
+        sessionSnapshots(): only needed while a checkpoint is
+        outstanding."""
+        if not self._checkpoints:
+            return
+        with self._sessionChangesLock:
+            self._sessionChanges.pop(sessionID, None)
+            self._sessionChanges[sessionID] = (next(self._sessionClock), deleted)
 
+    def sessionCheckpoint(self):
+        """Return a checkpoint, to pass to sessionSnapshots() later.
+
+        The sessions changed since the oldest checkpoint outstanding are
+        recorded; a checkpoint is outstanding until sessionSnapshots()
+        is given a later one.
+
+        """
+        with self._sessionChangesLock:
+            checkpoint = next(self._sessionClock)
+            self._checkpoints.append(checkpoint)
+        return checkpoint
+
+    def sessionSnapshots(self, since=None):
+        """Generate a (sessionID, SessionSnapshot) pair for every
+        session, or only for those changed since the checkpoint since
+        (see sessionCheckpoint()), with None for the sessions deleted
+        since then.  Sessions the session store forgot are left out.
+
+        Each session is copied between two of its responses, when it
+        comes; they are not copied at once.  For incremental dumps, take
+        the next checkpoint before iterating: sessions changing
+        meanwhile will be part of both dumps.  Passing a checkpoint lets
+        go of the earlier ones, which can no longer be passed.
+
+        """
+        if since is None:
+            changes = ((sessionID, False) for sessionID in self._sessions.sessionIDs())
+        else:
+            changes = []
+            with self._sessionChangesLock:
+                del self._checkpoints[:bisect.bisect_left(self._checkpoints, since)]
+                # forget the changes no checkpoint outstanding needs
+                oldest = self._checkpoints[0] if self._checkpoints else None
+                while self._sessionChanges:
+                    sessionID = next(iter(self._sessionChanges))
+                    if oldest is not None and self._sessionChanges[sessionID][0] > oldest:
+                        break
+                    del self._sessionChanges[sessionID]
+                for sessionID in reversed(self._sessionChanges):
+                    tick, deleted = self._sessionChanges[sessionID]
+                    if tick <= since:
+                        break
+                    changes.append((sessionID, deleted))
+            changes.reverse()
+        for sessionID, deleted in changes:
+            snapshot = self._withSession(sessionID, SessionSnapshot)
+            if snapshot is not None or deleted:
+                yield sessionID, snapshot
+
+    def _withSession(self, sessionID, func):
+        """Return func(session) for the specified session, called
+        between two of its responses, or None if there is no session."""
+        locks = self._acquireLocks(sessionID)
+        try:
+            session = self._sessions.peek(sessionID)
+            return func(session) if session is not None else None
+        finally:
+            self._releaseLocks(sessionID, locks)
+
+    def _copySession(self, session):
+        """Return a copy of the data of a session."""
+        data = {}
+        for name, value in session.items():
+            # the values are strings, but for the histories and input
+            # stack (lists of strings)
+            if isinstance(value, (str, unicode)):
+                data[name] = value
+            elif isinstance(value, (list, deque)) and all(isinstance(v, (str, unicode)) for v in value):
+                data[name] = copy.copy(value)
+            else:
+                data[name] = copy.deepcopy(value)
+        return data
+
+    @_exclusive
     def learn(self, filename):
         """Load and learn the contents of the specified AIML file.
 
@@ -327,7 +898,7 @@ class Kernel:
             if self._verboseMode: print( "Loading %s..." % f, end="")
             start = time.time()
             # Load and parse the AIML file.
-            parser = create_parser()
+            parser = create_parser(self._parserBackend)
             handler = parser.getContentHandler()
             handler.setEncoding(self._textEncoding)
             try: parser.parse(f)
@@ -338,12 +909,89 @@ class Kernel:
             # store the pattern/template pairs in the PatternMgr.
             for key, tem in handler.categories.items():
                 self._brain.add(key, tem)
+            # templates may have been replaced
+            self._templatesChanged()
             # Parsing was successful.
             if self._verboseMode:
                 print("done (%.2f seconds)" % (time.time() - start))
 
+    @_exclusive
+    def learnParallel(self, globs, workers=None, cache=None):
+        """Load and learn the AIML files matching globs, a filename with
+        wildcard characters or a list of them, parsing them in workers
+        worker processes (one per CPU by default; with a single one,
+        the files are parsed in this process).
+
+        The categories are learned as learn() would, one file after
+        another in the order of the globs, so that categories defined
+        again replace the earlier ones in the same way.
+
+        cache is an optional aiml.BrainCache.BrainCache: the files it
+        holds the categories of are not parsed again, and it is given
+        those of the others.
+
+        """
+        if isinstance(globs, (str, unicode)):
+            globs = [globs]
+        files = [f for pattern in globs for f in glob.glob(pattern)]
+        keys, cached = {}, {}
+        if cache is not None:
+            for f in files:
+                keys[f] = cache.key(f, self._textEncoding)
+                categories = cache.get(keys[f])
+                if categories is not None:
+                    cached[f] = categories
+        parse = [f for f in files if f not in cached]
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        workers = min(workers, len(parse))
+        # categories are marshalled to be sent back by the workers, and
+        # stored in the cache
+        marshalled = workers > 1 or cache is not None
+        jobs = [(f, self._textEncoding, self._parserBackend, marshalled) for f in parse]
+        pool = None
+        if workers > 1:
+            context = multiprocessing.get_context('fork' if hasattr(os, 'fork') else 'spawn') \
+                if hasattr(multiprocessing, 'get_context') else multiprocessing
+            pool = context.Pool(workers)
+            results = pool.imap(_parseAimlFile, jobs)
+        else:
+            results = (_parseAimlFile(job) for job in jobs)
+        try:
+            for f in files:
+                if self._verboseMode: print( "Loading %s..." % f, end="")
+                if f in cached:
+                    categories, error, seconds = cached[f], None, 0.0
+                else:
+                    categories, error, seconds = next(results)
+                    if error is None and cache is not None:
+                        cache.put(keys[f], categories)
+                if error is not None:
+                    err = "\nFATAL PARSE ERROR in file %s:\n%s\n" % (f, error)
+                    sys.stderr.write(err)
+                    continue
+                if marshalled:
+                    categories = marshal.loads(categories)
+                # store the pattern/template pairs in the PatternMgr.
+                for key, tem in categories:
+                    self._brain.add(key, tem)
+                if self._verboseMode:
+                    print("done (%.2f seconds)" % seconds)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            # templates may have been replaced
+            self._templatesChanged()
+
     def respond(self, input_, sessionID=_globalSessionID):
         """Return the Kernel's response to the input string."""
+        return self._respondInput(input_, sessionID, None)
+
+    def _respondInput(self, input_, sessionID, memo):
+        """respond(), normalizing the sentences through memo, a dictionary
+        of the sentences normalized so far, unless it is None (see
+        _respond())."""
         if len(input_) == 0:
             return u""
 
@@ -354,33 +1002,28 @@ class Kernel:
         except AttributeError: pass
 
         # prevent other threads from stomping all over us.
-        self._respondLock.acquire()
+        locks = self._acquireLocks(sessionID)
 
+        # the session store must not forget the session meanwhile
+        self._active[sessionID] = self._active.get(sessionID, 0) + 1
+        session = None
         try:
             # Add the session, if it doesn't already exist
-            self._addSession(sessionID)
+            session = self._addSession(sessionID)
 
-            # split the input into discrete sentences
-            sentences = Utils.sentences(input_)
+            # split the input into discrete sentences, leaving out empty
+            # ones, which would only push empty entries into the histories
             finalResponse = u""
-            for s in sentences:
-                # Add the input to the history list before fetching the
+            for s in Utils.iterSentences(input_, self._sentenceTerminators):
+                # Add the input to the history deque before fetching the
                 # response, so that <input/> tags work properly.
-                inputHistory = self.getPredicate(self._inputHistory, sessionID)
-                inputHistory.append(s)
-                while len(inputHistory) > self._maxHistorySize:
-                    inputHistory.pop(0)
-                self.setPredicate(self._inputHistory, inputHistory, sessionID)
+                self._history(session, self._inputHistory).append(s)
 
                 # Fetch the response
-                response = self._respond(s, sessionID)
+                response = self._respond(s, sessionID, memo)
 
-                # add the data from this exchange to the history lists
-                outputHistory = self.getPredicate(self._outputHistory, sessionID)
-                outputHistory.append(response)
-                while len(outputHistory) > self._maxHistorySize:
-                    outputHistory.pop(0)
-                self.setPredicate(self._outputHistory, outputHistory, sessionID)
+                # add the data from this exchange to the history deques
+                self._history(session, self._outputHistory).append(response)
 
                 # append this response to the final response.
                 finalResponse += (response + u"  ")
@@ -392,17 +1035,196 @@ class Kernel:
             # and return, encoding the string into the I/O encoding
             return self._cod.enc(finalResponse)
 
+        except Exception:
+            # a response that failed left its inputs on the stack: the
+            # next ones must start from an empty one
+            if session is not None:
+                del session[self._inputStack][:]
+            raise
+
         finally:
-            # release the lock
-            self._respondLock.release()
+            self._sessionChanged(sessionID)
+            active = self._active[sessionID] - 1
+            if active:
+                self._active[sessionID] = active
+            else:
+                del self._active[sessionID]
+            # release the locks
+            self._releaseLocks(sessionID, locks)
+
+    def _acquireLocks(self, sessionID):
+        """Acquire and return the locks a response in the specified
+        session must hold (see setLockingMode()), to pass to
+        _releaseLocks()."""
+        if self._lockingMode == 'global':
+            locks = (self._respondLock,)
+        else:
+            # the session's lock comes first: a response that waits for
+            # its session must not keep writers waiting.
+            with self._sessionLocksLock:
+                entry = self._sessionLocks.get(sessionID)
+                if entry is None:
+                    entry = self._sessionLocks[sessionID] = [threading.RLock(), 0]
+                entry[1] += 1
+            locks = (entry[0], self._brainLock.reader)
+        for lock in locks:
+            lock.acquire()
+        return locks
+
+    def _releaseLocks(self, sessionID, locks):
+        """Release the locks _acquireLocks() returned.  A session's lock
+        is dropped once no thread holds or waits for it, so that there
+        are only as many as there are responses in progress."""
+        for lock in reversed(locks):
+            lock.release()
+        if locks[0] is self._respondLock:
+            return
+        with self._sessionLocksLock:
+            entry = self._sessionLocks[sessionID]
+            entry[1] -= 1
+            if not entry[1]:
+                del self._sessionLocks[sessionID]
+
+    def respondMany(self, inputs, batchSize=1000, processes=0):
+        """Answer an iterable of (sessionID, input) pairs, generating
+        (sessionID, input, response) triples.
+
+        The inputs of each session are answered in the order in which
+        they come, as respond() would, but those of different sessions
+        may be answered, and generated, in another order: inputs are
+        read batchSize at a time, and a batch is answered in rounds
+        that take the next input of each of its sessions, sorted by
+        text, so that repeated inputs are normalized once per batch.
+
+        If processes is more than 1 (and the platform can fork), the
+        sessions are spread over that many worker processes, which
+        share the loaded brain with this one; the sessions they
+        answered are copied back into this Kernel at the end.  Changes
+        made to the brain by <learn> elements or to bot predicates are
+        not.  Responses then arrive in no particular order across
+        sessions.
+
+        """
+        if processes > 1 and hasattr(os, 'fork'):
+            return self._respondForked(inputs, batchSize, processes)
+        return self._respondBatches(inputs, batchSize)
+
+    def _respondBatches(self, inputs, batchSize):
+        """respondMany() in this process."""
+        inputs = iter(inputs)
+        while True:
+            batch = OrderedDict()
+            for sessionID, input_ in itertools.islice(inputs, batchSize):
+                batch.setdefault(sessionID, deque()).append(input_)
+            if not batch:
+                return
+            # the sentences of the batch normalized so far
+            memo = {}
+            while batch:
+                round_ = sorted(((queue.popleft(), sessionID)
+                                 for sessionID, queue in batch.items()),
+                                key=lambda pair: pair[0])
+                for input_, sessionID in round_:
+                    if not batch[sessionID]:
+                        del batch[sessionID]
+                    yield sessionID, input_, self._respondInput(input_, sessionID, memo)
+
+    def _respondForked(self, inputs, batchSize, processes):
+        """respondMany() with worker processes."""
+        context = multiprocessing.get_context('fork') \
+            if hasattr(multiprocessing, 'get_context') else multiprocessing
+        outbox = context.Queue()
+        workers = []
+        for i in range(processes):
+            inbox = context.Queue(4)
+            worker = context.Process(target=self._respondWorker,
+                                     args=(inbox, outbox, batchSize))
+            worker.daemon = True
+            worker.start()
+            workers.append((worker, inbox))
+        # the inputs of a session always go to the same worker
+        workerOf = {}
+        chunks = [[] for i in range(processes)]
+        running = processes
+        try:
+            for sessionID, input_ in inputs:
+                try:
+                    i = workerOf[sessionID]
+                except KeyError:
+                    i = workerOf[sessionID] = len(workerOf) % processes
+                chunks[i].append((sessionID, input_))
+                if len(chunks[i]) >= batchSize:
+                    workers[i][1].put(chunks[i])
+                    chunks[i] = []
+                    # meanwhile, pass on what the workers have answered
+                    while True:
+                        try:
+                            message = outbox.get_nowait()
+                        except Empty:
+                            break
+                        for result in self._workerMessage(message):
+                            yield result
+            for (worker, inbox), chunk in zip(workers, chunks):
+                if chunk:
+                    inbox.put(chunk)
+                inbox.put(None)
+            while running:
+                try:
+                    message = outbox.get(timeout=1)
+                except Empty:
+                    if any(worker.exitcode for worker, inbox in workers):
+                        raise RuntimeError("respondMany() worker died")
+                    continue
+                if message[0] == 'done':
+                    running -= 1
+                for result in self._workerMessage(message):
+                    yield result
+        finally:
+            for worker, inbox in workers:
+                if running:
+                    worker.terminate()
+                worker.join()
+
+    def _workerMessage(self, message):
+        """Handle a message of a respondMany() worker process, returning
+        the responses it holds."""
+        kind, data = message
+        if kind == 'responses':
+            return data
+        if kind == 'error':
+            raise RuntimeError("respondMany() worker failed:\n" + data)
+        # 'done': the sessions the worker answered
+        for sessionID, session in data.items():
+            if session is None:
+                # the worker's store forgot it: so does this one
+                self._sessions.delete(sessionID)
+                self._sessionEvicted(sessionID)
+                continue
+            self._sessions.add(sessionID, session)
+            self._sessionEvicted(sessionID)
+            self._sessionChanged(sessionID)
+        return ()
+
+    def _respondWorker(self, inbox, outbox, batchSize):
+        """The main loop of a respondMany() worker process."""
+        sessionIDs = set()
+        try:
+            for chunk in iter(inbox.get, None):
+                sessionIDs.update(sessionID for sessionID, input_ in chunk)
+                outbox.put(('responses', list(self._respondBatches(chunk, batchSize))))
+            outbox.put(('done', dict((sessionID, self._sessions.peek(sessionID))
+                                     for sessionID in sessionIDs)))
+        except Exception:
+            outbox.put(('error', traceback.format_exc()))
 
 
     # This version of _respond() just fetches the response for some input.
     # It does not mess with the input and output histories.  Recursive calls
     # to respond() spawned from tags like <srai> should call this function
     # instead of respond().
-    def _respond(self, input_, sessionID):
-        """Private version of respond(), does the real work."""
+    def _respond(self, input_, sessionID, memo=None):
+        """Private version of respond(), does the real work.  memo, if not
+        None, is a dictionary of the normalized inputs, keyed by input."""
         if len(input_) == 0:
             return u""
 
@@ -412,6 +1234,9 @@ class Kernel:
             if self._verboseMode:
                 err = u"WARNING: maximum recursion depth exceeded (input='%s')" % self._cod.enc(input_)
                 sys.stderr.write(err)
+            records = self._sraiRecords[sessionID]
+            if records:
+                records[-1].cacheable = False
             return u""
 
         # push the input onto the input stack
@@ -419,32 +1244,40 @@ class Kernel:
         inputStack.append(input_)
         self.setPredicate(self._inputStack, inputStack, sessionID)
 
-        # run the input through the 'normal' subber
-        subbedInput = self._subbers['normal'].sub(input_)
+        # run the input through the 'normal' subber and normalize it for
+        # the pattern matcher (once per batch of respondMany()).
+        if memo is None:
+            subbedInput = self._brain.normalize(self._subbers['normal'].sub(input_))
+        else:
+            try:
+                subbedInput = memo[input_]
+            except KeyError:
+                subbedInput = memo[input_] = self._brain.normalize(self._subbers['normal'].sub(input_))
 
         # fetch the bot's previous response, to pass to the match()
         # function as 'that'.
         outputHistory = self.getPredicate(self._outputHistory, sessionID)
         try: that = outputHistory[-1]
         except IndexError: that = ""
-        subbedThat = self._subbers['normal'].sub(that)
+        subbedThat = self._normalizedPredicate(sessionID, "that", that,
+                                               self._brain._DUMMY_THAT)
 
         # fetch the current topic
         topic = self.getPredicate("topic", sessionID)
-        subbedTopic = self._subbers['normal'].sub(topic)
-
-        # Determine the final response.
-        response = u""
-        elem = self._brain.match(subbedInput, subbedThat, subbedTopic)
-        if elem is None:
-            if self._verboseMode:
-                err = "WARNING: No match found for input: %s\n" % self._cod.enc(input_)
-                sys.stderr.write(err)
+        subbedTopic = self._normalizedPredicate(sessionID, "topic", topic,
+                                                self._brain._DUMMY_TOPIC)
+
+        # Determine the final response; the input sentence, or the input
+        # of a <srai> element (the input stack holds the original input
+        # too), may have been seen before.
+        srai = len(inputStack) > 1
+        cache = self._sraiCache if srai else self._responseCache
+        if cache is not None:
+            response = self._cachedResponse(cache, not srai, input_, subbedInput,
+                                            subbedThat, subbedTopic, sessionID)
         else:
-            # Process the element into a response string.
-            response += self._processElement(elem, sessionID).strip()
-            response += u" "
-        response = response.strip()
+            response = self._matchResponse(input_, subbedInput, subbedThat,
+                                           subbedTopic, sessionID)
 
         # pop the top entry off the input stack.
         inputStack = self.getPredicate(self._inputStack, sessionID)
@@ -453,6 +1286,147 @@ class Kernel:
 
         return response
 
+    def _matchResponse(self, input_, subbedInput, subbedThat, subbedTopic, sessionID):
+        """Return the response of the template matching the normalized
+        input, 'that' and topic."""
+        response = u""
+        context = self._brain.matchContext(subbedInput, subbedThat, subbedTopic)
+        # the match context is kept on the stack for the star-like
+        # elements of the template.
+        matchStack = self._matchStack[sessionID]
+        matchStack.append(context)
+        records = self._sraiRecords[sessionID]
+        if records:
+            record = records[-1]
+            if record.match is None:
+                record.match = context
+            elif record.cacheable and not record.context:
+                # the input of a <srai> that is not cached on its own
+                record.context = self._brain.dependsOnContext(subbedInput, context)
+        try:
+            if context is None:
+                if self._verboseMode:
+                    err = "WARNING: No match found for input: %s\n" % self._cod.enc(input_)
+                    sys.stderr.write(err)
+            else:
+                if context.exhausted:
+                    # the fallback template: whether a match runs out of
+                    # time varies
+                    if records:
+                        records[-1].cacheable = False
+                    if self._verboseMode:
+                        err = "WARNING: Match budget exceeded for input: %s\n" % self._cod.enc(input_)
+                        sys.stderr.write(err)
+                if records:
+                    info = self._analyzer.analyze(context.template)
+                    if info.cacheable():
+                        records[-1].merge(info.predicates, info.context, True, 0)
+                    else:
+                        records[-1].cacheable = False
+                # Process the element into a response string.
+                if self._compiler is not None:
+                    response += self._compiler.render(context.template, sessionID).strip()
+                else:
+                    response += self._processElement(context.template, sessionID).strip()
+                response += u" "
+        finally:
+            matchStack.pop()
+        return response.strip()
+
+    def _cachedResponse(self, cache, pureOnly, input_, subbedInput, subbedThat,
+                        subbedTopic, sessionID):
+        """_matchResponse() through cache, the srai or the response cache
+        (see setSraiCacheSize()).  If pureOnly is true, results depending
+        on predicates are not cached."""
+        session = self._sessions[sessionID]
+        records = self._sraiRecords[sessionID]
+        depth = len(session[self._inputStack])
+        # whether 'that' and the topic are empty may always matter
+        key = (subbedInput.text, len(subbedThat.words) > 0, len(subbedTopic.words) > 0)
+        context = (subbedThat.text, subbedTopic.text)
+        # The results are stored under the values of the predicates they
+        # read (and the context, if it made a difference): the entry of
+        # the input itself tells which ones, as of the last result, and
+        # inputs without one read none.  The same values lead to the same
+        # templates.
+        index = cache.get(key, count=False)
+        names, byContext = index if index is not None else ((), False)
+        def valid(entry):
+            # the same template must be chosen, and the recursion limit
+            # not be reached
+            response, template, height = entry
+            return (depth + height <= self._maxRecursionDepth + 1 and
+                    (template is _ANY_TEMPLATE or
+                     self._brain.match(subbedInput, subbedThat, subbedTopic) is template))
+        entry = cache.get((key, names, tuple(session.get(name, "") for name in names),
+                           context if byContext else None), valid=valid)
+        if entry is not None:
+            response, template, height = entry
+            if records:
+                records[-1].merge(names, byContext or template is not _ANY_TEMPLATE,
+                                  True, depth + height)
+            return response
+
+        record = _SraiRecord(depth)
+        records.append(record)
+        try:
+            response = self._matchResponse(input_, subbedInput, subbedThat,
+                                           subbedTopic, sessionID)
+        finally:
+            records.pop()
+        cacheable = record.cacheable and not (pureOnly and record.names)
+        if cacheable:
+            # If only the choice of the template depends on 'that' and the
+            # topic, the result is reused as long as the same template
+            # gets chosen; otherwise, only in the same context.
+            template = _ANY_TEMPLATE
+            if not record.context and self._brain.dependsOnContext(subbedInput, record.match):
+                template = record.match.template if record.match is not None else None
+            # nothing was set: the predicates have kept their values
+            names = tuple(sorted(record.names))
+            if names or record.context:
+                cache.put(key, (names, record.context))
+            elif index is not None:
+                cache.discard(key)
+            cache.put((key, names, tuple(session.get(name, "") for name in names),
+                       context if record.context else None),
+                      (response, template, record.depth - depth))
+            record.context = record.context or template is not _ANY_TEMPLATE
+        if records:
+            records[-1].merge(record.names, record.context, record.cacheable, record.depth)
+        return response
+
+    def _isBuiltinProcessor(self, tag):
+        """Is the processor of tag elements the Kernel's own?"""
+        handler = self._elementProcessors.get(tag)
+        func = getattr(handler, '__func__', None)
+        if func is None or getattr(handler, '__self__', None) is not self:
+            return False
+        builtin = getattr(Kernel, "_process" + tag.capitalize(), None)
+        return func is getattr(builtin, '__func__', builtin)
+
+    def _normalizedPredicate(self, sessionID, name, text, default):
+        """Return the normalized form of text, the current value of the
+        session's 'that' or topic (selected by name).  It is cached
+        until the value changes."""
+        cache = self._normalized[sessionID]
+        try:
+            cachedText, normalized = cache[name]
+            if cachedText == text:
+                return normalized
+        except KeyError:
+            pass
+        normalized = self._brain.normalize(self._subbers['normal'].sub(text), default)
+        cache[name] = (text, normalized)
+        return normalized
+
+    def _starMatch(self, starType, elem, sessionID):
+        """Return the text matched by a wildcard of the current pattern,
+        for the <star>, <thatstar> and <topicstar> elements."""
+        try: index = int(elem[1]['index'])
+        except KeyError: index = 1
+        return self._matchStack[sessionID][-1].star(starType, index)
+
     def _processElement(self, elem, sessionID):
         """Process an AIML element.
 
@@ -771,7 +1745,7 @@ class Kernel:
         for e in elem[2:]:
             response += self._processElement(e, sessionID)
         if len(elem[2:]) == 0:  # atomic <person/> = <person><star/></person>
-            response = self._processElement(['star', {}], sessionID)
+            response = self._matchStack[sessionID][-1].star('star', 1)
         return self._subbers['person'].sub(response)
 
     # <person2>
@@ -791,7 +1765,7 @@ class Kernel:
         for e in elem[2:]:
             response += self._processElement(e, sessionID)
         if len(elem[2:]) == 0:  # atomic <person2/> = <person2><star/></person2>
-            response = self._processElement(['star', {}], sessionID)
+            response = self._matchStack[sessionID][-1].star('star', 1)
         return self._subbers['person2'].sub(response)
 
     # <random>
@@ -873,7 +1847,7 @@ class Kernel:
         <sr> elements are shortcuts for <srai><star/></srai>.
 
         """
-        star = self._processElement(['star', {}], sessionID)
+        star = self._matchStack[sessionID][-1].star('star', 1)
         response = self._respond(star, sessionID)
         return response
 
@@ -907,18 +1881,7 @@ class Kernel:
         would evaluate to "Tom Smith".
 
         """
-        try: index = int(elem[1]['index'])
-        except KeyError: index = 1
-        # fetch the user's last input
-        inputStack = self.getPredicate(self._inputStack, sessionID)
-        input_ = self._subbers['normal'].sub(inputStack[-1])
-        # fetch the Kernel's last response (for 'that' context)
-        outputHistory = self.getPredicate(self._outputHistory, sessionID)
-        try: that = self._subbers['normal'].sub(outputHistory[-1])
-        except: that = ""  # there might not be any output yet
-        topic = self.getPredicate("topic", sessionID)
-        response = self._brain.star("star", input_, that, topic, index)
-        return response
+        return self._starMatch("star", elem, sessionID)
 
     # <system>
     def _processSystem(self, elem, sessionID):
@@ -938,7 +1901,23 @@ class Kernel:
         command = ""
         for e in elem[2:]:
             command += self._processElement(e, sessionID)
+        return self._runSystem(command)
+
+    def _runSystem(self, command):
+        """Execute command, as built by a <system> element, and return
+        its output joined into a single line."""
+        command = self._systemCommand(command)
 
+        # execute the command.
+        try:
+            out = os.popen(command)
+        except RuntimeError as msg:
+            return self._systemError("RuntimeError", msg)
+        time.sleep(0.01) # I'm told this works around a potential IOError exception.
+        return self._systemOutput(out)
+
+    def _systemCommand(self, command):
+        """Return the shell command to run for a <system> element."""
         # normalize the path to the command.  Under Windows, this
         # switches forward-slashes to back-slashes; all system
         # elements should use unix-style paths for cross-platform
@@ -946,23 +1925,25 @@ class Kernel:
         #executable,args = command.split(" ", 1)
         #executable = os.path.normpath(executable)
         #command = executable + " " + args
-        command = os.path.normpath(command)
+        return os.path.normpath(command)
 
-        # execute the command.
+    def _systemOutput(self, lines):
+        """Return the output of a <system> command, read as lines, joined
+        into a single line."""
         response = ""
-        try:
-            out = os.popen(command)
-        except RuntimeError as msg:
-            if self._verboseMode:
-                err = "WARNING: RuntimeError while processing \"system\" element:\n%s\n" % self._cod.enc(msg)
-                sys.stderr.write(err)
-            return "There was an error while computing my response.  Please inform my botmaster."
-        time.sleep(0.01) # I'm told this works around a potential IOError exception.
-        for line in out:
+        for line in lines:
             response += line + "\n"
         response = ' '.join(response.splitlines()).strip()
         return response
 
+    def _systemError(self, error, msg):
+        """Return the response of a <system> element whose command
+        failed with error."""
+        if self._verboseMode:
+            err = "WARNING: %s while processing \"system\" element:\n%s\n" % (error, self._cod.enc(msg))
+            sys.stderr.write(err)
+        return "There was an error while computing my response.  Please inform my botmaster."
+
     # <template>
     def _processTemplate(self, elem, sessionID):
         """Process a <template> AIML element.
@@ -1047,18 +2028,7 @@ class Kernel:
         "*" in the current category's <that> pattern.
 
         """
-        try: index = int(elem[1]['index'])
-        except KeyError: index = 1
-        # fetch the user's last input
-        inputStack = self.getPredicate(self._inputStack, sessionID)
-        input_ = self._subbers['normal'].sub(inputStack[-1])
-        # fetch the Kernel's last response (for 'that' context)
-        outputHistory = self.getPredicate(self._outputHistory, sessionID)
-        try: that = self._subbers['normal'].sub(outputHistory[-1])
-        except Exception: that = ""  # there might not be any output yet
-        topic = self.getPredicate("topic", sessionID)
-        response = self._brain.star("thatstar", input_, that, topic, index)
-        return response
+        return self._starMatch("thatstar", elem, sessionID)
 
     # <think>
     def _processThink(self, elem, sessionID):
@@ -1088,18 +2058,7 @@ class Kernel:
         by a "*" in the current category's <topic> pattern.
 
         """
-        try: index = int(elem[1]['index'])
-        except KeyError: index = 1
-        # fetch the user's last input
-        inputStack = self.getPredicate(self._inputStack, sessionID)
-        input_ = self._subbers['normal'].sub(inputStack[-1])
-        # fetch the Kernel's last response (for 'that' context)
-        outputHistory = self.getPredicate(self._outputHistory, sessionID)
-        try: that = self._subbers['normal'].sub(outputHistory[-1])
-        except Exception: that = ""  # there might not be any output yet
-        topic = self.getPredicate("topic", sessionID)
-        response = self._brain.star("topicstar", input_, that, topic, index)
-        return response
+        return self._starMatch("topicstar", elem, sessionID)
 
     # <uppercase>
     def _processUppercase(self, elem, sessionID):
@@ -0,0 +1,101 @@
+"""
+A small bounded mapping that forgets its least recently used entries,
+used by the Kernel's response caches.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache(object):
+    """A mapping of at most maxSize entries.  get() and put() make an
+    entry the most recently used one; when the cache is full, put()
+    evicts the least recently used entry.  If ttl is given, entries also
+    expire ttl seconds after they were put().
+
+    The hits and misses attributes count the calls to get() that found,
+    or did not find, their key.  Instances may be shared by threads.
+    """
+
+    def __init__(self, maxSize, ttl=None):
+        if maxSize < 1:
+            raise ValueError("maxSize must be positive")
+        if ttl is not None and ttl <= 0:
+            raise ValueError("ttl must be positive")
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # key -> (value, expiry time or None)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None, valid=None, count=True):
+        """Return the value stored for key, or default.  If a function
+        valid is given, a value for which it returns false is not
+        returned (and the call counts as a miss), but kept for the calls
+        it suits; expired values are discarded.  If count is false, the
+        call is not counted, e.g. a lookup of an index leading to the
+        entry that counts."""
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+        if entry is not _MISSING:
+            # (valid may take a while: the lock is not held meanwhile)
+            value, expiry = entry
+            if expiry is not None and time.time() >= expiry:
+                with self._lock:
+                    if self._entries.get(key) is entry:
+                        del self._entries[key]
+            elif valid is None or valid(value):
+                with self._lock:
+                    # make it the most recently used, unless it was
+                    # replaced or evicted meanwhile
+                    if self._entries.get(key) is entry:
+                        del self._entries[key]
+                        self._entries[key] = entry
+                    if count:
+                        self.hits += 1
+                return value
+        if count:
+            with self._lock:
+                self.misses += 1
+        return default
+
+    def put(self, key, value):
+        """Store value for key, evicting the least recently used entry if
+        the cache is full."""
+        expiry = None if self.ttl is None else time.time() + self.ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expiry)
+            self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.maxSize:
+            self._entries.popitem(last=False)
+
+    def discard(self, key):
+        """Remove the entry for key, if any."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove every entry.  The counters are kept."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return a dictionary of the size, limits and counters of the
+        cache."""
+        with self._lock:
+            return {'size': len(self._entries), 'maxSize': self.maxSize,
+                    'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses}
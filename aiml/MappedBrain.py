@@ -0,0 +1,316 @@
+'''
+A brain file format that can be memory-mapped and walked in place.
+
+Brains saved by PatternMgr.save() are a marshal dump of the whole pattern
+tree, which has to be turned back into Python objects before the first
+response can be computed.  A mapped brain instead lays the tree out as
+flat tables that PatternMgr reads straight from an mmap, so loading one
+takes a few milliseconds and its pages are shared by every process that
+maps the same file.  Only the templates that are actually used get
+unmarshalled.
+
+File layout (all integers little-endian):
+
+  header       magic, format version, counts and section offsets
+  nodes        one fixed-size record per node: the start and length of
+               its run in the child table, the indices of its underscore,
+               star, bot name, that and topic children, the index of its
+               template (-1 when absent), and its minWords and maxWords
+  children     (word ID, node index) pairs, sorted by word ID within each
+               node's run so they can be binary-searched
+  word index   offsets of each word in the word pool
+  word pool    the UTF-8 encoded pattern words, sorted, so that a word's
+               ID is its rank and lookups are a binary search as well
+  template
+    index      offsets of each template in the template pool
+  template
+    pool       one marshal dump per template
+  metadata     a marshal dump of a dictionary (bot name, and the
+               metadata given to PatternMgr.saveMapped())
+'''
+
+from __future__ import print_function
+
+import marshal
+import mmap
+import struct
+
+from .Utils import canonicalCopier
+
+MAGIC = b"AIMLMAP\0"
+FORMAT_VERSION = 2
+
+_HEADER = struct.Struct("<8sIIIIIIQQQQQQQQ")
+_NODE = struct.Struct("<IIiiiiiiii")
+_CHILD = struct.Struct("<II")
+_OFFSET32 = struct.Struct("<I")
+_OFFSET64 = struct.Struct("<Q")
+
+
+def isMappedBrain(filename):
+    """Return True if filename is a brain in the mapped format."""
+    with open(filename, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write(patternMgr, filename, metadata=None):
+    """Save the pattern tree of patternMgr to filename in the mapped
+    format, with the optional metadata dictionary.  The same patterns and
+    metadata, learned in the same order, make the same file."""
+    vocabulary = patternMgr._vocabulary
+    # Lay the nodes out breadth-first, so that siblings end up together.
+    # Word edges are kept as words until every word has been seen and the
+    # word IDs (their rank in the sorted pool) are known.
+    nodes = [patternMgr._root]
+    records = []
+    templates = []
+    # templates are dumped the same however they were learned
+    copy = canonicalCopier()
+    words = set()
+    i = 0
+    while i < len(nodes):
+        node = nodes[i]
+        i += 1
+        kids = []
+        if node.children is not None:
+            for wordId, child in node.children.items():
+                word = vocabulary.word(wordId).encode("utf-8")
+                words.add(word)
+                kids.append((word, len(nodes)))
+                nodes.append(child)
+        fields = []
+        for child in (node.underscore, node.star, node.botName, node.that, node.topic):
+            if child is None:
+                fields.append(-1)
+            else:
+                fields.append(len(nodes))
+                nodes.append(child)
+        if node.template is None:
+            fields.append(-1)
+        else:
+            fields.append(len(templates))
+            templates.append(marshal.dumps(copy(node.template)))
+        fields += [node.minWords, node.maxWords]
+        records.append((kids, fields))
+
+    words = sorted(words)
+    wordIds = dict((w, n) for n, w in enumerate(words))
+
+    nodeData = bytearray()
+    childData = bytearray()
+    childCount = 0
+    for kids, fields in records:
+        kids = sorted((wordIds[w], index) for w, index in kids)
+        nodeData += _NODE.pack(childCount, len(kids), *fields)
+        for wordId, index in kids:
+            childData += _CHILD.pack(wordId, index)
+        childCount += len(kids)
+
+    def pool(items, offsetStruct):
+        index, data = bytearray(), bytearray()
+        for item in items:
+            index += offsetStruct.pack(len(data))
+            data += item
+        index += offsetStruct.pack(len(data))
+        return index, data
+
+    wordIndex, wordData = pool(words, _OFFSET32)
+    templateIndex, templateData = pool(templates, _OFFSET64)
+    meta = dict(metadata or {})
+    meta[u"botName"] = patternMgr._botName
+    meta = marshal.dumps(copy(meta))
+
+    sections = [nodeData, childData, wordIndex, wordData, templateIndex,
+                templateData, meta]
+    offsets = []
+    position = _HEADER.size
+    for section in sections:
+        offsets.append(position)
+        position += len(section)
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, patternMgr.numTemplates(),
+                          len(records), childCount, len(words), len(templates),
+                          *(offsets + [len(meta)]))
+    with open(filename, "wb") as outFile:
+        outFile.write(header)
+        for section in sections:
+            outFile.write(section)
+
+
+def convert(brainFile, mappedFile):
+    """Convert a brain saved by PatternMgr.save() to the mapped format."""
+    from .PatternMgr import PatternMgr
+    patternMgr = PatternMgr()
+    metadata = patternMgr.restore(brainFile)
+    write(patternMgr, mappedFile, metadata)
+
+
+class MappedBrain(object):
+    """A read-only view of a mapped brain file.
+
+    'root' and 'vocabulary' behave like PatternMgr's in-memory node tree
+    and vocabulary, so the matchers can walk either one.
+    """
+
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.templateCount, self._nodeCount, childCount,
+         wordCount, templateTableCount, self._nodesOffset, self._childrenOffset,
+         self._wordIndexOffset, self._wordDataOffset, self._templateIndexOffset,
+         self._templateDataOffset, metaOffset, metaLength) = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError("%s is not a mapped brain file" % filename)
+        if version != FORMAT_VERSION:
+            raise ValueError("%s has unsupported mapped brain version %d" % (filename, version))
+        meta = marshal.loads(self._map[metaOffset:metaOffset + metaLength])
+        self.botName = meta.pop(u"botName")
+        self.metadata = meta
+        self.vocabulary = _MappedVocabulary(self, wordCount)
+        self.root = self.node(0)
+        # Templates are unmarshalled the first time they are needed, and
+        # kept so that each one is always the same object.
+        self._templates = {}
+
+    def close(self):
+        """Unmap the brain file."""
+        self._map.close()
+
+    def node(self, index):
+        """Return a view of the node with the given index."""
+        return _MappedNode(self, index, _NODE.unpack_from(self._map, self._nodesOffset + index * _NODE.size))
+
+    def template(self, index):
+        """Return the template with the given index."""
+        try:
+            return self._templates[index]
+        except KeyError:
+            start, = _OFFSET64.unpack_from(self._map, self._templateIndexOffset + 8 * index)
+            end, = _OFFSET64.unpack_from(self._map, self._templateIndexOffset + 8 * index + 8)
+            base = self._templateDataOffset
+            template = self._templates[index] = marshal.loads(self._map[base + start:base + end])
+            return template
+
+
+class _MappedNode(object):
+    """A node of a mapped brain, with the same attributes as
+    PatternMgr's in-memory nodes.  Each lookup makes a new view, so views
+    of the same node compare (and hash) equal."""
+    __slots__ = ('_brain', '_index', '_record')
+
+    def __init__(self, brain, index, record):
+        self._brain = brain
+        self._index = index
+        self._record = record
+
+    def __eq__(self, other):
+        return (isinstance(other, _MappedNode) and self._index == other._index
+                and self._brain is other._brain)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return self._index
+
+    def _child(self, field):
+        index = self._record[field]
+        return None if index < 0 else self._brain.node(index)
+
+    @property
+    def children(self):
+        start, count = self._record[0], self._record[1]
+        return None if count == 0 else _MappedChildren(self._brain, start, count)
+
+    underscore = property(lambda self: self._child(2))
+    star = property(lambda self: self._child(3))
+    botName = property(lambda self: self._child(4))
+    that = property(lambda self: self._child(5))
+    topic = property(lambda self: self._child(6))
+
+    @property
+    def template(self):
+        index = self._record[7]
+        return None if index < 0 else self._brain.template(index)
+
+    minWords = property(lambda self: self._record[8])
+    maxWords = property(lambda self: self._record[9])
+
+
+class _MappedChildren(object):
+    """The word edges of a mapped node, looked up by binary search."""
+    __slots__ = ('_brain', '_start', '_count')
+
+    def __init__(self, brain, start, count):
+        self._brain = brain
+        self._start = start
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def _entry(self, i):
+        brain = self._brain
+        return _CHILD.unpack_from(brain._map, brain._childrenOffset + (self._start + i) * _CHILD.size)
+
+    def get(self, wordId, default=None):
+        if wordId is None:
+            return default
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entryId, index = self._entry(mid)
+            if entryId < wordId:
+                lo = mid + 1
+            elif entryId > wordId:
+                hi = mid
+            else:
+                return self._brain.node(index)
+        return default
+
+    def __contains__(self, wordId):
+        return self.get(wordId) is not None
+
+    def keys(self):
+        return [self._entry(i)[0] for i in range(self._count)]
+
+    def items(self):
+        for i in range(self._count):
+            wordId, index = self._entry(i)
+            yield wordId, self._brain.node(index)
+
+
+class _MappedVocabulary(object):
+    """The word pool of a mapped brain."""
+    __slots__ = ('_brain', '_count')
+
+    def __init__(self, brain, count):
+        self._brain = brain
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def _bytes(self, wordId):
+        brain = self._brain
+        start, = _OFFSET32.unpack_from(brain._map, brain._wordIndexOffset + 4 * wordId)
+        end, = _OFFSET32.unpack_from(brain._map, brain._wordIndexOffset + 4 * wordId + 4)
+        return brain._map[brain._wordDataOffset + start:brain._wordDataOffset + end]
+
+    def get(self, word, default=None):
+        """Return the ID of word, or default if no pattern uses it."""
+        target = word.encode("utf-8")
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            current = self._bytes(mid)
+            if current < target:
+                lo = mid + 1
+            elif current > target:
+                hi = mid
+            else:
+                return mid
+        return default
+
+    def word(self, wordId):
+        """Return the word with the given ID."""
+        return self._bytes(wordId).decode("utf-8")
@@ -9,24 +9,251 @@ from __future__ import print_function
 import marshal
 import pprint
 import re
-import string
-import sys
+import time
 
 from .constants import *
+from . import MappedBrain
+from .Utils import canonicalCopier
+
+
+# the maxWords of a node from which a wildcard can be reached
+_UNBOUNDED = 0x7fffffff
+
+
+class _Node(object):
+    """A node of the pattern tree.
+
+    Edges for ordinary words live in the 'children' dictionary, keyed by
+    the integer ID the word was given by the _Vocabulary (the dictionary
+    is None until the node gets its first word edge).  Wildcards, the
+    bot name, the <that> and <topic> subtrees and the template each have
+    a field of their own.
+
+    minWords and maxWords bound the number of words of its segment (the
+    input, 'that' or topic) the paths below the node can take before they
+    get to the end of the segment: a template, or the <that> or <topic>
+    subtree.  A wildcard takes one word or more, so maxWords is
+    _UNBOUNDED below one.  The matchers skip the nodes that cannot take
+    the words left.
+    """
+    __slots__ = ('children', 'underscore', 'star', 'botName', 'that',
+                 'topic', 'template', 'minWords', 'maxWords')
+
+    def __init__(self):
+        self.children = None
+        self.underscore = None
+        self.star = None
+        self.botName = None
+        self.that = None
+        self.topic = None
+        self.template = None
+        # no paths yet
+        self.minWords = _UNBOUNDED
+        self.maxWords = 0
+
+    def widen(self, child, wildcard):
+        """Widen the bounds of the node to take in the paths through
+        child, reached by a word, or by a wildcard if wildcard is true."""
+        if child.minWords + 1 < self.minWords:
+            self.minWords = child.minWords + 1
+        if wildcard or child.maxWords == _UNBOUNDED:
+            self.maxWords = _UNBOUNDED
+        elif child.maxWords + 1 > self.maxWords:
+            self.maxWords = child.maxWords + 1
+
+
+class _Vocabulary(object):
+    """Interns the words that appear in patterns as small integers."""
+    __slots__ = ('_ids', '_words')
+
+    def __init__(self):
+        self._ids = {}
+        self._words = []
+
+    def __len__(self):
+        return len(self._words)
+
+    def get(self, word, default=None):
+        """Return the ID of word, or default if no pattern uses it."""
+        return self._ids.get(word, default)
+
+    def intern(self, word):
+        """Return the ID of word, allocating a new one if needed."""
+        try:
+            return self._ids[word]
+        except KeyError:
+            wordId = self._ids[word] = len(self._words)
+            self._words.append(word)
+            return wordId
+
+    def word(self, wordId):
+        """Return the word with the given ID."""
+        return self._words[wordId]
+
+
+class Normalized(object):
+    """A piece of text (an input sentence, 'that' or the topic) in the
+    form the pattern matcher works with.
+
+    'words' holds the upper-cased tokens left once punctuation has been
+    removed, 'original' the whitespace-separated words of the text as it
+    was given, and origins[i] the index in 'original' of the word that
+    token i came from, so that the words matched by a wildcard can be
+    handed back untouched.  Instances are built by PatternMgr.normalize()
+    and are never modified, so they may be shared and reused freely.
+    """
+    __slots__ = ('text', 'words', 'origins', 'original')
+
+    def __init__(self, text, words, origins, original):
+        self.text = text
+        self.words = words
+        self.origins = origins
+        self.original = original
+
+    def originalWords(self, start, end):
+        """Return the original text of tokens start to end (inclusive)."""
+        if end >= len(self.words):
+            end = len(self.words) - 1
+        if start > end:
+            return u""
+        return u" ".join(self.original[self.origins[start]:self.origins[end]+1])
+
+
+class MatchContext(object):
+    """The outcome of a successful match: the template, the Normalized
+    input, 'that' and topic it was matched against, and the path through
+    the pattern tree that led to the template.
+
+    stars maps 'star', 'thatstar' and 'topicstar' to a list of
+    (start, end) token offsets, one per wildcard of the pattern, its
+    <that> and its <topic>, end being exclusive.  It is worked out from
+    the path the first time it is needed (most templates never ask), so
+    that <star/> and friends are then simple lookups.
+
+    exhausted is true if the match ran out of its budget (see
+    PatternMgr.setMatchBudget()): the template is then the fallback one,
+    and the path is empty.
+    """
+    __slots__ = ('template', 'input', 'that', 'topic', 'path', 'exhausted',
+                 '_captures', '_stars')
+
+    def __init__(self, template, input_, that, topic, path, captures, exhausted=False):
+        self.template = template
+        self.input = input_
+        self.that = that
+        self.topic = topic
+        self.path = path
+        self.exhausted = exhausted
+        self._captures = captures
+        self._stars = None
+
+    @property
+    def stars(self):
+        if self._stars is None:
+            self._stars = self._captures(self.path, self.input.words,
+                                         self.that.words, self.topic.words)
+        return self._stars
+
+    def star(self, starType, index):
+        """Return the original text matched by the index'th (starting at
+        1) wildcard of the given type, or the empty string if there is no
+        such wildcard."""
+        try:
+            spans = self.stars[starType]
+        except KeyError:
+            raise ValueError( "starType must be in ['star', 'thatstar', 'topicstar']" )
+        if index < 1 or index > len(spans):
+            return u""
+        source = self.input if starType == 'star' else self.that if starType == 'thatstar' else self.topic
+        start, end = spans[index-1]
+        return source.originalWords(start, end - 1)
+
+
+class MatchBudgetExceeded(Exception):
+    """Raised by the matchers when a match visits more nodes, or takes
+    longer, than its MatchBudget allows."""
+    pass
+
+
+class MatchBudget(object):
+    """Counts the nodes a match visits and the times it backtracks (gives
+    up a node whose every alternative failed), and stops the match by
+    raising MatchBudgetExceeded once it has visited more than maxVisits
+    nodes or run for more than maxSeconds, when those are given.  The
+    clock is only read every 256 visits.
+    """
+    __slots__ = ('visits', 'backtracks', 'maxVisits', 'deadline')
+
+    def __init__(self, maxVisits=None, maxSeconds=None):
+        self.visits = 0
+        self.backtracks = 0
+        self.maxVisits = maxVisits
+        self.deadline = None if maxSeconds is None else time.time() + maxSeconds
+
+    def visit(self):
+        self.visits += 1
+        if self.maxVisits is not None and self.visits > self.maxVisits:
+            raise MatchBudgetExceeded("more than %d nodes visited" % self.maxVisits)
+        if self.deadline is not None and self.visits & 255 == 0 and time.time() > self.deadline:
+            raise MatchBudgetExceeded("out of time after %d nodes visited" % self.visits)
+
+
+class MatchProfile(object):
+    """What PatternMgr.profile() found out about a match: the number of
+    nodes visited and of backtracks, the time taken, whether the budget
+    ran out, and the pattern, 'that' and topic of the matched category
+    (wildcards rendered as "*" and "_"; None if nothing matched), and
+    its template.
+    """
+    __slots__ = ('visits', 'backtracks', 'seconds', 'exhausted', 'pattern', 'template')
+
+    def __init__(self, visits, backtracks, seconds, exhausted, pattern, template):
+        self.visits = visits
+        self.backtracks = backtracks
+        self.seconds = seconds
+        self.exhausted = exhausted
+        self.pattern = pattern
+        self.template = template
+
+    def __repr__(self):
+        return "<MatchProfile %d visits, %d backtracks, %.6f s%s: %r>" % (
+            self.visits, self.backtracks, self.seconds,
+            " (exhausted)" if self.exhausted else "", self.pattern)
+
 
 class PatternMgr:
-    # special dictionary keys
+    # special dictionary keys, used in saved brains and in matched paths
     _UNDERSCORE = 0
     _STAR       = 1
     _TEMPLATE   = 2
     _THAT       = 3
     _TOPIC      = 4
     _BOT_NAME   = 5
+    # the (minWords, maxWords) of a node, in saved brains only
+    _BOUNDS     = 6
+
+    # stand-ins for an empty 'that' or topic, which must never be empty
+    _DUMMY_THAT  = u"ULTRABOGUSDUMMYTHAT"
+    _DUMMY_TOPIC = u"ULTRABOGUSDUMMYTOPIC"
+
+    # names of the available match engines, see setMatchEngine()
+    _ENGINES = ('recursive', 'iterative', 'memoized')
     
     def __init__(self):
-        self._root = {}
+        self._root = _Node()
+        self._vocabulary = _Vocabulary()
+        # the MappedBrain the tree is read from, if it was restoreMapped()
+        self._mapped = None
+        # the input patterns of the categories with a 'that' or topic
+        # pattern, see dependsOnContext()
+        self._contextual = None
         self._templateCount = 0
         self._botName = u"Nameless"
+        self._matcher = self._match
+        # the budget of each match, see setMatchBudget()
+        self._maxVisits = None
+        self._maxSeconds = None
+        self._fallback = None
         punctuation = r"""`~!@#$%^&*()-_=+[{]}\|;:'",<.>/?"""
         self._puncStripRE = re.compile("[" + re.escape(punctuation) + "]")
         self._whitespaceRE = re.compile(r"\s+", re.UNICODE)
@@ -42,119 +269,498 @@ class PatternMgr:
         # Collapse a multi-word name into a single word
         self._botName = unicode( ' '.join(name.split()) )
 
+    def setMatchEngine(self, engine):
+        """Select the algorithm used by match() and star() to walk the
+        node tree.
+
+        Legal values are:
+         - 'recursive': the original algorithm, which recurses once per
+           input word.
+         - 'iterative': walks the tree with an explicit stack and word
+           offsets, without copying any word lists.
+         - 'memoized': the recursive algorithm, remembering for the rest
+           of the match every node that failed to match the words left
+           over at it, so that no such subproblem is searched twice.  This
+           bounds the work of a match by the number of nodes times the
+           square of the number of words, where inputs of many words can
+           otherwise make several wildcards backtrack exponentially.
+
+        All engines return exactly the same templates.
+        """
+        if engine not in self._ENGINES:
+            raise ValueError( "engine must be in %s" % list(self._ENGINES) )
+        if engine == 'iterative':
+            self._matcher = self._matchIterative
+        elif engine == 'memoized':
+            self._matcher = self._matchMemoized
+        else:
+            self._matcher = self._match
+
+    def setMatchBudget(self, maxVisits=None, maxSeconds=None, fallback=None):
+        """Bound the work of each match: give up once it has visited more
+        than maxVisits nodes of the tree, or run for more than maxSeconds
+        seconds (None for no limit, the default for both).
+
+        Wildcards try every split of the words they may take, so inputs
+        of many words can make a match backtrack for a long time when
+        several wildcards almost fit.  A match that runs out of budget
+        yields the fallback template, in a MatchContext whose 'exhausted'
+        flag is set, or no match if fallback is None.  Visits are counted
+        the same way by both engines (see profile()).
+        """
+        self._maxVisits = maxVisits
+        self._maxSeconds = maxSeconds
+        self._fallback = fallback
+
+    def _budget(self):
+        """Return a new MatchBudget for a match, or None if matches are
+        not bounded."""
+        if self._maxVisits is None and self._maxSeconds is None:
+            return None
+        return MatchBudget(self._maxVisits, self._maxSeconds)
+
+    def categories(self):
+        """Generate a ((pattern, that, topic), template) tuple for every
+        template stored in the node tree.  Wildcards and the bot name are
+        rendered back as "*", "_" and "BOT_NAME".
+        """
+        stack = [(self._root, ([], [], []), 0)]
+        while stack:
+            node, words, segment = stack.pop()
+            if node.template is not None:
+                yield tuple(u" ".join(w) for w in words), node.template
+            for key, child in self._edges(node):
+                if key == self._THAT:
+                    stack.append((child, words, 1))
+                elif key == self._TOPIC:
+                    stack.append((child, words, 2))
+                else:
+                    if key == self._UNDERSCORE: key = u"_"
+                    elif key == self._STAR: key = u"*"
+                    elif key == self._BOT_NAME: key = u"BOT_NAME"
+                    childWords = tuple(w + [key] if i == segment else w
+                                       for i, w in enumerate(words))
+                    stack.append((child, childWords, segment))
+
+    def _edges(self, node):
+        """Generate (key, child) for each edge leaving node, where key is
+        either a word or one of the special keys."""
+        if node.children is not None:
+            word = self._vocabulary.word
+            for wordId, child in node.children.items():
+                yield word(wordId), child
+        for key, child in ((self._UNDERSCORE, node.underscore),
+                           (self._STAR, node.star),
+                           (self._BOT_NAME, node.botName),
+                           (self._THAT, node.that),
+                           (self._TOPIC, node.topic)):
+            if child is not None:
+                yield key, child
+
+    def _toDict(self, copy=None):
+        """Return the node tree as the nested dictionaries used by the
+        brain file format, keyed by words and the special keys.
+
+        The words and templates are passed through copy, if given (e.g.
+        a Utils.canonicalCopier(), for a dump that depends on the tree
+        only).
+        """
+        if copy is None:
+            copy = lambda obj: obj
+        # one tuple per pair of bounds, which marshal writes once
+        bounds = {}
+        root = {}
+        stack = [(self._root, root)]
+        while stack:
+            node, d = stack.pop()
+            for key, child in self._edges(node):
+                d[copy(key)] = {}
+                stack.append((child, d[key]))
+            if node.template is not None:
+                d[self._TEMPLATE] = copy(node.template)
+            pair = (node.minWords, node.maxWords)
+            try:
+                d[self._BOUNDS] = bounds[pair]
+            except KeyError:
+                d[self._BOUNDS] = bounds[pair] = copy(pair)
+        return root
+
+    def _fromDict(self, root):
+        """Rebuild the node tree from nested dictionaries produced by
+        _toDict()."""
+        self._vocabulary = _Vocabulary()
+        self._mapped = None
+        self._contextual = None
+        intern = self._vocabulary.intern
+        self._root = _Node()
+        stack = [(root, self._root)]
+        while stack:
+            d, node = stack.pop()
+            for key, value in d.items():
+                if key == self._TEMPLATE:
+                    node.template = value
+                    continue
+                if key == self._BOUNDS:
+                    node.minWords, node.maxWords = value
+                    continue
+                child = _Node()
+                if key == self._UNDERSCORE: node.underscore = child
+                elif key == self._STAR: node.star = child
+                elif key == self._BOT_NAME: node.botName = child
+                elif key == self._THAT: node.that = child
+                elif key == self._TOPIC: node.topic = child
+                else:
+                    if node.children is None:
+                        node.children = {}
+                    node.children[intern(key)] = child
+                stack.append((value, child))
+        if self._BOUNDS not in root:
+            # saved by an earlier version
+            self._computeBounds()
+
+    def _computeBounds(self):
+        """Work out the minWords and maxWords of every node of the tree."""
+        nodes = [self._root]
+        for node in nodes:
+            for key, child in self._edges(node):
+                nodes.append(child)
+        # children before their parents
+        for node in reversed(nodes):
+            if node.template is not None or node.that is not None or node.topic is not None:
+                node.minWords = 0
+            if node.children is not None:
+                for child in node.children.values():
+                    node.widen(child, False)
+            if node.botName is not None:
+                node.widen(node.botName, False)
+            for child in (node.underscore, node.star):
+                if child is not None:
+                    node.widen(child, True)
+
     def dump(self):
         """Print all learned patterns, for debugging purposes."""
-        pprint.pprint(self._root)
+        pprint.pprint(self._toDict())
 
-    def save(self, filename):
+    def save(self, filename, metadata=None):
         """Dump the current patterns to the file specified by filename.  To
         restore later, use restore().
+
+        metadata is an optional dictionary of data marshal can save,
+        stored along with the patterns.  The same patterns and metadata,
+        learned in the same order, make the same file.
         """
+        copy = canonicalCopier()
         try:
             outFile = open(filename, "wb")
             marshal.dump(self._templateCount, outFile)
             marshal.dump(self._botName, outFile)
-            marshal.dump(self._root, outFile)
+            marshal.dump(self._toDict(copy), outFile)
+            if metadata:
+                marshal.dump(copy(metadata), outFile)
             outFile.close()
-        except Exception as e:
+        except Exception:
             print( "Error saving PatternMgr to file %s:" % filename )
             raise
 
     def restore(self, filename):
-        """Restore a previously save()d collection of patterns."""
+        """Restore a previously save()d collection of patterns.  Return
+        the metadata saved with them (an empty dictionary if none)."""
         try:
             inFile = open(filename, "rb")
             self._templateCount = marshal.load(inFile)
             self._botName = marshal.load(inFile)
-            self._root = marshal.load(inFile)
+            self._fromDict(marshal.load(inFile))
+            try:
+                metadata = marshal.load(inFile)
+            except EOFError:
+                # brains saved without metadata, by earlier versions too
+                metadata = {}
             inFile.close()
-        except Exception as e:
+        except Exception:
             print( "Error restoring PatternMgr from file %s:" % filename )
             raise
+        return metadata
+
+    def saveMapped(self, filename, metadata=None):
+        """Save the current patterns to filename in the memory-mappable
+        format described in the MappedBrain module, with the optional
+        metadata as save() does.  To load them later, use
+        restoreMapped().
+        """
+        try:
+            MappedBrain.write(self, filename, metadata)
+        except Exception:
+            print( "Error saving PatternMgr to file %s:" % filename )
+            raise
+
+    def restoreMapped(self, filename):
+        """Map a collection of patterns saved by saveMapped().
+
+        The node tree is walked in place in the mapped file, so this
+        takes next to no time and memory.  It is copied into ordinary
+        nodes only if add() is called afterwards.  Return the metadata
+        saved with the patterns.
+        """
+        try:
+            brain = MappedBrain.MappedBrain(filename)
+        except Exception:
+            print( "Error restoring PatternMgr from file %s:" % filename )
+            raise
+        self._templateCount = brain.templateCount
+        self._botName = brain.botName
+        self._root = brain.root
+        self._vocabulary = brain.vocabulary
+        self._mapped = brain
+        self._contextual = None
+        return brain.metadata
 
     def add(self, data, template):
         """Add a [pattern/that/topic] tuple and its corresponding template
         to the node tree.
         """
         pattern,that,topic = data
+        # A mapped tree is read-only: copy it into memory first.
+        if self._mapped is not None:
+            self._fromDict(self._toDict())
         # TODO: make sure words contains only legal characters
         # (alphanumerics,*,_)
 
         # Navigate through the node tree to the template's location, adding
-        # nodes if necessary.
+        # nodes if necessary.  'edges' records the (parent, child, word)
+        # steps taken, and 'ends' the last node of each segment, for the
+        # bounds of the nodes.
+        edges = []
+        ends = []
         node = self._root
         for word in pattern.split():
-            key = word
-            if key == u"_":
-                key = self._UNDERSCORE
-            elif key == u"*":
-                key = self._STAR
-            elif key == u"BOT_NAME":
-                key = self._BOT_NAME
-            if key not in node:
-                node[key] = {}
-            node = node[key]
+            child = self._addEdge(node, word, botName=True)
+            edges.append((node, child, word))
+            node = child
 
         # navigate further down, if a non-empty "that" pattern was included
         if len(that) > 0:
-            if self._THAT not in node:
-                node[self._THAT] = {}
-            node = node[self._THAT]
+            if node.that is None:
+                node.that = _Node()
+            ends.append(node)
+            node = node.that
             for word in that.split():
-                key = word
-                if key == u"_":
-                    key = self._UNDERSCORE
-                elif key == u"*":
-                    key = self._STAR
-                if key not in node:
-                    node[key] = {}
-                node = node[key]
+                child = self._addEdge(node, word)
+                edges.append((node, child, word))
+                node = child
 
         # navigate yet further down, if a non-empty "topic" string was included
         if len(topic) > 0:
-            if self._TOPIC not in node:
-                node[self._TOPIC] = {}
-            node = node[self._TOPIC]
+            if node.topic is None:
+                node.topic = _Node()
+            ends.append(node)
+            node = node.topic
             for word in topic.split():
-                key = word
-                if key == u"_":
-                    key = self._UNDERSCORE
-                elif key == u"*":
-                    key = self._STAR
-                if key not in node:
-                    node[key] = {}
-                node = node[key]
-
+                child = self._addEdge(node, word)
+                edges.append((node, child, word))
+                node = child
 
         # add the template.
-        if self._TEMPLATE not in node:
+        if node.template is None:
             self._templateCount += 1    
-        node[self._TEMPLATE] = template
+        node.template = template
+        self._contextual = None
+
+        # the new paths can only widen the bounds of the nodes they cross
+        ends.append(node)
+        for end in ends:
+            end.minWords = 0
+        for parent, child, word in reversed(edges):
+            parent.widen(child, word == u"*" or word == u"_")
+
+    def _addEdge(self, node, word, botName=False):
+        """Return the child of node reached through word, creating it if
+        necessary.  "_" and "*" are wildcards; "BOT_NAME" stands for the
+        bot's name, but only if botName is true (i.e. in the main pattern).
+        """
+        if word == u"_":
+            if node.underscore is None:
+                node.underscore = _Node()
+            return node.underscore
+        elif word == u"*":
+            if node.star is None:
+                node.star = _Node()
+            return node.star
+        elif botName and word == u"BOT_NAME":
+            if node.botName is None:
+                node.botName = _Node()
+            return node.botName
+        if node.children is None:
+            node.children = {}
+        wordId = self._vocabulary.intern(word)
+        try:
+            return node.children[wordId]
+        except KeyError:
+            child = node.children[wordId] = _Node()
+            return child
+
+    def normalize(self, text, default=None):
+        """Return a Normalized object for text: convert it to all caps
+        and remove all punctuation.  If text is blank and a default is
+        given, the default is normalized instead.
+        """
+        if default is not None and text.strip() == u"":
+            text = default
+        original = text.split()
+        upper = text.upper()
+        if self._puncStripRE.search(upper) is None:
+            words = upper.split()
+            origins = range(len(words))
+        else:
+            # some words may be split in several tokens, or vanish.
+            words, origins = [], []
+            for i, word in enumerate(upper.split()):
+                for token in self._puncStripRE.sub(u" ", word).split():
+                    words.append(token)
+                    origins.append(i)
+        return Normalized(text, words, origins, original)
+
+    def _normalizeAll(self, pattern, that, topic):
+        """Normalize whichever of the match() arguments are still plain
+        strings."""
+        if not isinstance(pattern, Normalized):
+            pattern = self.normalize(pattern)
+        if not isinstance(that, Normalized):
+            that = self.normalize(that, self._DUMMY_THAT)
+        if not isinstance(topic, Normalized):
+            topic = self.normalize(topic, self._DUMMY_TOPIC)
+        return pattern, that, topic
 
     def match(self, pattern, that, topic):
         """Return the template which is the closest match to pattern. The
         'that' parameter contains the bot's previous response. The 'topic'
         parameter contains the current topic of conversation.
 
+        Each argument is either a string or the Normalized object that
+        normalize() returned for it; passing the latter saves normalizing
+        the same text again.
+
         Returns None if no template is found.
         """
-        if len(pattern) == 0:
+        context = self.matchContext(pattern, that, topic)
+        if context is None:
             return None
-        # Mutilate the input.  Remove all punctuation and convert the
-        # text to all caps.
-        input_ = pattern.upper()
-        input_ = re.sub(self._puncStripRE, " ", input_)
-        if that.strip() == u"": that = u"ULTRABOGUSDUMMYTHAT" # 'that' must never be empty
-        thatInput = that.upper()
-        thatInput = re.sub(self._puncStripRE, " ", thatInput)
-        thatInput = re.sub(self._whitespaceRE, " ", thatInput)
-        if topic.strip() == u"": topic = u"ULTRABOGUSDUMMYTOPIC" # 'topic' must never be empty
-        topicInput = topic.upper()
-        topicInput = re.sub(self._puncStripRE, " ", topicInput)
-        
-        # Pass the input off to the recursive call
-        patMatch, template = self._match(input_.split(), thatInput.split(), topicInput.split(), self._root)
-        return template
+        return context.template
+
+    def matchContext(self, pattern, that, topic):
+        """Like match(), but return a MatchContext that also records
+        which words each wildcard matched, or None if no template is
+        found.
+        """
+        pattern, that, topic = self._normalizeAll(pattern, that, topic)
+        if len(pattern.text) == 0:
+            return None
+        budget = self._budget()
+        try:
+            patMatch, template = self._matcher(pattern.words, that.words, topic.words,
+                                               self._root, budget)
+        except MatchBudgetExceeded:
+            if self._fallback is None:
+                return None
+            return MatchContext(self._fallback, pattern, that, topic, [], self._captures, True)
+        if template is None:
+            return None
+        return MatchContext(template, pattern, that, topic, patMatch, self._captures)
+
+    def profile(self, pattern, that, topic):
+        """Match pattern, that and topic (as with match()) and return a
+        MatchProfile of the match: how many nodes it visited, how many
+        times it backtracked, and which category it found.  The match
+        budget applies (see setMatchBudget()).
+        """
+        pattern, that, topic = self._normalizeAll(pattern, that, topic)
+        budget = self._budget() or MatchBudget()
+        start = time.time()
+        exhausted = False
+        path, template = None, None
+        try:
+            if len(pattern.text) > 0:
+                path, template = self._matcher(pattern.words, that.words, topic.words,
+                                               self._root, budget)
+        except MatchBudgetExceeded:
+            exhausted = True
+        seconds = time.time() - start
+        category = None
+        if template is not None:
+            category = self._renderPath(path)
+        return MatchProfile(budget.visits, budget.backtracks, seconds, exhausted,
+                            category, template)
+
+    def _renderPath(self, path):
+        """Return the (pattern, that, topic) strings of the category that
+        path, a path returned by the matcher, leads to."""
+        segments = ([], [], [])
+        segment = 0
+        for key in path:
+            if key == self._THAT: segment = 1
+            elif key == self._TOPIC: segment = 2
+            elif key == self._UNDERSCORE: segments[segment].append(u"_")
+            elif key == self._STAR: segments[segment].append(u"*")
+            else: segments[segment].append(key)
+        return tuple(u" ".join(words) for words in segments)
+
+    def dependsOnContext(self, pattern, context=None):
+        """Could the template matched by pattern depend on the words of
+        'that' and topic?
+
+        Only categories whose 'that' or topic pattern is more than "*"
+        tell contexts apart.  If none of their input patterns match
+        pattern, or if context, the MatchContext of a match of pattern,
+        was found before the matchers would get to the first of them,
+        the match only depends on whether 'that' and topic are empty.
+        The answer may be a false positive, never a false negative.
+        """
+        if not isinstance(pattern, Normalized):
+            pattern = self.normalize(pattern)
+        if self._contextual is None:
+            contextual = PatternMgr()
+            for (words, that, topic), template in self.categories():
+                if that not in (u"", u"*") or topic not in (u"", u"*"):
+                    contextual.add((words, u"", u""), True)
+            self._contextual = contextual
+        contextual = self._contextual
+        if contextual._templateCount == 0:
+            return False
+        contextual._botName = self._botName
+        try:
+            path, found = contextual._match(pattern.words, [], [], contextual._root,
+                                            self._budget())
+        except MatchBudgetExceeded:
+            return True
+        if found is None:
+            return False
+        if context is None:
+            return True
+        first = contextual._searchOrder(path, pattern.words)
+        matched = self._searchOrder(context.path, pattern.words)
+        return first is None or matched is None or first <= matched
+
+    def _searchOrder(self, path, words):
+        """Return the rank of path, a path returned by the matcher for
+        words, in the order in which both engines try the paths through
+        the input patterns: a list of (edge rank, number of words taken)
+        pairs, to be compared as a sequence.  Returns None if it cannot be
+        told whether a word went through the bot name."""
+        keys = []
+        for key in path:
+            if key == self._THAT or key == self._TOPIC:
+                break
+            keys.append(key)
+        spans = iter(self._spans(keys, words))
+        order = []
+        for key in keys:
+            if key == self._UNDERSCORE or key == self._STAR:
+                start, end = next(spans)
+                order.append((0 if key == self._UNDERSCORE else 3, end - start))
+            elif key == self._botName:
+                return None
+            else:
+                order.append((1, 1))
+        return order
 
     def star(self, starType, pattern, that, topic, index):
         """Returns a string, the portion of pattern that was matched by a *.
@@ -164,97 +770,90 @@ class PatternMgr:
          - 'star': matches a star in the main pattern.
          - 'thatstar': matches a star in the that pattern.
          - 'topicstar': matches a star in the topic pattern.
+
+        As with match(), pattern, that and topic may be given either as
+        strings or as Normalized objects.  Each call matches the input
+        again: to fetch several stars, use matchContext() instead.
         """
-        # Mutilate the input.  Remove all punctuation and convert the
-        # text to all caps.
-        input_ = pattern.upper()
-        input_ = re.sub(self._puncStripRE, " ", input_)
-        input_ = re.sub(self._whitespaceRE, " ", input_)
-        if that.strip() == u"": that = u"ULTRABOGUSDUMMYTHAT" # 'that' must never be empty
-        thatInput = that.upper()
-        thatInput = re.sub(self._puncStripRE, " ", thatInput)
-        thatInput = re.sub(self._whitespaceRE, " ", thatInput)
-        if topic.strip() == u"": topic = u"ULTRABOGUSDUMMYTOPIC" # 'topic' must never be empty
-        topicInput = topic.upper()
-        topicInput = re.sub(self._puncStripRE, " ", topicInput)
-        topicInput = re.sub(self._whitespaceRE, " ", topicInput)
-
-        # Pass the input off to the recursive pattern-matcher
-        patMatch, template = self._match(input_.split(), thatInput.split(), topicInput.split(), self._root)
-        if template == None:
-            return ""
-
-        # Extract the appropriate portion of the pattern, based on the
-        # starType argument.
-        words = None
-        if starType == 'star':
-            patMatch = patMatch[:patMatch.index(self._THAT)]
-            words = input_.split()
-        elif starType == 'thatstar':
-            patMatch = patMatch[patMatch.index(self._THAT)+1 : patMatch.index(self._TOPIC)]
-            words = thatInput.split()
-        elif starType == 'topicstar':
-            patMatch = patMatch[patMatch.index(self._TOPIC)+1 :]
-            words = topicInput.split()
-        else:
-            # unknown value
+        if starType not in ('star', 'thatstar', 'topicstar'):
             raise ValueError( "starType must be in ['star', 'thatstar', 'topicstar']" )
-        
-        # compare the input string to the matched pattern, word by word.
-        # At the end of this loop, if foundTheRightStar is true, start and
-        # end will contain the start and end indices (in "words") of
-        # the substring that the desired star matched.
-        foundTheRightStar = False
-        start = end = j = numStars = k = 0
-        for i in range(len(words)):
-            # This condition is true after processing a star
-            # that ISN'T the one we're looking for.
-            if i < k:
-                continue
-            # If we're reached the end of the pattern, we're done.
-            if j == len(patMatch):
-                break
-            if not foundTheRightStar:
-                if patMatch[j] in [self._STAR, self._UNDERSCORE]: #we got a star
-                    numStars += 1
-                    if numStars == index:
-                        # This is the star we care about.
-                        foundTheRightStar = True
-                    start = i
-                    # Iterate through the rest of the string.
-                    for k in range (i, len(words)):
-                        # If the star is at the end of the pattern,
-                        # we know exactly where it ends.
-                        if j+1  == len (patMatch):
-                            end = len (words)
-                            break
-                        # If the words have started matching the
-                        # pattern again, the star has ended.
-                        if patMatch[j+1] == words[k]:
-                            end = k - 1
-                            i = k
-                            break
-                # If we just finished processing the star we cared
-                # about, we exit the loop early.
-                if foundTheRightStar:
-                    break
-            # Move to the next element of the pattern.
-            j += 1
-            
-        # extract the star words from the original, unmutilated input.
-        if foundTheRightStar:
-            #print( ' '.join(pattern.split()[start:end+1]) )
-            if starType == 'star': return ' '.join(pattern.split()[start:end+1])
-            elif starType == 'thatstar': return ' '.join(that.split()[start:end+1])
-            elif starType == 'topicstar': return ' '.join(topic.split()[start:end+1])
-        else: return u""
-
-    def _match(self, words, thatWords, topicWords, root):
+        context = self.matchContext(pattern, that, topic)
+        if context is None:
+            return u""
+        return context.star(starType, index)
+
+    def _captures(self, patMatch, words, thatWords, topicWords):
+        """Work out the spans of words taken by the wildcards of a path
+        returned by the matcher, as the 'stars' of a MatchContext.
+
+        The path only says which wildcards were crossed, not how many
+        words each one took.  Both engines try the shortest split of a
+        wildcard first and only give it more words once everything below
+        has failed, so each wildcard took the fewest words that still let
+        the rest of the path match.
+        """
+        segments = [[], [], []]
+        segment = 0
+        for key in patMatch:
+            if key == self._THAT: segment = 1
+            elif key == self._TOPIC: segment = 2
+            else: segments[segment].append(key)
+        stars = {}
+        for name, keys, tokens in (('star', segments[0], words),
+                                   ('thatstar', segments[1], thatWords),
+                                   ('topicstar', segments[2], topicWords)):
+            stars[name] = self._spans(keys, tokens) if keys else []
+        return stars
+
+    def _spans(self, keys, tokens):
+        """Return the (start, end) spans taken by the wildcards among
+        keys, a matched path segment, when laid over tokens."""
+        wildcards = (self._STAR, self._UNDERSCORE)
+        n = len(tokens)
+        positions = [i for i, key in enumerate(keys) if key in wildcards]
+        if len(positions) < 2:
+            # a lone wildcard takes whatever the other keys leave over
+            return [(i, i + n - len(keys) + 1) for i in positions]
+        # fits[i][j]: can keys[i:] match tokens[j:]?  Computed backwards.
+        fits = [[False] * (n + 1) for _ in range(len(keys) + 1)]
+        fits[len(keys)][n] = True
+        for i in range(len(keys) - 1, -1, -1):
+            row, below = fits[i], fits[i+1]
+            if keys[i] in wildcards:
+                anyBelow = False
+                for j in range(n - 1, -1, -1):
+                    anyBelow = anyBelow or below[j+1]
+                    row[j] = anyBelow
+            else:
+                for j in range(n):
+                    row[j] = below[j+1] and tokens[j] == keys[i]
+        spans = []
+        j = 0
+        for i, key in enumerate(keys):
+            if key in wildcards:
+                end = j + 1
+                while not fits[i+1][end]:
+                    end += 1
+                spans.append((j, end))
+                j = end
+            else:
+                j += 1
+        return spans
+
+    def _match(self, words, thatWords, topicWords, root, budget=None, failed=None):
         """Return a tuple (pat, tem) where pat is a list of nodes, starting
         at the root and leading to the matching pattern, and tem is the
         matched template.
 
+        budget is the MatchBudget of the match, if any.  failed, if not
+        None, is a set of the (node, number of words left) pairs already
+        known not to match during this match, see _matchMemoized().
+
         """ 
+        if failed is not None and (root, len(words)) in failed:
+            return (None, None)
+        if budget is not None:
+            budget.visit()
         # base-case: if the word list is empty, return the current node's
         # template.
         if len(words) == 0:
@@ -264,70 +863,227 @@ class PatternMgr:
             if len(thatWords) > 0:
                 # If thatWords isn't empty, recursively
                 # pattern-match on the _THAT node with thatWords as words.
-                try:
-                    pattern, template = self._match(thatWords, [], topicWords, root[self._THAT])
+                if root.that is not None:
+                    pattern, template = self._match(thatWords, [], topicWords, root.that, budget, failed)
                     if pattern != None:
                         pattern = [self._THAT] + pattern
-                except KeyError:
-                    pattern = []
-                    template = None
             elif len(topicWords) > 0:
                 # If thatWords is empty and topicWords isn't, recursively pattern
                 # on the _TOPIC node with topicWords as words.
-                try:
-                    pattern, template = self._match(topicWords, [], [], root[self._TOPIC])
+                if root.topic is not None:
+                    pattern, template = self._match(topicWords, [], [], root.topic, budget, failed)
                     if pattern != None:
                         pattern = [self._TOPIC] + pattern
-                except KeyError:
-                    pattern = []
-                    template = None
             if template == None:
                 # we're totally out of input.  Grab the template at this node.
                 pattern = []
-                try: template = root[self._TEMPLATE]
-                except KeyError: template = None
+                template = root.template
+                if template is None:
+                    if budget is not None:
+                        budget.backtracks += 1
+                    if failed is not None:
+                        failed.add((root, 0))
             return (pattern, template)
 
         first = words[0]
         suffix = words[1:]
+        # Children whose paths cannot take the words left are skipped, as
+        # are the splits of a wildcard that leave too many or too few.
+        rest = len(suffix)
         
         # Check underscore.
         # Note: this is causing problems in the standard AIML set, and is
         # currently disabled.
-        if self._UNDERSCORE in root:
+        child = root.underscore
+        if child is not None:
             # Must include the case where suf is [] in order to handle the case
             # where a * or _ is at the end of the pattern.
-            for j in range(len(suffix)+1):
+            for j in self._splits(child, suffix):
                 suf = suffix[j:]
-                pattern, template = self._match(suf, thatWords, topicWords, root[self._UNDERSCORE])
+                pattern, template = self._match(suf, thatWords, topicWords, child, budget, failed)
                 if template is not None:
                     newPattern = [self._UNDERSCORE] + pattern
                     return (newPattern, template)
 
         # Check first
-        if first in root:
-            pattern, template = self._match(suffix, thatWords, topicWords, root[first])
-            if template is not None:
-                newPattern = [first] + pattern
-                return (newPattern, template)
+        if root.children is not None:
+            child = root.children.get(self._vocabulary.get(first))
+            if child is not None and child.minWords <= rest <= child.maxWords:
+                pattern, template = self._match(suffix, thatWords, topicWords, child, budget, failed)
+                if template is not None:
+                    newPattern = [first] + pattern
+                    return (newPattern, template)
 
         # check bot name
-        if self._BOT_NAME in root and first == self._botName:
-            pattern, template = self._match(suffix, thatWords, topicWords, root[self._BOT_NAME])
+        child = root.botName
+        if child is not None and first == self._botName and child.minWords <= rest <= child.maxWords:
+            pattern, template = self._match(suffix, thatWords, topicWords, child, budget, failed)
             if template is not None:
                 newPattern = [first] + pattern
                 return (newPattern, template)
         
         # check star
-        if self._STAR in root:
+        child = root.star
+        if child is not None:
             # Must include the case where suf is [] in order to handle the case
             # where a * or _ is at the end of the pattern.
-            for j in range(len(suffix)+1):
+            for j in self._splits(child, suffix):
                 suf = suffix[j:]
-                pattern, template = self._match(suf, thatWords, topicWords, root[self._STAR])
+                pattern, template = self._match(suf, thatWords, topicWords, child, budget, failed)
                 if template is not None:
                     newPattern = [self._STAR] + pattern
                     return (newPattern, template)
 
         # No matches were found.
-        return (None, None)         
+        if budget is not None:
+            budget.backtracks += 1
+        if failed is not None:
+            failed.add((root, len(words)))
+        return (None, None)
+
+    def _splits(self, child, words):
+        """Return the offsets into words, the words following the first one
+        taken by a wildcard, at which child, the node below the wildcard,
+        may take over, in the order the matchers try them.
+
+        Besides the offsets that leave child a number of words outside its
+        bounds, this skips, when child has no edges but words, those where
+        the next word is not one of them.  Words no pattern uses, such as
+        typos, can then only be taken by the wildcard, without descending
+        into child for each.
+        """
+        rest = len(words)
+        first = max(0, rest - child.maxWords)
+        last = rest - child.minWords
+        if child.underscore is not None or child.star is not None or child.botName is not None:
+            return range(first, last + 1)
+        splits = []
+        children = child.children
+        if children is not None:
+            wordId = self._vocabulary.get
+            for j in range(first, min(last + 1, rest)):
+                if wordId(words[j]) in children:
+                    splits.append(j)
+        if last == rest:
+            # the wildcard takes all the words
+            splits.append(rest)
+        return splits
+
+    def _matchMemoized(self, words, thatWords, topicWords, root, budget=None):
+        """Return the same (pat, tem) tuple as _match(), remembering the
+        subproblems that failed.
+
+        Whether the words left over at a node match below it does not
+        depend on how the match got there: the 'that' and topic words are
+        the same throughout a match, and a node belongs to the subtree of
+        a single segment.  So a (node, number of words left) pair that
+        failed once fails every time, and the wildcards of patterns like
+        "* IS * ABOUT *" stop searching the same splits again.  Successes
+        need no remembering, as the first one ends the match, and the
+        order of the search, hence the template found, is unchanged.
+
+        """
+        return self._match(words, thatWords, topicWords, root, budget, set())
+
+    def _matchIterative(self, words, thatWords, topicWords, root, budget=None):
+        """Return the same (pat, tem) tuple as _match(), but walk the node
+        tree with an explicit stack instead of recursing once per word.
+
+        Each stack frame holds a node, the word list it is consuming (0 for
+        the input, 1 for 'that', 2 for 'topic'), the offset of the next
+        word in that list, and how far through the node's alternatives the
+        search has got.  No word lists are sliced or concatenated; the
+        matched path is kept in a single list that grows and shrinks with
+        the stack.  budget is the MatchBudget of the match, if any.
+
+        """
+        segments = (words, thatWords, topicWords)
+        lengths = (len(words), len(thatWords), len(topicWords))
+        # look every word up in the vocabulary once, up front.
+        wordId = self._vocabulary.get
+        segmentIds = ([wordId(w) for w in words], [wordId(w) for w in thatWords],
+                      [wordId(w) for w in topicWords])
+        # the key leading into each segment's subtree
+        segmentKeys = (None, self._THAT, self._TOPIC)
+        path = []
+        # frame = [node, segment, offset, state, split]
+        stack = [[root, 0, 0, 0, 0]]
+        if budget is not None:
+            budget.visit()
+        while stack:
+            frame = stack[-1]
+            node, segment, offset, state, split = frame
+            length = lengths[segment]
+            child = None
+            if offset == length:
+                # We're out of words in this segment.  First try to carry
+                # on into the next non-empty segment, then fall back to the
+                # template at this node.
+                if state == 0:
+                    frame[3] = 1
+                    nextSegment = segment + 1
+                    while nextSegment < 3 and lengths[nextSegment] == 0:
+                        nextSegment += 1
+                    if nextSegment < 3:
+                        child = node.that if nextSegment == 1 else node.topic
+                        key, segment, offset = segmentKeys[nextSegment], nextSegment, 0
+                if child is None:
+                    if node.template is not None:
+                        return (list(path), node.template)
+            else:
+                # state 0: underscore, 1: exact word, 2: bot name, 3: star.
+                # 'split' counts the extra words given to the wildcard.
+                # As in _match(), the children and splits that would leave
+                # words their paths cannot take are skipped.
+                rest = length - offset - 1
+                while child is None and state < 4:
+                    if state == 0 or state == 3:
+                        wildcard = node.underscore if state == 0 else node.star
+                        if wildcard is not None:
+                            if split < rest - wildcard.maxWords:
+                                split = rest - wildcard.maxWords
+                            if (wildcard.underscore is None and wildcard.star is None
+                                and wildcard.botName is None):
+                                # see _splits()
+                                kids = wildcard.children
+                                ids = segmentIds[segment]
+                                while split < rest and (kids is None or ids[offset + 1 + split] not in kids):
+                                    split += 1
+                            if split <= rest - wildcard.minWords:
+                                child, key = wildcard, self._UNDERSCORE if state == 0 else self._STAR
+                                frame[4] = split + 1
+                                offset += 1 + split
+                                break
+                        split = frame[4] = 0
+                    elif state == 1:
+                        if node.children is not None:
+                            child = node.children.get(segmentIds[segment][offset])
+                            if child is not None:
+                                if child.minWords <= rest <= child.maxWords:
+                                    key = segments[segment][offset]
+                                    offset += 1
+                                else:
+                                    child = None
+                    elif node.botName is not None and segments[segment][offset] == self._botName:
+                        child = node.botName
+                        if child.minWords <= rest <= child.maxWords:
+                            key = segments[segment][offset]
+                            offset += 1
+                        else:
+                            child = None
+                    state = frame[3] = state + 1
+            if child is None:
+                # every alternative at this node has failed: backtrack.
+                stack.pop()
+                if budget is not None:
+                    budget.backtracks += 1
+                if stack:
+                    path.pop()
+            else:
+                path.append(key)
+                stack.append([child, segment, offset, 0, 0])
+                if budget is not None:
+                    budget.visit()
+
+        # No matches were found.
+        return (None, None)
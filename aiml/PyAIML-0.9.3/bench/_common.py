@@ -0,0 +1,77 @@
+"""
+Helpers shared by the benchmark scripts in this directory.
+
+The scripts use the AIML sets bundled with the Speak activity (the ``bot``
+directory at the top of the source tree) unless told otherwise, and assume
+the ``aiml`` package is importable.
+"""
+from __future__ import print_function
+
+import glob
+import io
+import os.path
+import sys
+import time
+
+import aiml
+
+BOTDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', '..', '..', 'bot')
+BRAINS = ('alice', 'sara', 'alisochka')
+
+# A few inputs per bundled brain, used by the response-level benchmarks
+INPUTS = {
+    'alice': [u"hello", u"what is your name", u"how old are you",
+              u"do you like cheese", u"my name is Tom", u"what is a computer",
+              u"I think that dogs are better than cats", u"tell me a joke",
+              u"who created you", u"are you a robot", u"bye"],
+    'sara': [u"hola", u"como te llamas", u"cuantos anos tienes",
+             u"me llamo Juan", u"que es una computadora", u"te gusta el queso",
+             u"eres un robot", u"adios"],
+    'alisochka': [u"hello", u"what is your name", u"how old are you",
+                  u"do you like cheese", u"my name is Tom", u"are you a robot",
+                  u"bye"],
+}
+
+
+def aiml_files(name):
+    """Return the sorted list of AIML files of a bundled brain."""
+    return sorted(glob.glob(os.path.join(BOTDIR, name, '*.aiml')))
+
+
+def learn_brain(name, kernel=None):
+    """Return a Kernel that has learned all the AIML files of a bundled
+    brain, with the parser's warnings silenced."""
+    k = kernel or aiml.Kernel()
+    k.verbose(False)
+    stderr, sys.stderr = sys.stderr, io.StringIO()
+    try:
+        for f in aiml_files(name):
+            k.learn(f)
+    finally:
+        sys.stderr = stderr
+    return k
+
+
+def timed(func, *args, **kwargs):
+    """Call func, returning (seconds elapsed, result)."""
+    start = time.time()
+    result = func(*args, **kwargs)
+    return time.time() - start, result
+
+
+def best_of(repeat, func, *args, **kwargs):
+    """Return the fastest of `repeat` timed calls to func, in seconds."""
+    return min(timed(func, *args, **kwargs)[0] for _ in range(repeat))
+
+
+def report(title, rows, header=None):
+    """Print a small fixed-width table."""
+    print()
+    print(title)
+    print('-' * len(title))
+    if header:
+        print('  '.join('%-14s' % h for h in header))
+    for row in rows:
+        print('  '.join(('%-14.4f' if isinstance(c, float) else '%-14s') % (c,)
+                        for c in row))
@@ -0,0 +1,87 @@
+"""
+Measure how an asyncio service fares when it answers with
+Kernel.respond() called on the event loop, or through AsyncKernel.
+
+Sessions answer the usual questions of _common.INPUTS concurrently, a
+quarter of them asked through a category whose template runs a <system>
+command; meanwhile a task ticks every millisecond.  Reports the time
+taken, and the longest the loop went without running the ticker.
+
+Usage:
+    python bench_async.py [brain [sessions]]
+"""
+from __future__ import print_function
+
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from aiml.AsyncKernel import AsyncKernel
+
+from _common import INPUTS, learn_brain, report
+from bench_threads import LOOKUP
+
+
+def inputs_of(name, session):
+    questions = INPUTS[name]
+    return [(u"lookup " + q if (i + session) % 4 == 0 else q)
+            for i, q in enumerate(questions)]
+
+
+async def conversation(respond, name, session):
+    for input_ in inputs_of(name, session):
+        await respond(input_, "s%d" % session)
+
+
+async def measure(respond, name, sessions):
+    stalls = [0.0]
+    done = []
+    async def ticker():
+        last = time.time()
+        while not done:
+            await asyncio.sleep(0.001)
+            now = time.time()
+            stalls[0] = max(stalls[0], now - last)
+            last = now
+    tick = asyncio.ensure_future(ticker())
+    start = time.time()
+    await asyncio.gather(*[conversation(respond, name, i) for i in range(sessions)])
+    elapsed = time.time() - start
+    done.append(True)
+    await tick
+    return elapsed, stalls[0]
+
+
+def main(name='alice', sessions=32):
+    kernel = learn_brain(name)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, "lookup.aiml")
+        with open(filename, "w") as f:
+            f.write(LOOKUP)
+        kernel.learn(filename)
+    finally:
+        shutil.rmtree(tmpdir)
+    async def blocking(input_, sessionID):
+        return kernel.respond(input_, sessionID)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    rows = []
+    try:
+        elapsed, stall = loop.run_until_complete(measure(blocking, name, sessions))
+        rows.append(("Kernel.respond", sessions, elapsed, 1000 * stall))
+        bot = AsyncKernel(kernel, maxSessions=sessions)
+        elapsed, stall = loop.run_until_complete(measure(bot.respond, name, sessions))
+        rows.append(("AsyncKernel", sessions, elapsed, 1000 * stall))
+    finally:
+        loop.close()
+    report("Asyncio service, brain %s" % name, rows,
+           header=("front end", "sessions", "seconds", "max stall (ms)"))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(*(args[:1] + [int(n) for n in args[1:2]]))
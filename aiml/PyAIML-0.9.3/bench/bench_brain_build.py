@@ -0,0 +1,73 @@
+"""
+Measure the incremental builds of aiml-build-brain (aiml/script/brainbuild.py).
+
+A copy of the AIML files of a bundled brain is built from scratch
+(--clean), then again with nothing changed, and after one file changed.
+Reports the time taken by each build, and whether its brain file is the
+same as that of a build from scratch of the same files (best of several
+runs).
+
+Usage:
+    python bench_brain_build.py [brain]
+"""
+from __future__ import print_function
+
+import io
+import os
+import shutil
+import sys
+import tempfile
+
+from aiml.script import brainbuild
+
+from _common import BOTDIR, report, timed
+
+
+def build(*args):
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = io.StringIO() if str is not bytes else io.BytesIO()
+    try:
+        return timed(brainbuild.main, list(args))[0]
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+
+
+def read(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def main(name='alice', repeat=3):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        aimldir = os.path.join(tmpdir, name)
+        shutil.copytree(os.path.join(BOTDIR, name), aimldir)
+        brain = os.path.join(tmpdir, name + '.brn')
+        pattern = os.path.join(aimldir, '*.aiml')
+        changed = sorted(os.listdir(aimldir))[0]
+
+        def change():
+            with open(os.path.join(aimldir, changed), 'a') as f:
+                f.write('<!-- changed -->\n')
+
+        rows = []
+        for label, prepare, args in (
+                ("from scratch", None, ("--clean",)),
+                ("nothing changed", None, ()),
+                ("one file changed", change, ())):
+            seconds = []
+            for i in range(repeat):
+                if prepare is not None:
+                    prepare()
+                seconds.append(build(*(args + (brain, pattern))))
+            output = read(brain)
+            build("--clean", "--cache", os.path.join(tmpdir, "clean"), brain, pattern)
+            rows.append((label, min(seconds), output == read(brain)))
+    finally:
+        shutil.rmtree(tmpdir)
+    report("Building brain %s" % name, rows,
+           header=("build", "seconds", "same file"))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,50 @@
+"""
+Compare Kernel.learn() with Kernel.learnParallel(), which parses the
+AIML files of a brain in a pool of processes and merges their
+categories in the order of the files.  Reports the time taken to learn
+a whole bundled brain with either, and several numbers of workers (best
+of several runs).  The gain depends on the number of CPUs available.
+
+Usage:
+    python bench_learn_parallel.py [brain]
+"""
+from __future__ import print_function
+
+import io
+import sys
+
+import aiml
+
+from _common import aiml_files, report, timed
+
+
+def learn_each(kernel, files):
+    for f in files:
+        kernel.learn(f)
+
+
+def learn(files, workers=None):
+    k = aiml.Kernel()
+    k.verbose(False)
+    stderr, sys.stderr = sys.stderr, io.StringIO()
+    try:
+        if workers is None:
+            return timed(learn_each, k, files)[0], k.numCategories()
+        return timed(k.learnParallel, files, workers)[0], k.numCategories()
+    finally:
+        sys.stderr = stderr
+
+
+def main(name='alice', repeat=3):
+    files = aiml_files(name)
+    rows = []
+    for label, workers in (("learn()", None), ("1 worker", 1),
+                           ("2 workers", 2), ("4 workers", 4)):
+        runs = [learn(files, workers) for i in range(repeat)]
+        rows.append((label, runs[0][1], min(r[0] for r in runs)))
+    report("Learning brain %s (%d files)" % (name, len(files)), rows,
+           header=("learned with", "categories", "seconds"))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
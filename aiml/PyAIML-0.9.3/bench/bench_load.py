@@ -0,0 +1,62 @@
+"""
+Compare loading a brain saved in the marshal format (Kernel.saveBrain())
+with mapping one saved in the memory-mapped format
+(Kernel.saveBrain(filename, mapped=True)).
+
+Reports, for each bundled brain, the file sizes, the time taken by
+loadBrain(), the Python heap it leaves allocated, and the time taken by
+the first response.
+
+Usage:
+    python bench_load.py [brain ...]
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+import aiml
+
+from _common import BRAINS, INPUTS, learn_brain, report, timed
+
+
+def load(filename, input_):
+    k = aiml.Kernel()
+    k.verbose(False)
+    seconds = timed(k.loadBrain, filename)[0]
+    first = timed(k.respond, input_)[0]
+    # tracemalloc slows allocations down, so measure the heap separately
+    k = aiml.Kernel()
+    k.verbose(False)
+    tracemalloc.start()
+    k.loadBrain(filename)
+    heap = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return seconds, heap, first
+
+
+def main(brains):
+    rows = []
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for name in brains:
+            kernel = learn_brain(name)
+            brn = os.path.join(tmpdir, name + '.brn')
+            brm = os.path.join(tmpdir, name + '.brm')
+            kernel._brain.save(brn)
+            kernel._brain.saveMapped(brm)
+            for kind, filename in (('marshal', brn), ('mapped', brm)):
+                seconds, heap, first = load(filename, INPUTS[name][0])
+                rows.append((name, kind, os.path.getsize(filename) // 1024,
+                             1000 * seconds, heap // 1024, 1000 * first))
+    finally:
+        shutil.rmtree(tmpdir)
+    report("Brain loading", rows,
+           header=("brain", "format", "file KiB", "load ms", "heap KiB", "1st resp. ms"))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or BRAINS)
@@ -0,0 +1,104 @@
+"""
+Measure the word-count bounds of the pattern tree nodes (minWords and
+maxWords), which let the matchers skip the children and wildcard splits
+that cannot take the words left.
+
+Matches the sentences of ordinary inputs built from the categories of a
+bundled brain, and the sentence of the word salads of
+bench_match_budget.py that visits the most nodes, with the bounds and
+with a copy of the tree whose bounds let everything through, as the
+matchers searched before (best of several runs).  Then compares the size
+and load time of brain files saved with and without the bounds; the
+latter are worked out on load.
+
+Usage:
+    python bench_match_bounds.py [brain]
+"""
+from __future__ import print_function
+
+import marshal
+import os
+import sys
+import tempfile
+
+from _common import best_of, learn_brain, report
+from bench_match_budget import word_salad
+from bench_match_memo import match_all
+from bench_templates import sample_inputs
+
+from aiml import Utils
+from aiml.PatternMgr import MatchBudget, PatternMgr, _UNBOUNDED
+
+
+def unbounded_copy(brain):
+    """Return a copy of brain whose nodes take any number of words."""
+    copy = PatternMgr()
+    copy._fromDict(brain._toDict())
+    copy._botName = brain._botName
+    nodes = [copy._root]
+    for node in nodes:
+        nodes.extend(child for key, child in copy._edges(node))
+        node.minWords, node.maxWords = 0, _UNBOUNDED
+    return copy
+
+
+def visits(brain, sentences):
+    budget = MatchBudget()
+    for s in sentences:
+        brain._match(s.words, [u"ULTRABOGUSDUMMYTHAT"], [u"ULTRABOGUSDUMMYTOPIC"],
+                     brain._root, budget)
+    return budget.visits
+
+
+def without_bounds(tree):
+    stack = [tree]
+    while stack:
+        d = stack.pop()
+        d.pop(PatternMgr._BOUNDS, None)
+        stack.extend(v for k, v in d.items() if k != PatternMgr._TEMPLATE)
+    return tree
+
+
+def main(name='alice', repeat=5):
+    kernel = learn_brain(name)
+    brain = kernel._brain
+    def prepare(inputs):
+        return [brain.normalize(kernel._subbers['normal'].sub(s))
+                for i in inputs for s in Utils.sentences(i)]
+    ordinary = prepare(sample_inputs(kernel, 1000))
+    salads = prepare(word_salad(kernel, 50, 200))
+    unbounded = unbounded_copy(brain)
+    worst = max(salads, key=lambda s: visits(unbounded, [s]))
+
+    rows = []
+    for engine in ('recursive', 'memoized'):
+        for label, pm in (("no bounds", unbounded), ("bounds", brain)):
+            pm.setMatchEngine(engine)
+            usual = 1e6 * best_of(repeat, match_all, pm, ordinary) / len(ordinary)
+            salad = 1000 * best_of(repeat, match_all, pm, [worst])
+            rows.append(("%s, %s" % (engine, label), usual,
+                         float(visits(pm, ordinary)) / len(ordinary), salad,
+                         visits(pm, [worst]) if engine == 'recursive' else '-'))
+    brain.setMatchEngine('recursive')
+    report("Match bounds, brain %s" % name, rows,
+           header=("engine", "us/sentence", "visits", "salad ms", "salad visits"))
+
+    rows = []
+    fd, filename = tempfile.mkstemp(suffix='.brn')
+    os.close(fd)
+    try:
+        for label, tree in (("bounds", brain._toDict()),
+                            ("no bounds", without_bounds(brain._toDict()))):
+            with open(filename, "wb") as f:
+                marshal.dump(brain.numTemplates(), f)
+                marshal.dump(brain._botName, f)
+                marshal.dump(tree, f)
+            restore = lambda: PatternMgr().restore(filename)
+            rows.append((label, os.path.getsize(filename) / 1e6, best_of(3, restore)))
+    finally:
+        os.remove(filename)
+    report("Brain file, brain %s" % name, rows, header=("saved", "MB", "load s"))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
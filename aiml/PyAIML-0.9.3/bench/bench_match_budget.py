@@ -0,0 +1,67 @@
+"""
+Profile the matches of a bundled brain (Kernel.profileMatch()), and
+measure the match budgets of Kernel.setMatchBudget().
+
+Inputs built from the categories of the brain and long word salads (as
+pasted text, with no punctuation to split it into sentences) are
+profiled; the inputs visiting the most nodes are listed with the
+category they matched, which shows the categories that make matches
+backtrack.  Then reports the time the input visiting the most nodes
+takes to answer with no budget and with budgets, and the cost of a
+budget on ordinary inputs (best of several runs).
+
+Usage:
+    python bench_match_budget.py [brain]
+"""
+from __future__ import print_function
+
+import random
+import sys
+
+from _common import best_of, learn_brain, report
+from bench_templates import converse, sample_inputs
+
+
+def word_salad(kernel, count, size, seed=1):
+    rnd = random.Random(seed)
+    vocabulary = kernel._brain._vocabulary
+    words = [vocabulary.word(i) for i in range(len(vocabulary))]
+    return [u" ".join(rnd.choice(words) for j in range(size)).lower() for i in range(count)]
+
+
+def main(name='alice', repeat=5):
+    kernel = learn_brain(name)
+    ordinary = sample_inputs(kernel, 1000)
+    inputs = ordinary + word_salad(kernel, 50, 200)
+
+    profiles = []
+    for input_ in inputs:
+        for profile in kernel.profileMatch(input_):
+            pattern = profile.pattern[0] if profile.pattern else u"(none)"
+            profiles.append((profile.visits, profile.backtracks, 1000 * profile.seconds,
+                             input_, pattern))
+    profiles.sort(key=lambda row: -row[0])
+    report("Matches visiting the most nodes, brain %s" % name,
+           [row[:3] + (row[3][:30], row[4][:30]) for row in profiles[:8]],
+           header=("visits", "backtracks", "ms", "input", "pattern"))
+    pathological = profiles[0][3]
+
+    rows = []
+    for label, budget in (("no budget", None), ("20000 visits", 20000),
+                          ("50 ms", 0.05)):
+        if budget is None:
+            kernel.setMatchBudget()
+        elif isinstance(budget, int):
+            kernel.setMatchBudget(maxVisits=budget, fallback=u"That is a lot to take in.")
+        else:
+            kernel.setMatchBudget(maxSeconds=budget, fallback=u"That is a lot to take in.")
+        long_ms = 1000 * best_of(repeat, converse, kernel, [pathological])
+        usual = 1e6 * best_of(repeat, converse, kernel, ordinary) / len(ordinary)
+        rows.append((label, long_ms, usual))
+    kernel.setMatchBudget()
+    report("Match budgets, brain %s" % name, rows,
+           header=("budget", "long input ms", "us/input"))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,62 @@
+"""
+Compare the match engines of PatternMgr.setMatchEngine(), in particular
+'memoized' against 'recursive', which it builds on.
+
+Reports, for each engine, the time to match the sentences of ordinary
+inputs built from the categories of a bundled brain, the sentence of
+the word salads of bench_match_budget.py that visits the most nodes,
+and a category of four wildcards that almost fits inputs of repeated
+words (best of several runs).
+
+Usage:
+    python bench_match_memo.py [brain]
+"""
+from __future__ import print_function
+
+import sys
+
+from _common import best_of, learn_brain, report, timed
+from bench_match_budget import word_salad
+from bench_templates import sample_inputs
+
+from aiml import Utils
+from aiml.PatternMgr import PatternMgr
+
+
+def match_all(brain, inputs):
+    for input_ in inputs:
+        brain.matchContext(input_, u"", u"")
+
+
+def main(name='alice', repeat=5):
+    kernel = learn_brain(name)
+    brain = kernel._brain
+    # the sentences of the inputs, as respond() matches them
+    def prepare(inputs):
+        return [brain.normalize(kernel._subbers['normal'].sub(s))
+                for i in inputs for s in Utils.sentences(i)]
+    ordinary = prepare(sample_inputs(kernel, 1000))
+    salads = prepare(word_salad(kernel, 50, 200))
+    worst = max(salads, key=lambda i: brain.profile(i, u"", u"").visits)
+
+    synthetic = PatternMgr()
+    synthetic.add((u"* A * A * A * B", u"*", u"*"), ['template', {}])
+    repeated = synthetic.normalize(u" ".join([u"A"] * 60))
+
+    rows = []
+    for engine in ('recursive', 'iterative', 'memoized'):
+        brain.setMatchEngine(engine)
+        synthetic.setMatchEngine(engine)
+        usual = 1e6 * best_of(repeat, match_all, brain, ordinary) / len(ordinary)
+        salad = 1000 * best_of(repeat, match_all, brain, [worst])
+        visits = brain.profile(worst, u"", u"").visits
+        # the recursive engines take seconds here: a single run each
+        wildcards = 1000 * timed(match_all, synthetic, [repeated])[0]
+        rows.append((engine, usual, salad, visits, wildcards))
+    brain.setMatchEngine('recursive')
+    report("Match engines, brain %s" % name, rows,
+           header=("engine", "us/sentence", "salad ms", "salad visits", "* A * A * A * B ms"))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
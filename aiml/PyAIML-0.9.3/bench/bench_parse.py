@@ -0,0 +1,59 @@
+"""
+Compare the AIML parser backends of aiml.AimlParser.create_parser():
+'sax', the generic xml.sax reader, and 'expat', which drives the handler
+from expat callbacks.
+
+Every AIML file of a bundled brain is parsed by each backend, the
+categories being checked to be the same.  Reports the parse throughput
+(best of several runs, the backends taking turns), in megabytes and categories per second.
+
+Usage:
+    python bench_parse.py [brain]
+"""
+from __future__ import print_function
+
+import io
+import os.path
+import sys
+
+from aiml.AimlParser import create_parser
+
+from _common import aiml_files, report, timed
+
+
+def parse(files, backend):
+    categories = []
+    stderr, sys.stderr = sys.stderr, io.StringIO()
+    try:
+        for f in files:
+            parser = create_parser(backend)
+            parser.parse(f)
+            categories.append(parser.getContentHandler().categories)
+    finally:
+        sys.stderr = stderr
+    return categories
+
+
+def main(name='alice', repeat=5):
+    files = aiml_files(name)
+    size = sum(os.path.getsize(f) for f in files) / 1024.0 ** 2
+    expected = parse(files, 'sax')
+    count = sum(len(c) for c in expected)
+    backends = ('sax', 'expat')
+    for backend in backends:
+        assert parse(files, backend) == expected
+    # the backends take turns, which evens out a busy machine
+    times = dict((backend, []) for backend in backends)
+    for i in range(repeat):
+        for backend in backends:
+            times[backend].append(timed(parse, files, backend)[0])
+    rows = []
+    for backend in backends:
+        seconds = min(times[backend])
+        rows.append((backend, seconds, size / seconds, count / seconds))
+    report("Parsing brain %s (%.1f MB, %d categories)" % (name, size, count), rows,
+           header=("backend", "seconds", "MB/s", "categories/s"))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,137 @@
+"""
+Measure the memory used per worker process when every worker loads its
+own copy of a brain, compared with the pre-forking server of
+aiml/script/server.py, where the brain is loaded once and then shared.
+
+For each brain format (marshal and mapped) the script starts WORKERS
+processes both ways, has each of them answer the sample inputs, and
+reports the average resident set (Rss), proportional set (Pss, where
+shared pages are split between the processes sharing them) and private
+memory per worker, plus the Pss of the whole group (Linux only).
+
+Usage:
+    python bench_prefork.py [brain [workers]]
+"""
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+import aiml
+from aiml.script.server import memory_stats, serve
+
+from _common import INPUTS, learn_brain, report
+
+
+def private(stats):
+    return stats.get('Private_Clean', 0) + stats.get('Private_Dirty', 0)
+
+
+def summarize(label, kind, stats):
+    n = len(stats)
+    return (label, kind,
+            sum(s['Rss'] for s in stats) // n,
+            sum(s['Pss'] for s in stats) // n,
+            sum(private(s) for s in stats) // n,
+            sum(s['Pss'] for s in stats))
+
+
+def independent(filename, inputs, workers):
+    """Fork workers that each load the brain themselves."""
+    children = []
+    for i in range(workers):
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(r)
+            k = aiml.Kernel()
+            k.verbose(False)
+            k.loadBrain(filename)
+            for input_ in inputs:
+                k.respond(input_)
+            os.write(w, b'.')
+            time.sleep(3600)
+            os._exit(0)
+        os.close(w)
+        os.read(r, 1)
+        os.close(r)
+        children.append(pid)
+    try:
+        return [memory_stats(pid) for pid in children]
+    finally:
+        for pid in children:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+
+def preforked(filename, inputs, workers, address):
+    """Start the pre-forking server and have every worker answer."""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            k = aiml.Kernel()
+            k.verbose(False)
+            k.loadBrain(filename)
+            serve(k, address, workers)
+        finally:
+            os._exit(0)
+    try:
+        while not os.path.exists(address):
+            time.sleep(0.01)
+        # One connection per worker: a worker serves one at a time.
+        streams = []
+        for i in range(workers):
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.connect(address)
+            streams.append(conn.makefile('rwb'))
+
+        def call(stream, request):
+            stream.write(json.dumps(request).encode('utf-8') + b'\n')
+            stream.flush()
+            return json.loads(stream.readline().decode('utf-8'))
+
+        for stream in streams:
+            for input_ in inputs:
+                call(stream, {'input': input_})
+        stats = [call(stream, {'stats': True}) for stream in streams]
+        parent = memory_stats(pid)
+        for stream in streams:
+            stream.close()
+        return stats, parent
+    finally:
+        os.kill(pid, signal.SIGINT)
+        os.waitpid(pid, 0)
+
+
+def main(name='alice', workers=4):
+    inputs = INPUTS[name]
+    tmpdir = tempfile.mkdtemp()
+    rows = []
+    try:
+        kernel = learn_brain(name)
+        files = (('marshal', os.path.join(tmpdir, name + '.brn')),
+                 ('mapped', os.path.join(tmpdir, name + '.brm')))
+        kernel._brain.save(files[0][1])
+        kernel._brain.saveMapped(files[1][1])
+        del kernel
+        for kind, filename in files:
+            rows.append(summarize('independent', kind, independent(filename, inputs, workers)))
+            stats, parent = preforked(filename, inputs, workers,
+                                      os.path.join(tmpdir, 'aiml.sock'))
+            row = summarize('pre-forked', kind, stats)
+            rows.append(row[:-1] + (row[-1] + parent['Pss'],))
+    finally:
+        shutil.rmtree(tmpdir)
+    report("Memory per worker, KiB (%s, %d workers)" % (name, workers), rows,
+           header=("workers", "format", "Rss", "Pss", "private", "total Pss"))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(args[0] if args else 'alice', int(args[1]) if len(args) > 1 else 4)
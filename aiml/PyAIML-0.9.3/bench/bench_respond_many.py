@@ -0,0 +1,67 @@
+"""
+Measure Kernel.respondMany() against a loop of Kernel.respond() calls.
+
+A replay log is made, for each bundled brain, of many sessions asking
+the usual questions of _common.INPUTS among inputs built from the
+brain's patterns, as logs of real traffic do.  It is answered with
+respond(), and with respondMany() in this process and with worker
+processes.  Reports the average time per input.
+
+Usage:
+    python bench_respond_many.py [brain ...]
+"""
+from __future__ import print_function
+
+import os
+import random
+import sys
+
+from _common import BRAINS, INPUTS, learn_brain, report, timed
+from bench_templates import sample_inputs
+
+
+def replay_log(kernel, name, size=4000, sessions=200, seed=1):
+    rnd = random.Random(seed)
+    inputs = sample_inputs(kernel, 500) + INPUTS[name] * 50
+    return [("s%d" % rnd.randrange(sessions), rnd.choice(inputs)) for i in range(size)]
+
+
+def replay(kernel, log):
+    for sessionID, input_ in log:
+        kernel.respond(input_, sessionID)
+
+
+def replay_many(kernel, log, processes=0):
+    for result in kernel.respondMany(log, processes=processes):
+        pass
+
+
+def forget(kernel, log):
+    for sessionID in set(sessionID for sessionID, input_ in log):
+        kernel._deleteSession(sessionID)
+
+
+def main(brains, processes=4, repeat=3):
+    rows = []
+    for name in brains:
+        kernel = learn_brain(name)
+        log = replay_log(kernel, name)
+        replay(kernel, log)         # warm-up
+        runs = [("respond", replay), ("respondMany", replay_many)]
+        if hasattr(os, 'fork'):
+            runs.append(("respondMany x%d" % processes,
+                         lambda kernel, log: replay_many(kernel, log, processes)))
+        best = {}
+        for i in range(repeat):
+            for label, run in runs:
+                forget(kernel, log)
+                t = timed(run, kernel, log)[0]
+                best[label] = min(best.get(label, t), t)
+        n = float(len(log))
+        rows.append((name, len(log)) + tuple(1e6 * best[label] / n for label, run in runs))
+    report("Replay time (microseconds per input)", rows,
+           header=("brain", "inputs") + tuple(label for label, run in runs))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or BRAINS)
@@ -0,0 +1,62 @@
+"""
+Measure the response cache (Kernel.setResponseCacheSize()).
+
+For each bundled brain, a conversation mixing a few hundred inputs built
+from its patterns with many repetitions of the common questions of
+_common.INPUTS is answered without and with the cache, and the responses
+compared.  Reports the average time per response, and how many responses
+were found in the cache.
+
+Usage:
+    python bench_response_cache.py [brain ...]
+"""
+from __future__ import print_function
+
+import random
+import sys
+
+from _common import BRAINS, INPUTS, learn_brain, report, timed
+from bench_templates import converse, sample_inputs
+
+
+def traffic(kernel, name, seed=1):
+    """Return a shuffled list of inputs where the usual questions come
+    back over and over, as they do in real conversations."""
+    inputs = sample_inputs(kernel, 500) + INPUTS[name] * 100
+    random.Random(seed).shuffle(inputs)
+    return inputs
+
+
+def main(brains, size=1000, repeat=5):
+    rows = []
+    for name in brains:
+        kernel = learn_brain(name)
+        inputs = traffic(kernel, name)
+        n = float(len(inputs))
+        # warm-up: compiles the templates, and checks the responses
+        kernel.setResponseCacheSize(size)
+        cached = converse(kernel, inputs)
+        kernel.setResponseCacheSize(0)
+        if converse(kernel, inputs) != cached:
+            print("WARNING: the cache changed the responses of brain %s" % name)
+        # alternate with and without the cache, so that both suffer the
+        # same noise; each run starts from an empty cache.
+        times = {0: [], size: []}
+        for i in range(repeat):
+            for cacheSize in (0, size):
+                kernel.setResponseCacheSize(cacheSize)
+                times[cacheSize].append(timed(converse, kernel, inputs)[0])
+        stats = kernel.cacheStats()['response']
+        kernel.setResponseCacheSize(0)
+        lookups = stats['hits'] + stats['misses']
+        best = dict((cacheSize, min(t)) for cacheSize, t in times.items())
+        rows.append((name, len(inputs), 1e6 * best[0] / n, 1e6 * best[size] / n,
+                     best[0] / best[size],
+                     100.0 * stats['hits'] / lookups if lookups else 0.0, stats['size']))
+    report("Response time (microseconds per input), response cache",
+           rows, header=("brain", "inputs", "no cache", "cache", "speedup",
+                         "hit %", "entries"))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or BRAINS)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark of aiml.Utils.sentences(), which splits every input of
+respond() into the sentences matched one by one.
+
+Times the splitter against the one it replaced (kept here as the
+reference point) on a few kinds of input, and counts the sentences each
+returns: the former returned empty ones for runs of punctuation, which
+respond() then answered, and kept the Spanish inverted marks on the words
+that follow them (the "spanish" input is split with them as terminators,
+as the Spanish bot is configured).
+
+Usage:
+    python bench_sentences.py
+"""
+from __future__ import print_function
+
+import sys
+
+from _common import best_of, report
+
+from aiml import Utils
+
+
+def old_sentences(s):
+    """Utils.sentences() as it was."""
+    try: s+""
+    except: raise TypeError( "s must be a string" )
+    pos = 0
+    sentenceList = []
+    l = len(s)
+    while pos < l:
+        try: p = s.index('.', pos)
+        except: p = l+1
+        try: q = s.index('?', pos)
+        except: q = l+1
+        try: e = s.index('!', pos)
+        except: e = l+1
+        end = min(p,q,e)
+        sentenceList.append( s[pos:end].strip() )
+        pos = end+1
+    if len(sentenceList) == 0: sentenceList.append(s)
+    return sentenceList
+
+
+SPANISH = u".?!¿¡"
+
+INPUTS = (
+    ("one word", u"hello", Utils.SENTENCE_TERMINATORS),
+    ("short", u"what is your name", Utils.SENTENCE_TERMINATORS),
+    ("shouted", u"hi!!!", Utils.SENTENCE_TERMINATORS),
+    ("two sentences", u"I like cats. Do you like cats?", Utils.SENTENCE_TERMINATORS),
+    ("spanish", u"¡Hola! ¿Cómo estás?", SPANISH),
+    ("paragraph", u"I went to school today. It was fun! We played games, "
+                  u"and then we read a story about a dragon... Do you like dragons? "
+                  u"I do!!! My sister does not. Why not?", Utils.SENTENCE_TERMINATORS),
+)
+
+
+def split_all(splitter, count, *args):
+    for i in range(count):
+        splitter(*args)
+
+
+def main(count=20000, repeat=5):
+    rows = []
+    for label, text, terminators in INPUTS:
+        old = 1e6 * best_of(repeat, split_all, old_sentences, count, text) / count
+        new = 1e6 * best_of(repeat, split_all, Utils.sentences, count, text, terminators) / count
+        rows.append((label, old, new, len(old_sentences(text)),
+                     len(Utils.sentences(text, terminators))))
+    report("Sentence splitting, us/call", rows,
+           header=("input", "before", "after", "sentences before", "after"))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
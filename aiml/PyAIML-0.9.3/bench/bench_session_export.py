@@ -0,0 +1,47 @@
+"""
+Measure the export of many sessions: a deep copy of all of them (what
+Kernel.getSessionData() used to do), getSessionData(), the snapshots of
+Kernel.sessionSnapshots(), and an incremental dump of the sessions
+changed since a checkpoint, after a percent of them answered again.
+
+Usage:
+    python bench_session_export.py [brain [sessions]]
+"""
+from __future__ import print_function
+
+import copy
+import sys
+
+from _common import INPUTS, best_of, learn_brain, report
+from bench_sessions import replay, traffic
+
+
+def deep_copy(kernel):
+    return copy.deepcopy(dict(kernel._sessions.items()))
+
+
+def snapshots(kernel, since=None):
+    return sum(1 for sessionID, snapshot in kernel.sessionSnapshots(since))
+
+
+def main(name='alice', sessions=20000, repeat=3):
+    kernel = learn_brain(name)
+    log = traffic(name, sessions, 2 * sessions)
+    replay(kernel, log)
+    checkpoint = kernel.sessionCheckpoint()
+    replay(kernel, [("s%d" % i, INPUTS[name][0]) for i in range(0, sessions, 100)])
+    held = len(kernel._sessions)
+    rows = [
+        ("deepcopy", held, 1000 * best_of(repeat, deep_copy, kernel)),
+        ("getSessionData", held, 1000 * best_of(repeat, kernel.getSessionData)),
+        ("snapshots", held, 1000 * best_of(repeat, snapshots, kernel)),
+        ("since checkpoint", snapshots(kernel, checkpoint),
+         1000 * best_of(repeat, snapshots, kernel, checkpoint)),
+    ]
+    report("Session export, brain %s" % name, rows,
+           header=("export", "sessions", "milliseconds"))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(*(args[:1] + [int(n) for n in args[1:2]]))
@@ -0,0 +1,80 @@
+"""
+Measure the session stores with many sessions.
+
+Many sessions, most of which are seen a few times, answer the usual
+questions of _common.INPUTS, with the default store (which keeps every
+session), a MemorySessionStore keeping the 1000 most recently used ones
+and a SqliteSessionStore keeping as many in memory.  Reports the
+average time per input, the memory the sessions hold at the end, and
+the hit rate of the store.
+
+Usage:
+    python bench_sessions.py [brain [sessions]]
+"""
+from __future__ import print_function
+
+import copy
+import os
+import random
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+from aiml.SessionStore import MemorySessionStore, SqliteSessionStore
+
+from _common import INPUTS, learn_brain, report, timed
+
+
+def traffic(name, sessions, size, seed=1):
+    """(sessionID, input) pairs, a few sessions being much busier."""
+    rnd = random.Random(seed)
+    return [("s%d" % int(sessions * rnd.random() ** 2), rnd.choice(INPUTS[name]))
+            for i in range(size)]
+
+
+def replay(kernel, log):
+    for sessionID, input_ in log:
+        kernel.respond(input_, sessionID)
+
+
+def measure(kernel, store, log):
+    if store is not None:
+        kernel.setSessionStore(store)
+    elapsed = timed(replay, kernel, log)[0]
+    tracemalloc.start()
+    # the size of the sessions held in memory: that of a copy
+    held = copy.deepcopy(dict(kernel._sessions._sessions))
+    heap = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del held
+    stats = kernel.sessionStats()
+    hits = stats['hits'] / float(max(1, stats['hits'] + stats['misses']))
+    return elapsed, heap, stats['sessions'], hits
+
+
+def main(name='alice', sessions=20000, size=40000):
+    log = traffic(name, sessions, size)
+    tmpdir = tempfile.mkdtemp()
+    stores = [
+        ("default", lambda: None),
+        ("memory 1000", lambda: MemorySessionStore(maxSessions=1000)),
+        ("sqlite 1000", lambda: SqliteSessionStore(os.path.join(tmpdir, "sessions.db"),
+                                                   maxSessions=1000)),
+    ]
+    rows = []
+    try:
+        for label, store in stores:
+            kernel = learn_brain(name)
+            elapsed, heap, held, hits = measure(kernel, store(), log)
+            rows.append((label, 1e6 * elapsed / len(log), heap / 1024 ** 2, held, 100 * hits))
+            kernel._sessions.close()
+    finally:
+        shutil.rmtree(tmpdir)
+    report("Session stores, brain %s, %d inputs" % (name, len(log)), rows,
+           header=("store", "us/input", "MB in memory", "held", "hit %"))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(*(args[:1] + [int(n) for n in args[1:2]]))
@@ -0,0 +1,52 @@
+"""
+Measure the srai cache (Kernel.setSraiCacheSize()).
+
+For each bundled brain, a few thousand inputs built from its patterns are
+answered twice in a row, without and with the cache, and the responses
+compared.  Reports the average time per response, and how many <srai>
+results were found in the cache.
+
+Usage:
+    python bench_srai_cache.py [brain ...]
+"""
+from __future__ import print_function
+
+import sys
+
+from _common import BRAINS, learn_brain, report, timed
+from bench_templates import converse, sample_inputs
+
+
+def main(brains, size=10000, repeat=5):
+    rows = []
+    for name in brains:
+        kernel = learn_brain(name)
+        inputs = sample_inputs(kernel) * 2
+        n = float(len(inputs))
+        # warm-up: compiles the templates, and checks the responses
+        kernel.setSraiCacheSize(size)
+        cached = converse(kernel, inputs)
+        kernel.setSraiCacheSize(0)
+        if converse(kernel, inputs) != cached:
+            print("WARNING: the cache changed the responses of brain %s" % name)
+        # alternate with and without the cache, so that both suffer the
+        # same noise; each run starts from an empty cache.
+        times = {0: [], size: []}
+        for i in range(repeat):
+            for cacheSize in (0, size):
+                kernel.setSraiCacheSize(cacheSize)
+                times[cacheSize].append(timed(converse, kernel, inputs)[0])
+        cache = kernel._sraiCache
+        kernel.setSraiCacheSize(0)
+        lookups = cache.hits + cache.misses
+        best = dict((cacheSize, min(t)) for cacheSize, t in times.items())
+        rows.append((name, len(inputs), 1e6 * best[0] / n, 1e6 * best[size] / n,
+                     best[0] / best[size], lookups,
+                     100.0 * cache.hits / lookups if lookups else 0.0, len(cache)))
+    report("Response time (microseconds per input), srai cache",
+           rows, header=("brain", "inputs", "no cache", "cache", "speedup",
+                         "srai lookups", "hit %", "entries"))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or BRAINS)
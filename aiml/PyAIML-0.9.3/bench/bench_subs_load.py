@@ -0,0 +1,66 @@
+"""
+Measure what the substitution tables saved with a brain
+(Kernel.saveBrain()) spare the first response after Kernel.loadBrain().
+
+A brain is saved with and without the tries of its tables (saved by the
+'trie' substitution engine only), and loaded into a new Kernel with
+either engine; the regex cache of the re module is purged first, as in
+a new process.  Reports the time taken by
+loadBrain() and by the first response, which compiles the tables it
+uses (best of several runs).
+
+Usage:
+    python bench_subs_load.py [brain]
+"""
+from __future__ import print_function
+
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+import aiml
+
+from _common import INPUTS, learn_brain, report, timed
+
+
+def load(filename, engine, input_):
+    re.purge()
+    k = aiml.Kernel()
+    k.verbose(False)
+    k.setSubstitutionEngine(engine)
+    seconds = timed(k.loadBrain, filename)[0]
+    # a response using each table
+    first = timed(k.respond, input_)[0]
+    first += timed(lambda: [subber.sub(input_) for subber in k._subbers.values()])[0]
+    return seconds, first
+
+
+def main(name='alice', repeat=7):
+    rows = []
+    tmpdir = tempfile.mkdtemp()
+    try:
+        kernel = learn_brain(name)
+        for engine in ('regex', 'trie'):
+            kernel.setSubstitutionEngine(engine)
+            saved = os.path.join(tmpdir, engine + '.brn')
+            kernel.saveBrain(saved)
+            plain = os.path.join(tmpdir, 'plain.brn')
+            kernel._brain.save(plain)
+            # (the 'regex' engine saves no tables)
+            files = [("without tables", plain)]
+            if engine == 'trie':
+                files.append(("with tables", saved))
+            for label, filename in files:
+                runs = [load(filename, engine, INPUTS[name][0]) for i in range(repeat)]
+                rows.append((engine, label, 1000 * min(r[0] for r in runs),
+                             1000 * min(r[1] for r in runs)))
+    finally:
+        shutil.rmtree(tmpdir)
+    report("Loading brain %s" % name, rows,
+           header=("engine", "brain file", "load ms", "1st resp. ms"))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
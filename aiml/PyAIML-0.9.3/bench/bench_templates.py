@@ -0,0 +1,104 @@
+"""
+Compare the interpreted and compiled template engines
+(Kernel.setTemplateEngine()).
+
+For each bundled brain, a few thousand inputs built from its patterns are
+answered with both engines, after a warm-up pass that compiles the
+templates.  Reports the average time per response, and the part of it
+not spent normalizing and matching the input (i.e. mostly evaluating
+templates), and checks that both engines answer alike.
+
+Usage:
+    python bench_templates.py [brain ...]
+"""
+from __future__ import print_function
+
+import random
+import sys
+import time
+
+from _common import BRAINS, learn_brain, report, timed
+
+
+def sample_inputs(kernel, count=3000, seed=1):
+    rnd = random.Random(seed)
+    categories = list(kernel._brain.categories())
+    inputs = []
+    for (pattern, that, topic), template in rnd.sample(categories, min(count, len(categories))):
+        words = []
+        for w in pattern.split():
+            words.extend(['some', 'words'] if w in ('*', '_') else
+                         [kernel._brain._botName] if w == 'BOT_NAME' else [w.lower()])
+        inputs.append(u" ".join(words))
+    return inputs
+
+
+def converse(kernel, inputs):
+    """Answer inputs in a fresh session, with reproducible <random>
+    choices (and <date/> frozen)."""
+    kernel._deleteSession("bench")
+    responses = []
+    asctime, time.asctime = time.asctime, lambda *args: u"Sat Oct 17 12:00:00 2026"
+    try:
+        for input_ in inputs:
+            random.seed(input_)
+            responses.append(kernel.respond(input_, "bench"))
+    finally:
+        time.asctime = asctime
+    return responses
+
+
+def timed_conversation(kernel, inputs):
+    """Return (total time, time not spent normalizing or matching) taken
+    to answer inputs.  The latter goes to the templates and the Kernel's
+    bookkeeping, the part the template engine changes."""
+    brain = kernel._brain
+    spent = [0.0]
+    def timer(original):
+        def wrapper(*args):
+            start = time.time()
+            try:
+                return original(*args)
+            finally:
+                spent[0] += time.time() - start
+        return wrapper
+    brain.matchContext = timer(brain.matchContext)
+    brain.normalize = timer(brain.normalize)
+    try:
+        total = timed(converse, kernel, inputs)[0]
+    finally:
+        del brain.matchContext, brain.normalize
+    return total, total - spent[0]
+
+
+def main(brains, repeat=5):
+    rows = []
+    for name in brains:
+        kernel = learn_brain(name)
+        inputs = sample_inputs(kernel)
+        responses = {}
+        for engine in ('interpreted', 'compiled'):
+            kernel.setTemplateEngine(engine)
+            responses[engine] = converse(kernel, inputs)   # warm-up, compiles
+        if responses['interpreted'] != responses['compiled']:
+            print("WARNING: the engines disagree on brain %s" % name)
+        # alternate the engines, so that both suffer the same noise
+        compiler = kernel._compiler
+        runs = {'interpreted': [], 'compiled': []}
+        for i in range(repeat):
+            for engine in ('interpreted', 'compiled'):
+                kernel._compiler = compiler if engine == 'compiled' else None
+                runs[engine].append(timed_conversation(kernel, inputs))
+        n = float(len(inputs))
+        interp = [min(t[i] for t in runs['interpreted']) for i in (0, 1)]
+        comp = [min(t[i] for t in runs['compiled']) for i in (0, 1)]
+        rows.append((name, len(inputs), 1e6 * interp[0] / n, 1e6 * comp[0] / n,
+                     interp[0] / comp[0], 1e6 * interp[1] / n, 1e6 * comp[1] / n,
+                     interp[1] / comp[1]))
+    report("Response time (microseconds per input)", rows,
+           header=("brain", "inputs", "interpreted", "compiled", "speedup",
+                   "rest interp.", "rest compiled", "rest speedup"))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or BRAINS)
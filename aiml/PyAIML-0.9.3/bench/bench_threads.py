@@ -0,0 +1,82 @@
+"""
+Measure how responses scale with threads, in the 'global' and 'session'
+locking modes (Kernel.setLockingMode()).
+
+Each thread holds its own session and answers the usual questions of
+_common.INPUTS; the total number of responses is the same whatever the
+number of threads.  Two workloads are measured: the plain questions,
+which keep the interpreter busy, and the same questions asked through a
+category whose template first runs a <system> command, as bots that
+look things up do.  Reports responses per second.
+
+Usage:
+    python bench_threads.py [brain [threads ...]]
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+from _common import INPUTS, learn_brain, report, timed
+
+LOOKUP = """<?xml version="1.0" encoding="ISO-8859-1"?>
+<aiml version="1.0.1">
+<category><pattern>LOOKUP *</pattern>
+<template><system>echo</system><srai><star/></srai></template></category>
+</aiml>
+"""
+
+
+def serve(kernel, inputs, threads):
+    """Answer inputs, split between threads each with its own session."""
+    def converse(sessionID, part):
+        for input_ in part:
+            kernel.respond(input_, sessionID)
+    workers = [threading.Thread(target=converse, args=("t%d" % i, inputs[i::threads]))
+               for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def main(name='alice', counts=(1, 2, 4, 8), responses=800, repeat=3):
+    kernel = learn_brain(name)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, "lookup.aiml")
+        with open(filename, "w") as f:
+            f.write(LOOKUP)
+        kernel.learn(filename)
+    finally:
+        shutil.rmtree(tmpdir)
+    questions = INPUTS[name] * (responses // len(INPUTS[name]))
+    workloads = (("questions", questions),
+                 ("<system>", [u"lookup " + q for q in questions[:responses // 8]]))
+    rows = []
+    for label, inputs in workloads:
+        serve(kernel, inputs, 1)        # warm-up
+        for threads in counts:
+            best = {}
+            # alternate the modes, so that both suffer the same noise
+            for i in range(repeat):
+                for mode in ('global', 'session'):
+                    kernel.setLockingMode(mode)
+                    t = timed(serve, kernel, inputs, threads)[0]
+                    best[mode] = min(best.get(mode, t), t)
+            n = float(len(inputs))
+            rows.append((label, threads, n / best['global'], n / best['session'],
+                         best['global'] / best['session']))
+    report("Responses per second, brain %s" % name, rows,
+           header=("workload", "threads", "global", "session", "speedup"))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if len(args) > 1:
+        main(args[0], [int(n) for n in args[1:]])
+    else:
+        main(*args)
@@ -0,0 +1,136 @@
+"""
+Compare the compact pattern tree used by PatternMgr (interned word IDs,
+__slots__ nodes) against the nested-dictionary tree it replaced, which is
+still the layout of saved .brn files.
+
+Reports, for each bundled brain, the memory held by each tree (in total,
+and without the templates, which both layouts store the same way) and
+the average time to match one input.
+
+Usage:
+    python bench_trie.py [brain ...]
+"""
+from __future__ import print_function
+
+import marshal
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+
+from aiml.PatternMgr import PatternMgr
+
+from _common import BRAINS, learn_brain, report, timed
+
+_UNDERSCORE, _STAR, _TEMPLATE, _THAT, _TOPIC, _BOT_NAME = range(6)
+
+
+def dict_match(words, thatWords, topicWords, root, botName):
+    """The matcher as it was before the compact tree, kept here as the
+    reference point for the comparison."""
+    if len(words) == 0:
+        pattern, template = [], None
+        if len(thatWords) > 0:
+            if _THAT in root:
+                pattern, template = dict_match(thatWords, [], topicWords, root[_THAT], botName)
+        elif len(topicWords) > 0:
+            if _TOPIC in root:
+                pattern, template = dict_match(topicWords, [], [], root[_TOPIC], botName)
+        if template is None:
+            template = root.get(_TEMPLATE)
+        return pattern, template
+    first, suffix = words[0], words[1:]
+    if _UNDERSCORE in root:
+        for j in range(len(suffix) + 1):
+            pattern, template = dict_match(suffix[j:], thatWords, topicWords, root[_UNDERSCORE], botName)
+            if template is not None:
+                return [_UNDERSCORE] + pattern, template
+    if first in root:
+        pattern, template = dict_match(suffix, thatWords, topicWords, root[first], botName)
+        if template is not None:
+            return [first] + pattern, template
+    if _BOT_NAME in root and first == botName:
+        pattern, template = dict_match(suffix, thatWords, topicWords, root[_BOT_NAME], botName)
+        if template is not None:
+            return [first] + pattern, template
+    if _STAR in root:
+        for j in range(len(suffix) + 1):
+            pattern, template = dict_match(suffix[j:], thatWords, topicWords, root[_STAR], botName)
+            if template is not None:
+                return [_STAR] + pattern, template
+    return None, None
+
+
+def allocated(func):
+    """Return (bytes still allocated after func returns, result)."""
+    tracemalloc.start()
+    try:
+        result = func()
+        return tracemalloc.get_traced_memory()[0], result
+    finally:
+        tracemalloc.stop()
+
+
+def load_dict_tree(filename):
+    with open(filename, 'rb') as f:
+        marshal.load(f)
+        marshal.load(f)
+        return marshal.load(f)
+
+
+def load_compact_tree(filename):
+    pm = PatternMgr()
+    pm.restore(filename)
+    return pm
+
+
+def sample_inputs(pm, count=5000, seed=1):
+    rnd = random.Random(seed)
+    samples = []
+    categories = list(pm.categories())
+    for (pattern, that, topic), template in rnd.sample(categories, min(count, len(categories))):
+        words = []
+        for w in pattern.split():
+            words.extend(['SOME', 'WORDS'] if w in ('*', '_') else
+                         [pm._botName] if w == 'BOT_NAME' else [w])
+        samples.append(words)
+    return samples
+
+
+def main(brains):
+    memory, latency = [], []
+    for name in brains:
+        fd, filename = tempfile.mkstemp(suffix='.brn')
+        os.close(fd)
+        try:
+            learn_brain(name)._brain.save(filename)
+            dictBytes, root = allocated(lambda: load_dict_tree(filename))
+            compactBytes, pm = allocated(lambda: load_compact_tree(filename))
+        finally:
+            os.remove(filename)
+        templates = marshal.dumps([t for _, t in pm.categories()])
+        templateBytes = allocated(lambda: marshal.loads(templates))[0]
+        memory.append((name, dictBytes // 1024, compactBytes // 1024,
+                       (dictBytes - templateBytes) // 1024,
+                       (compactBytes - templateBytes) // 1024,
+                       float(compactBytes - templateBytes) / (dictBytes - templateBytes)))
+
+        inputs = sample_inputs(pm)
+        that, topic = ['ULTRABOGUSDUMMYTHAT'], ['ULTRABOGUSDUMMYTOPIC']
+        tDict = timed(lambda: [dict_match(w, that, topic, root, pm._botName) for w in inputs])[0]
+        tRec = timed(lambda: [pm._match(w, that, topic, pm._root) for w in inputs])[0]
+        pm.setMatchEngine('iterative')
+        tIter = timed(lambda: [pm._matchIterative(w, that, topic, pm._root) for w in inputs])[0]
+        n = len(inputs)
+        latency.append((name, n, 1e6 * tDict / n, 1e6 * tRec / n, 1e6 * tIter / n))
+
+    report("Pattern tree memory (KiB)", memory,
+           header=("brain", "dict tree", "compact", "dict w/o tpl", "compact w/o tpl",
+                   "ratio w/o tpl"))
+    report("Match latency (microseconds per input)", latency,
+           header=("brain", "inputs", "dict tree", "compact rec.", "compact iter."))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or BRAINS)
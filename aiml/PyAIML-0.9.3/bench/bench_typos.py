@@ -0,0 +1,80 @@
+"""
+Measure matching on typo-heavy input, like that children type: words no
+pattern uses, which only wildcards can take.
+
+The inputs are built from the categories of the bundled brains, with
+letters dropped, swapped or repeated in a third of the words.  Their
+sentences are matched by the recursive engine as it is, whose wildcards
+skip the splits where the word that follows is not one the rest of the
+pattern can start with, and as it was, trying every split (best of
+several runs), with the number of nodes visited per sentence.
+
+Usage:
+    python bench_typos.py [brain...]
+"""
+from __future__ import print_function
+
+import random
+import sys
+
+from _common import BRAINS, best_of, learn_brain, report
+from bench_match_memo import match_all
+from bench_templates import sample_inputs
+
+from aiml import Utils
+from aiml.PatternMgr import MatchBudget, PatternMgr
+
+
+class EverySplit(PatternMgr):
+    """A PatternMgr whose wildcards try every split their bounds allow."""
+
+    def _splits(self, child, words):
+        rest = len(words)
+        return range(max(0, rest - child.maxWords), rest - child.minWords + 1)
+
+
+def typo(word, rnd):
+    i = rnd.randrange(len(word))
+    kind = rnd.randrange(3)
+    if kind == 0 and len(word) > 1:
+        return word[:i] + word[i+1:]
+    if kind == 1 and i + 1 < len(word):
+        return word[:i] + word[i+1] + word[i] + word[i+2:]
+    return word[:i] + word[i] * 3 + word[i+1:]
+
+
+def typos(inputs, rate=0.33, seed=7):
+    rnd = random.Random(seed)
+    return [u" ".join(typo(w, rnd) if rnd.random() < rate else w for w in i.split())
+            for i in inputs]
+
+
+def visits(brain, sentences):
+    budget = MatchBudget()
+    for s in sentences:
+        brain._match(s.words, [u"ULTRABOGUSDUMMYTHAT"], [u"ULTRABOGUSDUMMYTOPIC"],
+                     brain._root, budget)
+    return float(budget.visits) / len(sentences)
+
+
+def main(names=BRAINS, repeat=5):
+    rows = []
+    for name in names:
+        kernel = learn_brain(name)
+        brain = kernel._brain
+        everySplit = EverySplit()
+        everySplit._fromDict(brain._toDict())
+        everySplit._botName = brain._botName
+        sentences = [brain.normalize(kernel._subbers['normal'].sub(s))
+                     for i in typos(sample_inputs(kernel, 1000)) for s in Utils.sentences(i)]
+        unknown = sum(1 for s in sentences for w in s.words if brain._vocabulary.get(w) is None)
+        words = sum(len(s.words) for s in sentences)
+        for label, pm in (("every split", everySplit), ("next word", brain)):
+            us = 1e6 * best_of(repeat, match_all, pm, sentences) / len(sentences)
+            rows.append((name, label, us, visits(pm, sentences), 100.0 * unknown / words))
+    report("Typo-heavy input", rows,
+           header=("brain", "wildcards try", "us/sentence", "visits", "% unknown"))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or BRAINS)
@@ -0,0 +1,64 @@
+"""
+Compare the 'regex' and 'trie' substitution engines
+(Kernel.setSubstitutionEngine()).
+
+Each table of the Kernel is applied to texts of a bundled brain: the
+'normal' one to inputs (built from its patterns, and the usual questions
+of _common.INPUTS), the others to its responses.  A table of 1000 made
+up entries added to the 'normal' ones shows how both engines scale, as
+with a large substitutions file loaded by Kernel.loadSubs().  Reports
+the average time per text, and that of a whole response with either
+engine.
+
+Usage:
+    python bench_wordsub.py [brain]
+"""
+from __future__ import print_function
+
+import random
+import sys
+
+from aiml import DefaultSubs
+from aiml.WordSub import TrieWordSub, WordSub
+
+from _common import INPUTS, best_of, learn_brain, report
+from bench_templates import converse, sample_inputs
+
+
+def substitute(subber, texts):
+    for text in texts:
+        subber.sub(text)
+
+
+def main(name='alice', repeat=5):
+    kernel = learn_brain(name)
+    inputs = sample_inputs(kernel) + INPUTS[name] * 20
+    responses = converse(kernel, inputs)
+    rnd = random.Random(1)
+    large = dict(("w%d%s" % (i, rnd.choice(["", "'s", " x"])), "r%d" % i) for i in range(1000))
+    large.update(DefaultSubs.defaultNormal)
+    tables = [
+        ("normal", DefaultSubs.defaultNormal, inputs),
+        ("person", DefaultSubs.defaultPerson, responses),
+        ("person2", DefaultSubs.defaultPerson2, responses),
+        ("gender", DefaultSubs.defaultGender, responses),
+        ("normal+1000", large, inputs),
+    ]
+    rows = []
+    for label, table, texts in tables:
+        regex, trie = WordSub(table), TrieWordSub(table)
+        assert [regex.sub(t) for t in texts] == [trie.sub(t) for t in texts]
+        times = [1e6 * best_of(repeat, substitute, subber, texts) / len(texts)
+                 for subber in (regex, trie)]
+        rows.append((label, len(table)) + tuple(times))
+    times = []
+    for engine in ('regex', 'trie'):
+        kernel.setSubstitutionEngine(engine)
+        times.append(1e6 * best_of(repeat, converse, kernel, inputs) / len(inputs))
+    rows.append(("respond()", "") + tuple(times))
+    report("Substitutions, brain %s (microseconds per text)" % name, rows,
+           header=("table", "entries", "regex", "trie"))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -61,6 +61,9 @@ PyAIML (c) Cort Stratton
     entry_points = { 'console_scripts': [
         'aiml-validate = aiml.script.aimlvalidate:main',
         'aiml-bot = aiml.script.bot:main',
+        'aiml-convert-brain = aiml.script.brainconvert:main',
+        'aiml-build-brain = aiml.script.brainbuild:main',
+        'aiml-server = aiml.script.server:main',
     ]},
 
     test_suite = 'test.__main__.load_tests',
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os.path
+import shutil
+import tempfile
+import time
+import unittest
+
+try:
+    import asyncio
+    from aiml.AsyncKernel import AsyncKernel
+    asyncio.get_running_loop
+except (ImportError, SyntaxError, AttributeError):
+    AsyncKernel = None
+
+from aiml import Kernel
+
+
+@unittest.skipIf(AsyncKernel is None, "needs Python 3.7")
+class TestAsyncKernel( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        k = Kernel()
+        k.verbose(False)
+        k.learn(os.path.join(os.path.dirname(__file__), "self-test.aiml"))
+        self.tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(self.tmpdir, "async.aiml")
+        with open(filename, "w") as f:
+            f.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n<aiml version="1.0.1">'
+                    '<category><pattern>SLEEP *</pattern>'
+                    '<template><system>sleep 0.<star/>; echo slept</system></template></category>'
+                    '</aiml>\n')
+        k.learn(filename)
+        self.bot = AsyncKernel(k, maxSessions=2, systemTimeout=2)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _run(self, *coroutines):
+        return self.loop.run_until_complete(asyncio.gather(*coroutines))
+
+    def test01_respond( self ):
+        self.assertEqual([u"My name is Nameless"], self._run(self.bot.respond(u"test bot")))
+        # the histories are those of the wrapped kernel
+        self.assertEqual([u"test bot"], list(self.bot.kernel.getPredicate(Kernel._inputHistory)))
+        self.assertEqual(0, self.bot.inFlight)
+        self.assertEqual({}, self.bot._sessions)
+
+    def test02_system( self ):
+        # the loop keeps running while <system> commands run
+        ticks = []
+        async def ticker():
+            for i in range(5):
+                ticks.append(self.bot.inFlight)
+                await asyncio.sleep(0.05)
+        responses = self._run(self.bot.respond(u"test system"),
+                              self.bot.respond(u"sleep 5", "other"), ticker())
+        self.assertEqual([u"The system says hello!", u"slept", None], responses)
+        self.assertEqual(5, len(ticks))
+        self.assertIn(1, ticks)
+        # and synchronous calls still work
+        self.assertEqual(u"The system says hello!", self.bot.kernel.respond(u"test system"))
+
+    def test03_timeout( self ):
+        start = time.time()
+        self.bot.systemTimeout = 0.2
+        response, = self._run(self.bot.respond(u"sleep 9"))
+        self.assertLess(time.time() - start, 0.8)
+        self.assertIn(u"error", response)
+
+    def test04_backpressure( self ):
+        # maxSessions=2: four sessions take two rounds
+        ticks = []
+        async def ticker():
+            for i in range(15):
+                ticks.append(self.bot.inFlight)
+                await asyncio.sleep(0.05)
+        start = time.time()
+        responses = self._run(ticker(), *[self.bot.respond(u"sleep 3", "s%d" % i) for i in range(4)])
+        self.assertGreaterEqual(time.time() - start, 0.6)
+        self.assertEqual([u"slept"] * 4, responses[1:])
+        self.assertEqual(2, max(ticks))
+
+    def test05_order( self ):
+        # the inputs of a session are answered in order
+        inputs = [u"test bot", u"sleep 1", u"test that"]
+        responses = self._run(*[self.bot.respond(input_, "same") for input_ in inputs])
+        self.assertEqual([u"My name is Nameless", u"slept", u"I just said: slept"], responses)
+        self.assertEqual(inputs, list(self.bot.kernel.getPredicate(Kernel._inputHistory, "same")))
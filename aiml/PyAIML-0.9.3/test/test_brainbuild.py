@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import glob
+import io
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+from aiml import Kernel
+from aiml.BrainCache import BrainCache
+from aiml.script import brainbuild
+
+
+BOT = os.path.join(os.path.dirname(__file__), "..", "..", "..", "bot")
+
+
+def read(filename):
+    with open(filename, "rb") as f:
+        return f.read()
+
+
+class TestBrainBuild( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.aiml = os.path.join(self.tmpdir, "sara")
+        shutil.copytree(os.path.join(BOT, "sara"), self.aiml)
+        self.files = sorted(glob.glob(os.path.join(self.aiml, "*.aiml")))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def build(self, *args):
+        """Run aiml-build-brain, returning what it printed."""
+        stdout, sys.stdout = sys.stdout, io.StringIO() if str is not bytes else io.BytesIO()
+        try:
+            brainbuild.main(list(args))
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def learned(self, filename, mapped=False):
+        """Save the brain of a Kernel that learned the files."""
+        k = Kernel()
+        k.verbose(False)
+        for f in self.files:
+            k.learn(f)
+        k.saveBrain(filename, mapped)
+        return read(filename)
+
+    def test01_incremental( self ):
+        brain = os.path.join(self.tmpdir, "sara.brn")
+        pattern = os.path.join(self.aiml, "*.aiml")
+        self.assertIn("(%d parsed)" % len(self.files), self.build(brain, pattern))
+        first = read(brain)
+        self.assertIn("(0 parsed)", self.build(brain, pattern))
+        self.assertEqual(first, read(brain))
+        # a brain saved after learn() is the same
+        self.assertEqual(first, self.learned(os.path.join(self.tmpdir, "learned.brn")))
+
+        # a changed file is parsed again, and replaces its categories
+        with io.open(self.files[-1], "a", encoding="utf-8") as f:
+            f.write(u"<!-- changed -->\n")
+        with io.open(self.files[0], "w", encoding="utf-8") as f:
+            f.write(u'<?xml version="1.0" encoding="UTF-8"?>\n<aiml version="1.0">'
+                    u'<category><pattern>PRUEBA INCREMENTAL</pattern><template>Hey</template></category>'
+                    u'</aiml>\n')
+        self.assertIn("(2 parsed)", self.build(brain, pattern))
+        incremental = read(brain)
+        self.assertNotEqual(first, incremental)
+        self.build("--clean", brain, pattern)
+        self.assertEqual(incremental, read(brain))
+        self.assertEqual(incremental, self.learned(os.path.join(self.tmpdir, "learned.brn")))
+
+        k = Kernel()
+        k.verbose(False)
+        k.loadBrain(brain)
+        self.assertEqual(u"Hey", k.respond(u"prueba incremental"))
+
+    def test02_mapped( self ):
+        brain = os.path.join(self.tmpdir, "sara.brm")
+        pattern = os.path.join(self.aiml, "*.aiml")
+        self.build("--mapped", "--workers", "2", brain, pattern)
+        first = read(brain)
+        self.assertIn("(0 parsed)", self.build("--mapped", brain, pattern))
+        self.assertEqual(first, read(brain))
+        self.assertEqual(first, self.learned(os.path.join(self.tmpdir, "learned.brm"), True))
+
+    def test03_cache( self ):
+        cache = BrainCache(os.path.join(self.tmpdir, "cache"))
+        k = Kernel()
+        k.verbose(False)
+        k.learnParallel(self.files[:2], 1, cache)
+        self.assertEqual({'hits': 0, 'misses': 2}, cache.stats())
+        # the entries are named by contents, not by files
+        copy = os.path.join(self.tmpdir, "copy.aiml")
+        shutil.copy(self.files[0], copy)
+        cache = BrainCache(os.path.join(self.tmpdir, "cache"))
+        k.learnParallel([copy, self.files[2]], 1, cache)
+        self.assertEqual({'hits': 1, 'misses': 1}, cache.stats())
+        # the entry of files[1] is not used any more
+        self.assertEqual(1, cache.prune())
+        self.assertEqual(2, len(os.listdir(os.path.join(self.tmpdir, "cache"))))
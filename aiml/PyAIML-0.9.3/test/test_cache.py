@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os.path
+import random
+import time
+import unittest
+
+from aiml import Kernel
+
+from .test_patternmgr import load_brain, sample_inputs
+
+
+def converse(k, inputs):
+    """Answer inputs in a fresh session, with a seeded random generator;
+    return the responses and the final session data."""
+    responses = []
+    for input_ in inputs:
+        random.seed(input_)
+        responses.append(k.respond(input_, "user"))
+    data = k.getSessionData("user")
+    k._deleteSession("user")
+    return responses, data
+
+
+class TestSraiCache( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        self.k = Kernel()
+        self.k.verbose(False)
+        self.k.learn(os.path.join(os.path.dirname(__file__), "cache-test.aiml"))
+        self.k.setSraiCacheSize(10)
+
+    def test01_hit( self ):
+        cache = self.k._sraiCache
+        self.assertEqual(u"Hello", self.k.respond(u"hi"))
+        self.assertEqual((0, 1), (cache.hits, cache.misses))
+        self.assertEqual(u"Hello", self.k.respond(u"hi", "other"))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+    def test02_predicates( self ):
+        # the result is reused only while <get name="name"/> is unchanged
+        self.k.setPredicate("name", u"Ann")
+        self.assertEqual(u"Welcome Ann", self.k.respond(u"howdy"))
+        self.k.setPredicate("name", u"Bob")
+        self.assertEqual(u"Welcome Bob", self.k.respond(u"howdy"))
+        self.assertEqual(u"Welcome Bob", self.k.respond(u"howdy"))
+        self.assertEqual((1, 2), (self.k._sraiCache.hits, self.k._sraiCache.misses))
+
+    def test03_that( self ):
+        # a <that> pattern can select another template for the same input
+        self.assertEqual(u"Hello there", self.k.respond(u"hello there"))
+        self.assertEqual(u"Hello again there", self.k.respond(u"hello there"))
+        self.assertEqual(u"Hello again there", self.k.respond(u"hello there"))
+        # ... so its result is only reused while the same template is
+        # chosen: the third time, with another 'that'
+        self.assertEqual(1, self.k._sraiCache.hits)
+        self.k.setPredicate("name", u"Ann", "other")
+        self.assertEqual(u"Hello Ann there", self.k.respond(u"hello there", "other"))
+        self.assertTrue(self.k._brain.dependsOnContext(u"greeting"))
+        self.assertFalse(self.k._brain.dependsOnContext(u"welcome"))
+
+    def test04_impure( self ):
+        self.assertEqual(u"I", self.k.respond(u"count"))
+        self.assertEqual(u"II", self.k.respond(u"count"))
+        self.assertEqual(u"III IIII", self.k.respond(u"count twice"))
+        tosses = set(self.k.respond(u"toss") for i in range(50))
+        self.assertEqual(set([u"heads", u"tails"]), tosses)
+        self.assertEqual(0, len(self.k._sraiCache))
+
+    def test05_recursion( self ):
+        # results cut short by the recursion limit are not cached
+        expected = self.k.respond(u"loop")
+        self.assertEqual(0, len(self.k._sraiCache))
+        self.assertEqual(expected, self.k.respond(u"loop"))
+
+    def test06_invalidate( self ):
+        # the result, and the entry telling it reads "name"
+        self.k.respond(u"hi")
+        self.assertEqual(2, len(self.k._sraiCache))
+        self.k.setBotPredicate("name", u"Robby")
+        self.assertEqual(0, len(self.k._sraiCache))
+        self.k.respond(u"hi")
+        self.k.learn(os.path.join(os.path.dirname(__file__), "cache-test.aiml"))
+        self.assertEqual(0, len(self.k._sraiCache))
+
+    def test07_sessions( self ):
+        # sessions with different values each find their own result
+        cache = self.k._sraiCache
+        self.k.setPredicate("name", u"Ann", "a")
+        self.k.setPredicate("name", u"Bob", "b")
+        for i in range(2):
+            self.assertEqual(u"Welcome Ann", self.k.respond(u"howdy", "a"))
+            self.assertEqual(u"Welcome Bob", self.k.respond(u"howdy", "b"))
+        self.assertEqual((2, 2), (cache.hits, cache.misses))
+        self.assertEqual(3, len(cache))
+
+    def test07_lru( self ):
+        self.k.setSraiCacheSize(1)
+        self.k.respond(u"hi")
+        self.k.respond(u"howdy")
+        self.k.respond(u"hi")
+        self.assertEqual(1, len(self.k._sraiCache))
+        self.assertEqual(0, self.k._sraiCache.hits)
+        self.k.setSraiCacheSize(0)
+        self.assertIsNone(self.k._sraiCache)
+
+    def test08_brains( self ):
+        # the same conversations, with and without the cache
+        asctime, time.asctime = time.asctime, lambda *args: u"Sat Oct 17 12:00:00 2026"
+        try:
+            for name, step in (('alice', 5), ('sara', 1), ('alisochka', 1)):
+                k = load_brain(name)
+                inputs = [u" ".join(words) for words, that, topic in sample_inputs(k._brain)[::step]]
+                expected, expectedData = converse(k, inputs)
+                k.setSraiCacheSize(1000)
+                try:
+                    responses, data = converse(k, inputs)
+                finally:
+                    k.setSraiCacheSize(0)
+                for input_, e, r in zip(inputs, expected, responses):
+                    self.assertEqual(e, r, msg="brain=%s input=%s" % (name, input_))
+                self.assertEqual(expectedData, data)
+        finally:
+            time.asctime = asctime
+
+
+class TestResponseCache( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        self.k = Kernel()
+        self.k.verbose(False)
+        self.k.learn(os.path.join(os.path.dirname(__file__), "cache-test.aiml"))
+        self.k.setResponseCacheSize(10)
+
+    def test01_hit( self ):
+        cache = self.k._responseCache
+        self.assertEqual(u"My name is Nameless", self.k.respond(u"what is your name"))
+        self.assertEqual(u"My name is Nameless", self.k.respond(u"what is your name?", "other"))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+        # (<star/> gives back the words as they were typed)
+        self.k.respond(u"What is your name")
+        self.assertEqual((1, 2), (cache.hits, cache.misses))
+        # the histories are kept up to date on hits
+        self.assertEqual([u"what is your name"],
+                         list(self.k.getPredicate(self.k._inputHistory, "other")))
+        self.assertEqual([u"My name is Nameless"],
+                         list(self.k.getPredicate(self.k._outputHistory, "other")))
+
+    def test02_bypass( self ):
+        # predicates, randomness and side effects, even through a <srai>
+        self.k.setPredicate("name", u"Ann")
+        self.assertEqual(u"Welcome Ann", self.k.respond(u"howdy"))
+        self.k.setPredicate("name", u"Bob")
+        self.assertEqual(u"Welcome Bob", self.k.respond(u"howdy"))
+        self.assertEqual(u"I", self.k.respond(u"count"))
+        self.assertEqual(u"II", self.k.respond(u"count"))
+        tosses = set(self.k.respond(u"toss") for i in range(50))
+        self.assertEqual(set([u"heads", u"tails"]), tosses)
+        self.assertEqual(0, len(self.k._responseCache))
+
+    def test03_that( self ):
+        self.assertEqual(u"Yes what?", self.k.respond(u"yes"))
+        self.k.respond(u"cats")
+        self.assertEqual(u"Me too", self.k.respond(u"yes"))
+        self.assertEqual(u"Yes what?", self.k.respond(u"yes"))
+
+    def test04_ttl( self ):
+        self.k.setResponseCacheSize(10, ttl=60)
+        cache = self.k._responseCache
+        self.k.respond(u"what is your name")
+        now = time.time()
+        clock, time.time = time.time, lambda: now + 61
+        try:
+            self.k.respond(u"what is your name")
+        finally:
+            time.time = clock
+        self.assertEqual((0, 2), (cache.hits, cache.misses))
+        self.k.respond(u"what is your name")
+        self.assertEqual(1, cache.hits)
+
+    def test05_invalidate( self ):
+        self.k.setSraiCacheSize(10)
+        self.k.respond(u"what is your name")
+        self.k.respond(u"hi")
+        stats = self.k.cacheStats()
+        self.assertEqual(dict(size=1, maxSize=10, ttl=None, hits=0, misses=2), stats['response'])
+        self.assertEqual(2, stats['srai']['size'])
+        self.k.setBotPredicate("name", u"Robby")
+        self.assertEqual(u"My name is Robby", self.k.respond(u"what is your name"))
+        self.k.setResponseCacheSize(0)
+        self.k.setSraiCacheSize(0)
+        self.assertEqual({}, self.k.cacheStats())
+
+    def test06_brains( self ):
+        # the same conversations, with and without the caches
+        asctime, time.asctime = time.asctime, lambda *args: u"Sat Oct 17 12:00:00 2026"
+        try:
+            for name, step in (('alice', 5), ('sara', 1), ('alisochka', 1)):
+                k = load_brain(name)
+                inputs = [u" ".join(words) for words, that, topic in sample_inputs(k._brain)[::step]]
+                # each input twice, so that the cache gets used
+                inputs = inputs + inputs
+                expected, expectedData = converse(k, inputs)
+                k.setResponseCacheSize(1000)
+                k.setSraiCacheSize(1000)
+                try:
+                    responses, data = converse(k, inputs)
+                    self.assertGreater(k._responseCache.hits, 0, msg="brain=%s" % name)
+                finally:
+                    k.setResponseCacheSize(0)
+                    k.setSraiCacheSize(0)
+                for input_, e, r in zip(inputs, expected, responses):
+                    self.assertEqual(e, r, msg="brain=%s input=%s" % (name, input_))
+                self.assertEqual(expectedData, data)
+        finally:
+            time.asctime = asctime
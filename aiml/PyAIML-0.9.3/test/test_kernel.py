@@ -115,6 +115,17 @@ class TestKernel( unittest.TestCase ):
         self._testTag('that test #1', "test that", ["I just said: The system says hello!"])
         self._testTag('that test #2', "test that", ["I have already answered this question"])
 
+    def test14_thatpunctuation( self ):
+        # runs of punctuation make no empty sentences, whose empty
+        # responses would become 'that'
+        self._testTag('system', "test system!!!", ["The system says hello!"])
+        self._testTag('that after punctuation', "test that", ["I just said: The system says hello!"])
+        # Spanish questions start with an inverted question mark, for the
+        # bots told so
+        self._testTag('input', u"\xbftest input?", [u''])
+        self.k.setSentenceTerminators(u".?!\xbf\xa1")
+        self._testTag('input', u"\xbftest input?", ['You just said: test input'])
+
     def test15_thatstar( self ):
         self._testTag('thatstar test #1', "test thatstar", ["I say beans"])
         self._testTag('thatstar test #2', "test thatstar", ["I just said \"beans\""])
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import io
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+from aiml import Kernel
+
+
+BOT = os.path.join(os.path.dirname(__file__), "..", "..", "..", "bot")
+
+
+def new_kernel():
+    k = Kernel()
+    k.verbose(False)
+    return k
+
+
+class TestLearnParallel( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _aiml(self, name, categories):
+        filename = os.path.join(self.tmpdir, name)
+        with open(filename, "w") as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n<aiml version="1.0">\n')
+            for pattern, template in categories:
+                f.write("<category><pattern>%s</pattern><template>%s</template></category>\n"
+                        % (pattern, template))
+            f.write("</aiml>\n")
+        return filename
+
+    def test01_sara( self ):
+        files = os.path.join(BOT, "sara", "*.aiml")
+        expected = new_kernel()
+        expected.learn(files)
+        for workers in (1, 3):
+            k = new_kernel()
+            k.learnParallel(files, workers)
+            self.assertEqual(expected.numCategories(), k.numCategories())
+            self.assertEqual(expected._brain._toDict(), k._brain._toDict(), msg="workers=%d" % workers)
+
+    def test02_order( self ):
+        # categories defined again replace the earlier ones, in the order
+        # of the globs
+        a = self._aiml("a.aiml", [("HELLO", "from a"), ("ONLY A", "a")])
+        b = self._aiml("b.aiml", [("HELLO", "from b")])
+        for globs, expected in (([a, b], u"from b"), ([b, a], u"from a")):
+            k = new_kernel()
+            k.learnParallel(globs, workers=2)
+            self.assertEqual(expected, k.respond(u"hello"))
+            self.assertEqual(u"a", k.respond(u"only a"))
+
+    def test03_error( self ):
+        # files that do not parse are reported and skipped
+        bad = os.path.join(self.tmpdir, "bad.aiml")
+        with open(bad, "w") as f:
+            f.write("<aiml><category><pattern>BROKEN")
+        self._aiml("good.aiml", [("HELLO", "hi")])
+        k = new_kernel()
+        stderr, sys.stderr = sys.stderr, io.StringIO()
+        try:
+            k.learnParallel(os.path.join(self.tmpdir, "*.aiml"), workers=2)
+            errors = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        self.assertIn("bad.aiml", errors)
+        self.assertEqual(1, k.numCategories())
+        self.assertEqual(u"hi", k.respond(u"hello"))
+
+    def test04_parser_backend( self ):
+        # learn() and the worker processes of learnParallel() parse with
+        # the backend of the kernel
+        files = os.path.join(BOT, "sara", "*.aiml")
+        expected = new_kernel()
+        expected.learn(files)
+        for workers in (None, 1, 3):
+            k = new_kernel()
+            k.setParserBackend("expat")
+            if workers is None:
+                k.learn(files)
+            else:
+                k.learnParallel(files, workers)
+            self.assertEqual(expected._brain._toDict(), k._brain._toDict(), msg="workers=%s" % workers)
+        self.assertRaises(ValueError, k.setParserBackend, "lxml")
+        self.assertEqual("expat", k._parserBackend)
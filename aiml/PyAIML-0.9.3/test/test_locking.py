@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import functools
+import os
+import os.path
+import random
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from aiml import Kernel
+from aiml.SessionStore import MemorySessionStore
+from aiml.ReadWriteLock import ReadWriteLock
+
+from .test_patternmgr import load_brain, sample_inputs
+
+
+def run_threads(targets, timeout=30):
+    """Run each function in its own thread, and return whether they all
+    finished in time."""
+    threads = [threading.Thread(target=target) for target in targets]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    deadline = time.time() + timeout
+    for thread in threads:
+        thread.join(max(0, deadline - time.time()))
+    return not any(thread.is_alive() for thread in threads)
+
+
+class TestReadWriteLock( unittest.TestCase ):
+
+    longMessage = True
+
+    def test01_readers( self ):
+        # readers do not wait for each other
+        lock = ReadWriteLock()
+        inside = threading.Event()
+        def reader():
+            with lock.reader:
+                inside.set()
+                time.sleep(0.2)
+        thread = threading.Thread(target=reader)
+        thread.start()
+        inside.wait()
+        with lock.reader:
+            self.assertTrue(thread.is_alive())
+        thread.join()
+
+    def test02_writer( self ):
+        lock = ReadWriteLock()
+        events = []
+        def writer():
+            with lock.writer:
+                events.append("write")
+        with lock.reader:
+            thread = threading.Thread(target=writer)
+            thread.start()
+            time.sleep(0.1)
+            events.append("read")
+        thread.join()
+        self.assertEqual(["read", "write"], events)
+
+    def test03_reentrant( self ):
+        lock = ReadWriteLock()
+        with lock.writer:
+            with lock.writer:
+                with lock.reader:
+                    pass
+        with lock.reader:
+            with lock.reader:
+                pass
+        self.assertRaises(RuntimeError, lock.releaseRead)
+        self.assertRaises(RuntimeError, lock.releaseWrite)
+
+    def test04_upgrade( self ):
+        # two readers that both start writing do not deadlock
+        lock = ReadWriteLock()
+        order = []
+        def upgrade(name):
+            def run():
+                with lock.reader:
+                    time.sleep(0.1)
+                    with lock.writer:
+                        order.append(name)
+                    order.append(name)
+            return run
+        self.assertTrue(run_threads([upgrade(1), upgrade(2)]))
+        self.assertEqual(4, len(order))
+
+
+class TestSessionLocking( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        self.k = Kernel()
+        self.k.verbose(False)
+        self.k.learn(os.path.join(os.path.dirname(__file__), "self-test.aiml"))
+        self.k.setLockingMode('session')
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _learnString(self, aiml):
+        filename = os.path.join(self.tmpdir, "%d.aiml" % len(os.listdir(self.tmpdir)))
+        with open(filename, "w") as f:
+            f.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n'
+                    '<aiml version="1.0.1">%s</aiml>\n' % aiml)
+        self.k.learn(filename)
+        return filename
+
+    def test01_mode( self ):
+        self.assertRaises(ValueError, self.k.setLockingMode, 'none')
+        self.assertEqual(u"My name is Nameless", self.k.respond(u"test bot"))
+        self.k.setLockingMode('global')
+        self.assertEqual(u"My name is Nameless", self.k.respond(u"test bot"))
+
+    def test02_concurrent( self ):
+        # a response that waits for one of another session: in the
+        # 'global' mode, they would deadlock
+        started = threading.Event()
+        def wait(elem, sessionID):
+            if sessionID == "first":
+                started.set()
+                done.wait(10)
+            else:
+                started.wait(10)
+            return u"done"
+        done = threading.Event()
+        self.k._elementProcessors['id'] = wait
+        self._learnString('<category><pattern>WAIT</pattern><template><id/></template></category>')
+        responses = {}
+        def answer(sessionID):
+            def run():
+                responses[sessionID] = self.k.respond(u"wait", sessionID)
+                done.set()
+            return run
+        self.assertTrue(run_threads([answer("first"), answer("second")]))
+        self.assertEqual({"first": u"done", "second": u"done"}, responses)
+
+    def test03_session( self ):
+        # responses of a single session still run one at a time
+        active = []
+        overlaps = []
+        def wait(elem, sessionID):
+            overlaps.append(len(active))
+            active.append(sessionID)
+            time.sleep(0.05)
+            active.remove(sessionID)
+            return u""
+        self.k._elementProcessors['id'] = wait
+        self._learnString('<category><pattern>WAIT</pattern><template><id/></template></category>')
+        self.assertTrue(run_threads([lambda: self.k.respond(u"wait", "same")] * 4))
+        self.assertEqual([0, 0, 0, 0], overlaps)
+
+    def test04_learn( self ):
+        # <learn> waits for the other sessions' responses, which then
+        # see the new categories
+        target = self._learnString('<category><pattern>OLD</pattern><template>old</template></category>')
+        with open(target, "w") as f:
+            f.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n<aiml version="1.0.1">'
+                    '<category><pattern>NEW</pattern><template>new</template></category></aiml>\n')
+        self._learnString('<category><pattern>LEARN</pattern><template>'
+                          '<learn>%s</learn>learned</template></category>' % target)
+        responses = []
+        def learn(sessionID):
+            return lambda: responses.append(self.k.respond(u"learn", sessionID))
+        self.assertTrue(run_threads([learn("first"), learn("second")]))
+        self.assertEqual([u"learned", u"learned"], responses)
+        self.assertEqual(u"new", self.k.respond(u"new", "third"))
+
+    def test05_brain( self ):
+        # sessions answered at once get the responses they get alone
+        k = load_brain('alice')
+        inputs = [u" ".join(words) for words, that, topic in sample_inputs(k._brain)[::20]]
+        def converse(sessionID, responses):
+            for input_ in inputs:
+                # (<id/>)
+                responses.append(k.respond(input_, sessionID).replace(sessionID, u"ID"))
+        shuffle, random.shuffle = random.shuffle, lambda items: None
+        asctime, time.asctime = time.asctime, lambda *args: u"Sat Oct 17 12:00:00 2026"
+        try:
+            expected = []
+            converse("session-alone", expected)
+            k.setSraiCacheSize(100)
+            k.setResponseCacheSize(100)
+            k.setLockingMode('session')
+            results = dict((i, []) for i in range(4))
+            self.assertTrue(run_threads([functools.partial(converse, "session-%d" % i, responses)
+                                         for i, responses in results.items()], timeout=600))
+        finally:
+            random.shuffle = shuffle
+            time.asctime = asctime
+        for responses in results.values():
+            self.assertEqual(expected, responses)
+
+    def test06_bounded( self ):
+        # the locks of the sessions go with their responses, whether the
+        # session store keeps the sessions or forgets them
+        self.k.setSessionStore(MemorySessionStore(maxSessions=10))
+        held = []
+        def converse(first):
+            for i in range(first, 2000, 4):
+                self.k.respond(u"test bot", "session-%d" % i)
+                held.append(len(self.k._sessionLocks))
+        self.assertTrue(run_threads([functools.partial(converse, i) for i in range(4)]))
+        self.assertEqual(2000, len(held))
+        self.assertLessEqual(max(held), 4)
+        self.assertEqual({}, self.k._sessionLocks)
+        self.assertLessEqual(len(self.k._normalized), 11)
+        self.assertLessEqual(len(self.k._matchStack), 11)
+        self.assertEqual(0, len(self.k._sessionChanges))
+        self.assertEqual(u"My name is Nameless", self.k.respond(u"test bot", "session-0"))
+        self.assertEqual({}, self.k._sessionLocks)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import glob
+import io
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+import xml.sax
+
+from aiml.AimlParser import create_parser
+
+
+BOT = os.path.join(os.path.dirname(__file__), "..", "..", "..", "bot")
+
+
+def parse(filename, backend):
+    """Return the categories parsed from filename by backend, and what it
+    wrote to stderr (or the SAXParseException raised)."""
+    parser = create_parser(backend)
+    handler = parser.getContentHandler()
+    handler.setEncoding(None)
+    stderr, sys.stderr = sys.stderr, io.StringIO()
+    try:
+        parser.parse(filename)
+        return handler.categories, handler.getNumErrors(), sys.stderr.getvalue()
+    except xml.sax.SAXParseException as e:
+        return str(e), e.getLineNumber(), e.getColumnNumber()
+    finally:
+        sys.stderr = stderr
+
+
+class TestParserBackends( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _aiml(self, text):
+        filename = os.path.join(self.tmpdir, "test.aiml")
+        with io.open(filename, "w", encoding="utf-8") as f:
+            f.write(text)
+        return filename
+
+    def test01_brains( self ):
+        # the bundled brains, errors included (alisochka has many)
+        for name in ("sara", "alice", "alisochka"):
+            for f in sorted(glob.glob(os.path.join(BOT, name, "*.aiml"))):
+                self.assertEqual(parse(f, "sax"), parse(f, "expat"), msg=f)
+
+    def test02_self_test( self ):
+        f = os.path.join(os.path.dirname(__file__), "self-test.aiml")
+        categories = parse(f, "expat")[0]
+        self.assertTrue(categories)
+        self.assertEqual(parse(f, "sax"), parse(f, "expat"))
+
+    def test03_text( self ):
+        # text split by entities and lines, whitespace, and AIML errors
+        f = self._aiml(u'''<?xml version="1.0" encoding="UTF-8"?>
+<aiml version="1.0.1">
+<category><pattern>A &amp; B</pattern>
+<template>one &lt;
+two <random> <li>x</li>
+  <li>y &amp; z</li> </random>
+<set name="it" xml:space="preserve">  it </set></template></category>
+<category><pattern>BAD</pattern><template><random>text</random></template></category>
+<category><pattern>BAD TOO</pattern><template><star index="x"/></template></category>
+<topic name="T"><category><pattern>ÁÉ</pattern><that>HI</that><template>ok</template></category></topic>
+</aiml>
+''')
+        result = parse(f, "expat")
+        self.assertEqual(parse(f, "sax"), result)
+        categories, errors, stderr = result
+        self.assertEqual(2, errors)
+        self.assertEqual(2, len(categories))
+        self.assertIn((u"A & B", u"*", u"*"), categories)
+        self.assertIn((u"ÁÉ", u"HI", u"T"), categories)
+        self.assertIn(u"line 9", stderr)
+
+    def test04_malformed( self ):
+        f = self._aiml(u'<aiml version="1.0">\n<category><pattern>A</pattern>\n<template>x</category></aiml>\n')
+        result = parse(f, "expat")
+        self.assertEqual(parse(f, "sax"), result)
+        self.assertEqual(3, result[1])
+        self.assertIn("mismatched tag", result[0])
+
+    def test05_unknown( self ):
+        self.assertRaises(ValueError, create_parser, "lxml")
@@ -0,0 +1,528 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import glob
+import io
+import os.path
+import random
+import sys
+import tempfile
+import time
+import unittest
+
+from aiml import Kernel
+from aiml import MappedBrain
+from aiml.PatternMgr import MatchBudget, PatternMgr, _UNBOUNDED
+
+
+# The AIML sets bundled with the Speak activity
+BOTDIR = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'bot')
+BRAINS = ('alice', 'sara', 'alisochka')
+
+_kernels = {}
+
+def load_brain(name):
+    """Return a Kernel that has learned all the AIML files of a bundled
+    brain.  Kernels are cached, since learning ALICE takes a while."""
+    if name not in _kernels:
+        k = Kernel()
+        k.verbose(False)
+        # the bundled sets produce a lot of (harmless) parse warnings
+        stderr, sys.stderr = sys.stderr, io.StringIO()
+        try:
+            for f in sorted(glob.glob(os.path.join(BOTDIR, name, '*.aiml'))):
+                k.learn(f)
+        finally:
+            sys.stderr = stderr
+        _kernels[name] = k
+    return _kernels[name]
+
+
+def sample_inputs(brain, seed=1234):
+    """Generate (input, that, topic) word lists that exercise every category
+    in the brain, plus some word salad to force plenty of backtracking."""
+    rnd = random.Random(seed)
+    fillers = (['XYZZY'], ['FOO', 'BAR'], ['WHAT', 'IS', 'IT'])
+    vocabulary = set()
+
+    def instantiate(pattern):
+        words = []
+        for w in pattern.split():
+            if w in ('*', '_'):
+                words.extend(rnd.choice(fillers))
+            elif w == 'BOT_NAME':
+                words.append(brain._botName)
+            else:
+                words.append(w)
+                vocabulary.add(w)
+        return words
+
+    samples = []
+    for (pattern, that, topic), template in brain.categories():
+        samples.append((instantiate(pattern), instantiate(that) or ['ULTRABOGUSDUMMYTHAT'],
+                        instantiate(topic) or ['ULTRABOGUSDUMMYTOPIC']))
+    vocabulary = sorted(vocabulary)
+    for i in range(2000):
+        words = [rnd.choice(vocabulary) for _ in range(rnd.randint(1, 12))]
+        samples.append((words, ['ULTRABOGUSDUMMYTHAT'], ['ULTRABOGUSDUMMYTOPIC']))
+    return samples
+
+
+class TestMatchEngines( unittest.TestCase ):
+
+    longMessage = True
+
+    def _testEquivalence(self, name):
+        brain = load_brain(name)._brain
+        for words, that, topic in sample_inputs(brain):
+            expected = brain._match(words, that, topic, brain._root)
+            msg = "brain=%s input=%s that=%s topic=%s" % (name, words, that, topic)
+            for matcher in (brain._matchIterative, brain._matchMemoized):
+                result = matcher(words, that, topic, brain._root)
+                self.assertEqual(expected[0], result[0], msg=msg)
+                self.assertIs(expected[1], result[1], msg=msg)
+
+    def test01_alice( self ):
+        self._testEquivalence('alice')
+
+    def test02_sara( self ):
+        self._testEquivalence('sara')
+
+    def test03_alisochka( self ):
+        self._testEquivalence('alisochka')
+
+    def test04_select( self ):
+        k = Kernel()
+        k.verbose(False)
+        k.learn(os.path.join(os.path.dirname(__file__), "self-test.aiml"))
+        for engine in ('iterative', 'memoized'):
+            k.setMatchEngine(engine)
+            self.assertEqual(k.respond('test star having multiple stars in a pattern makes me extremely happy'),
+                             'Multiple stars matched: having, stars in a pattern, extremely happy')
+        self.assertRaises(ValueError, k.setMatchEngine, 'quantum')
+
+
+class TestPatternTree( unittest.TestCase ):
+
+    longMessage = True
+
+    def test01_save_restore( self ):
+        brain = load_brain('sara')._brain
+        fd, filename = tempfile.mkstemp(suffix='.brn')
+        os.close(fd)
+        try:
+            brain.save(filename)
+            restored = PatternMgr()
+            restored.restore(filename)
+        finally:
+            os.remove(filename)
+        self.assertEqual(brain.numTemplates(), restored.numTemplates())
+        self.assertEqual(brain._toDict(), restored._toDict())
+        self.assertEqual(sorted(brain.categories()), sorted(restored.categories()))
+
+    def test02_sentinels( self ):
+        pm = PatternMgr()
+        pm.add((u"HELLO BOT_NAME", u"BOT_NAME *", u"_"), ['template', {}])
+        self.assertEqual([((u"HELLO BOT_NAME", u"BOT_NAME *", u"_"), ['template', {}])],
+                         list(pm.categories()))
+        # BOT_NAME is only special in the main pattern
+        self.assertIsNotNone(pm._root.children[pm._vocabulary.get(u"HELLO")].botName)
+        self.assertIsNotNone(pm._vocabulary.get(u"BOT_NAME"))
+
+
+class TestNodeBounds( unittest.TestCase ):
+
+    longMessage = True
+
+    def _nodes(self, pm):
+        nodes = [pm._root]
+        for node in nodes:
+            nodes.extend(child for key, child in pm._edges(node))
+        return nodes
+
+    def test01_values( self ):
+        pm = PatternMgr()
+        pm.add((u"HELLO THERE FRIEND", u"", u""), ['template', {}])
+        pm.add((u"HELLO BOT_NAME", u"WHAT * IS IT", u""), ['template', {}])
+        root = pm._root
+        hello = root.children[pm._vocabulary.get(u"HELLO")]
+        self.assertEqual((2, 3), (root.minWords, root.maxWords))
+        self.assertEqual((0, 0), (hello.botName.minWords, hello.botName.maxWords))
+        that = hello.botName.that
+        self.assertEqual((4, _UNBOUNDED), (that.minWords, that.maxWords))
+        pm.add((u"HELLO *", u"", u""), ['template', {}])
+        self.assertEqual((1, _UNBOUNDED), (hello.minWords, hello.maxWords))
+        self.assertEqual((0, 0), (hello.star.minWords, hello.star.maxWords))
+
+    def test02_restore( self ):
+        # bounds worked out at once, for brains saved without them, are
+        # the same as those kept up to date by add()
+        brain = load_brain('sara')._brain
+        tree = brain._toDict()
+        stack = [tree]
+        while stack:
+            d = stack.pop()
+            del d[PatternMgr._BOUNDS]
+            stack.extend(v for k, v in d.items() if k != PatternMgr._TEMPLATE)
+        restored = PatternMgr()
+        restored._fromDict(tree)
+        self.assertEqual(brain._toDict(), restored._toDict())
+
+    def test03_pruning( self ):
+        # the bounds change how much is searched, not what is found
+        brain = load_brain('sara')._brain
+        unbounded = PatternMgr()
+        unbounded._fromDict(brain._toDict())
+        for node in self._nodes(unbounded):
+            node.minWords, node.maxWords = 0, _UNBOUNDED
+        visits = [0, 0]
+        for words, that, topic in sample_inputs(brain)[::3]:
+            results = []
+            for i, pm in enumerate((brain, unbounded)):
+                budget = MatchBudget()
+                results.append(pm._match(words, that, topic, pm._root, budget))
+                visits[i] += budget.visits
+            self.assertEqual(results[0][0], results[1][0], msg=words)
+            self.assertEqual(results[0][1], results[1][1], msg=words)
+        self.assertLess(visits[0], visits[1])
+
+
+def reference_match(words, thatWords, topicWords, root, botName):
+    """The matching algorithm as originally written, trying every split of
+    the wildcards, over the nested dictionaries of PatternMgr._toDict()."""
+    if len(words) == 0:
+        pattern, template = [], None
+        if len(thatWords) > 0:
+            if PatternMgr._THAT in root:
+                pattern, template = reference_match(thatWords, [], topicWords, root[PatternMgr._THAT], botName)
+                if template is not None:
+                    pattern = [PatternMgr._THAT] + pattern
+        elif len(topicWords) > 0:
+            if PatternMgr._TOPIC in root:
+                pattern, template = reference_match(topicWords, [], [], root[PatternMgr._TOPIC], botName)
+                if template is not None:
+                    pattern = [PatternMgr._TOPIC] + pattern
+        if template is None:
+            pattern, template = [], root.get(PatternMgr._TEMPLATE)
+        return pattern, template
+    first, suffix = words[0], words[1:]
+    for key in (PatternMgr._UNDERSCORE, first, PatternMgr._BOT_NAME, PatternMgr._STAR):
+        if key not in root or (key == PatternMgr._BOT_NAME and first != botName):
+            continue
+        splits = range(len(suffix) + 1) if key in (PatternMgr._UNDERSCORE, PatternMgr._STAR) else [0]
+        for j in splits:
+            pattern, template = reference_match(suffix[j:], thatWords, topicWords, root[key], botName)
+            if template is not None:
+                return [first if key == PatternMgr._BOT_NAME else key] + pattern, template
+    return None, None
+
+
+class TestUnknownWords( unittest.TestCase ):
+
+    longMessage = True
+
+    def test01_typos( self ):
+        # misspelt words, which no pattern uses, are left to the wildcards
+        brain = load_brain('sara')._brain
+        tree = brain._toDict()
+        rnd = random.Random(42)
+        for words, that, topic in sample_inputs(brain)[::5]:
+            typos = [w[:-1] + u"X" if rnd.random() < 0.3 else w for w in words]
+            expected = reference_match(typos, that, topic, tree, brain._botName)
+            for engine in ('recursive', 'iterative', 'memoized'):
+                brain.setMatchEngine(engine)
+                result = brain._matcher(typos, that, topic, brain._root)
+                self.assertEqual(expected, result, msg="%s: %s" % (engine, typos))
+        brain.setMatchEngine('recursive')
+
+    def test02_visits( self ):
+        pm = PatternMgr()
+        pm.add((u"* IS * ABOUT *", u"*", u"*"), ['template', {}, 'about'])
+        words = u" ".join([u"blah"] * 40 + [u"is"] + [u"blah"] * 40 + [u"about it"])
+        for engine in ('recursive', 'iterative'):
+            pm.setMatchEngine(engine)
+            profile = pm.profile(words, u"", u"")
+            self.assertEqual((u"* IS * ABOUT *", u"*", u"*"), profile.pattern)
+            # each wildcard goes straight to the next word of the pattern
+            self.assertLess(profile.visits, 20, msg=engine)
+
+
+class TestMappedBrain( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        self.brain = load_brain('sara')._brain
+        fd, self.brnFile = tempfile.mkstemp(suffix='.brn')
+        os.close(fd)
+        fd, self.mappedFile = tempfile.mkstemp(suffix='.brm')
+        os.close(fd)
+        self.brain.save(self.brnFile)
+        MappedBrain.convert(self.brnFile, self.mappedFile)
+        self.mapped = PatternMgr()
+        self.mapped.restoreMapped(self.mappedFile)
+
+    def tearDown(self):
+        if self.mapped._mapped is not None:
+            self.mapped._mapped.close()
+        os.remove(self.brnFile)
+        os.remove(self.mappedFile)
+
+    def test01_contents( self ):
+        self.assertTrue(MappedBrain.isMappedBrain(self.mappedFile))
+        self.assertFalse(MappedBrain.isMappedBrain(self.brnFile))
+        self.assertEqual(self.brain.numTemplates(), self.mapped.numTemplates())
+        self.assertEqual(self.brain._toDict(), self.mapped._toDict())
+
+    def test02_match( self ):
+        for engine in ('recursive', 'iterative', 'memoized'):
+            for words, that, topic in sample_inputs(self.brain):
+                expected = self.brain._match(words, that, topic, self.brain._root)
+                self.mapped.setMatchEngine(engine)
+                result = self.mapped._matcher(words, that, topic, self.mapped._root)
+                self.assertEqual(expected, result, msg="input=%s" % words)
+
+    def test03_add( self ):
+        # adding to a mapped brain copies it into memory first
+        self.mapped.add((u"A BRAND NEW PATTERN", u"*", u"*"), ['template', {}])
+        self.assertIsNone(self.mapped._mapped)
+        self.assertEqual(self.brain.numTemplates() + 1, self.mapped.numTemplates())
+        self.assertEqual(['template', {}], self.mapped.match(u"a brand new pattern", u"", u""))
+
+    def test04_kernel( self ):
+        k = Kernel()
+        k.verbose(False)
+        k.loadBrain(self.mappedFile)
+        self.assertIsNotNone(k._brain._mapped)
+        self.assertEqual(self.brain.numTemplates(), k.numCategories())
+        reference = Kernel()
+        reference.verbose(False)
+        reference.loadBrain(self.brnFile)
+        for input_ in (u"hola", u"como te llamas", u"me llamo Pedro", u"adios"):
+            random.seed(input_)
+            expected = reference.respond(input_)
+            random.seed(input_)
+            self.assertEqual(expected, k.respond(input_))
+
+
+class TestNormalize( unittest.TestCase ):
+
+    longMessage = True
+
+    def test01_tokens( self ):
+        pm = PatternMgr()
+        n = pm.normalize(u"Hello,  it's  me -- Tom!")
+        self.assertEqual([u"HELLO", u"IT", u"S", u"ME", u"TOM"], n.words)
+        self.assertEqual([0, 1, 1, 2, 4], list(n.origins))
+        self.assertEqual(u"it's me -- Tom!", n.originalWords(1, 4))
+        self.assertEqual([u"ULTRABOGUSDUMMYTHAT"], pm.normalize(u"  ", pm._DUMMY_THAT).words)
+
+    def test02_star( self ):
+        pm = PatternMgr()
+        pm.add((u"MY NAME IS *", u"*", u"*"), ['template', {}])
+        # a word split by punctuation still comes back whole
+        self.assertEqual(u"O'Brien, Pat", pm.star('star', u"my name is O'Brien, Pat", u"", u"", 1))
+        n = pm.normalize(u"my name is O'Brien, Pat")
+        self.assertEqual(u"O'Brien, Pat",
+                         pm.star('star', n, pm.normalize(u"", pm._DUMMY_THAT),
+                                 pm.normalize(u"", pm._DUMMY_TOPIC), 1))
+
+    def test03_kernel_cache( self ):
+        k = Kernel()
+        k.verbose(False)
+        k.learn(os.path.join(os.path.dirname(__file__), "self-test.aiml"))
+        k.setPredicate("topic", "Soylent Green", "tom")
+        k.respond(u"test topicstar", "tom")
+        cached = k._normalized["tom"]["topic"][1]
+        self.assertEqual(u"Solyent Green is made of people!", k.respond(u"test topicstar", "tom"))
+        self.assertIs(cached, k._normalized["tom"]["topic"][1])
+        k.setPredicate("topic", "Soylent Ham and Cheese", "tom")
+        self.assertEqual(u"Both Soylents Ham and Cheese are made of people!",
+                         k.respond(u"test topicstar multiple", "tom"))
+        self.assertIsNot(cached, k._normalized["tom"]["topic"][1])
+        self.assertEqual([], k._matchStack["tom"])
+
+
+class TestMatchContext( unittest.TestCase ):
+
+    longMessage = True
+
+    def test01_spans( self ):
+        pm = PatternMgr()
+        pm.add((u"I LIKE * AND *", u"* SAID *", u"_"), ['template', {}])
+        context = pm.matchContext(u"I like and cheese and wine", u"She said yes, really", u"food")
+        self.assertEqual([(2, 4), (5, 6)], context.stars['star'])
+        self.assertEqual(u"and cheese", context.star('star', 1))
+        self.assertEqual(u"wine", context.star('star', 2))
+        self.assertEqual(u"", context.star('star', 3))
+        self.assertEqual(u"yes, really", context.star('thatstar', 2))
+        self.assertEqual(u"food", context.star('topicstar', 1))
+        self.assertRaises(ValueError, context.star, 'moonstar', 1)
+        self.assertIsNone(pm.matchContext(u"you like cheese", u"", u""))
+
+    def test02_tiling( self ):
+        # the spans of every match cover the input exactly, with the
+        # literal words of the pattern in between
+        for name in ('sara', 'alisochka'):
+            brain = load_brain(name)._brain
+            for words, that, topic in sample_inputs(brain)[::7]:
+                path, template = brain._match(words, that, topic, brain._root)
+                if template is None:
+                    continue
+                stars = brain._captures(path, words, that, topic)
+                segments = {'star': ([], words), 'thatstar': ([], that), 'topicstar': ([], topic)}
+                segment = 'star'
+                for key in path:
+                    if key == brain._THAT: segment = 'thatstar'
+                    elif key == brain._TOPIC: segment = 'topicstar'
+                    else: segments[segment][0].append(key)
+                for starType, (keys, tokens) in segments.items():
+                    if not keys:
+                        continue
+                    spans = iter(stars[starType])
+                    rebuilt = []
+                    for key in keys:
+                        if key in (brain._STAR, brain._UNDERSCORE):
+                            start, end = next(spans)
+                            self.assertEqual(len(rebuilt), start)
+                            rebuilt.extend(tokens[start:end])
+                        else:
+                            rebuilt.append(key)
+                    self.assertEqual(tokens, rebuilt, msg="input=%s" % words)
+
+
+    def test03_split_word( self ):
+        # a word split by punctuation is two words to the matcher; star()
+        # used to realign the pattern over the input and ended the first
+        # star after "is", leaving the second one empty (this input comes
+        # from ALICE's "SERAIT CE *", which srai's "C'EST <star/>")
+        pm = PatternMgr()
+        pm.add((u"* IS *", u"*", u"*"), ['template', {}])
+        context = pm.matchContext(u"C'EST MY NAME IS BOB", u"", u"")
+        self.assertEqual(u"C'EST MY NAME", context.star('star', 1))
+        self.assertEqual(u"BOB", context.star('star', 2))
+        self.assertEqual(u"BOB", pm.star('star', u"C'EST MY NAME IS BOB", u"", u"", 2))
+
+class TestMatchBudget( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        # three wildcards that almost fit: every split of the input is tried
+        self.pm = PatternMgr()
+        self.pm.add((u"* A * A * A * B", u"*", u"*"), ['template', {}, 'backtracked'])
+        self.pm.add((u"HELLO *", u"*", u"*"), ['template', {}, 'hello'])
+        self.words = u" ".join([u"A"] * 30)
+
+    def test01_counts( self ):
+        # both engines visit the same nodes, budget or not
+        brain = load_brain('sara')._brain
+        for words, that, topic in sample_inputs(brain)[::11]:
+            counts = []
+            for matcher in (brain._match, brain._matchIterative):
+                budget = MatchBudget()
+                counts.append((matcher(words, that, topic, brain._root, budget),
+                               budget.visits, budget.backtracks))
+            self.assertEqual(counts[0][0][0], counts[1][0][0], msg=words)
+            self.assertEqual(counts[0][1:], counts[1][1:], msg=words)
+            self.assertGreater(counts[0][1], counts[0][2], msg=words)
+
+    def test02_visits( self ):
+        profile = self.pm.profile(self.words, u"", u"")
+        self.assertIsNone(profile.pattern)
+        self.assertFalse(profile.exhausted)
+        self.assertEqual(profile.visits, profile.backtracks)
+        fallback = ['template', {}, 'too long']
+        for engine in ('recursive', 'iterative'):
+            self.pm.setMatchEngine(engine)
+            self.pm.setMatchBudget(maxVisits=profile.visits // 10, fallback=fallback)
+            context = self.pm.matchContext(self.words, u"", u"")
+            self.assertTrue(context.exhausted)
+            self.assertIs(fallback, context.template)
+            self.assertEqual(u"", context.star('star', 1))
+            self.assertTrue(self.pm.profile(self.words, u"", u"").exhausted)
+            # matches within the budget are not affected
+            context = self.pm.matchContext(u"hello there", u"", u"")
+            self.assertFalse(context.exhausted)
+            self.assertEqual(u"there", context.star('star', 1))
+            self.pm.setMatchBudget(maxVisits=profile.visits // 10)
+            self.assertIsNone(self.pm.matchContext(self.words, u"", u""))
+
+    def test03_seconds( self ):
+        self.pm.setMatchBudget(maxSeconds=0.01, fallback=['template', {}])
+        start = time.time()
+        context = self.pm.matchContext(u" ".join([u"A"] * 200), u"", u"")
+        self.assertTrue(context.exhausted)
+        self.assertLess(time.time() - start, 1)
+
+    def test04_kernel( self ):
+        k = Kernel()
+        k.verbose(False)
+        k.learn(os.path.join(os.path.dirname(__file__), "self-test.aiml"))
+        k._brain.add((u"* A * A * A * B", u"*", u"*"), [u'template', {}, [u'text', {u'xml:space': u'default'}, u'backtracked']])
+        k.setResponseCacheSize(100)
+        k.setMatchBudget(maxVisits=1000, fallback=u"Too long.")
+        self.assertEqual(u"Too long.", k.respond(self.words))
+        self.assertEqual(u"Too long.", k.respond(self.words))
+        # never cached
+        self.assertEqual(0, k.cacheStats()['response']['size'])
+        self.assertEqual(u"Formal Test Passed", k.respond(u"test formal"))
+        profile, = k.profileMatch(self.words)
+        self.assertTrue(profile.exhausted)
+        k.setMatchBudget()
+        profile, = k.profileMatch(self.words + u" b")
+        self.assertEqual((u"* A * A * A * B", u"*", u"*"), profile.pattern)
+        self.assertFalse(profile.exhausted)
+        self.assertEqual(u"backtracked", k.respond(self.words + u" b"))
+
+
+class TestMemoizedMatch( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        self.pm = PatternMgr()
+        self.pm.setBotName(u"Alice")
+        self.pm.add((u"* A * A * A * B", u"*", u"*"), ['template', {}, 'backtracked'])
+        self.pm.add((u"* IS * ABOUT *", u"*", u"*"), ['template', {}, 'about'])
+        self.pm.add((u"* IS * ABOUT *", u"* ABOUT *", u"*"), ['template', {}, 'that'])
+        self.pm.add((u"_ ALICE", u"*", u"*"), ['template', {}, 'underscore'])
+        self.pm.add((u"HELLO ALICE", u"*", u"*"), ['template', {}, 'word'])
+        self.pm.add((u"HELLO BOT_NAME", u"*", u"*"), ['template', {}, 'bot name'])
+        self.pm.add((u"HELLO *", u"*", u"*"), ['template', {}, 'star'])
+
+    def _match(self, engine, pattern, that=u"", topic=u""):
+        self.pm.setMatchEngine(engine)
+        context = self.pm.matchContext(pattern, that, topic)
+        if context is None:
+            return None
+        return context.template, context.stars
+
+    def test01_same( self ):
+        for pattern, that in ((u"hello alice", u""),
+                              (u"hi there alice", u""),
+                              (u"hello bob", u""),
+                              (u"this is a story about it is about time", u""),
+                              (u"this is a story about it", u"it is all about them"),
+                              (u"a a b a x a b a c a b", u""),
+                              (u"a a a a a a a a a a", u"")):
+            expected = self._match('recursive', pattern, that)
+            self.assertEqual(expected, self._match('memoized', pattern, that), msg=pattern)
+        # _ before words before the bot name before *
+        self.assertEqual('underscore', self._match('memoized', u"hello alice")[0][2])
+        self.assertEqual('star', self._match('memoized', u"hello bob")[0][2])
+
+    def test02_visits( self ):
+        # without the memo, every split of the three wildcards is tried
+        words = u" ".join([u"A"] * 30)
+        self.pm.setMatchEngine('recursive')
+        plain = self.pm.profile(words, u"", u"")
+        self.pm.setMatchEngine('memoized')
+        memoized = self.pm.profile(words, u"", u"")
+        self.assertIsNone(plain.pattern)
+        self.assertIsNone(memoized.pattern)
+        self.assertLess(memoized.visits * 20, plain.visits)
+        # and the work grows polynomially with the length of the input
+        longer = self.pm.profile(u" ".join([u"A"] * 120) + u" B", u"", u"")
+        self.assertEqual((u"* A * A * A * B", u"*", u"*"), longer.pattern)
+        self.assertLess(longer.visits, 120 * 120)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os
+import os.path
+import random
+import time
+import unittest
+
+from aiml import Kernel
+
+from .test_patternmgr import load_brain, sample_inputs
+
+
+class TestRespondMany( unittest.TestCase ):
+
+    longMessage = True
+
+    @classmethod
+    def setUpClass(cls):
+        cls.k = load_brain('alice')
+        # a log of conversations: a few sessions, repeating themselves
+        inputs = [u" ".join(words) for words, that, topic in sample_inputs(cls.k._brain)[:300:3]]
+        rnd = random.Random(1)
+        cls.log = [("s%d" % rnd.randrange(7), rnd.choice(inputs)) for i in range(400)]
+
+    def setUp(self):
+        self.shuffle, random.shuffle = random.shuffle, lambda items: None
+        self.asctime, time.asctime = time.asctime, lambda *args: u"Sat Oct 17 12:00:00 2026"
+
+    def tearDown(self):
+        random.shuffle = self.shuffle
+        time.asctime = self.asctime
+        self._deleteSessions()
+
+    def _deleteSessions(self):
+        for sessionID in set(sessionID for sessionID, input_ in self.log):
+            self.k._deleteSession(sessionID)
+
+    def _expected(self):
+        """The responses of respond(), and the session data."""
+        responses = [(sessionID, input_, self.k.respond(input_, sessionID))
+                     for sessionID, input_ in self.log]
+        data = self.k.getSessionData()
+        self._deleteSessions()
+        return responses, data
+
+    def _bySession(self, results):
+        sessions = {}
+        for sessionID, input_, response in results:
+            sessions.setdefault(sessionID, []).append((input_, response))
+        return sessions
+
+    def test01_respond( self ):
+        expected, data = self._expected()
+        for batchSize in (1, 10, 1000):
+            results = list(self.k.respondMany(self.log, batchSize))
+            self.assertEqual(len(expected), len(results))
+            self.assertEqual(self._bySession(expected), self._bySession(results), msg="batchSize=%d" % batchSize)
+            self.assertEqual(data, self.k.getSessionData())
+            self._deleteSessions()
+
+    def test02_batches( self ):
+        # each batch is answered in rounds, sorted by input
+        log = [("a", u"b"), ("a", u"a"), ("b", u"c"), ("b", u"a"), ("c", u"b")]
+        order = [(sessionID, input_) for sessionID, input_, response
+                 in self.k.respondMany(log, batchSize=4)]
+        self.assertEqual([("a", u"b"), ("b", u"c"), ("a", u"a"), ("b", u"a"), ("c", u"b")], order)
+        for sessionID in "abc":
+            self.k._deleteSession(sessionID)
+
+    def test03_lazy( self ):
+        consumed = []
+        def log():
+            for item in self.log:
+                consumed.append(item)
+                yield item
+        results = self.k.respondMany(log(), batchSize=10)
+        next(results)
+        self.assertEqual(10, len(consumed))
+        results.close()
+        self.assertEqual([], list(self.k.respondMany([])))
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "needs os.fork()")
+    def test04_processes( self ):
+        expected, data = self._expected()
+        results = list(self.k.respondMany(self.log, batchSize=20, processes=3))
+        self.assertEqual(self._bySession(expected), self._bySession(results))
+        # the sessions come back from the workers
+        self.assertEqual(data, self.k.getSessionData())
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "needs os.fork()")
+    def test05_error( self ):
+        k = Kernel()
+        k.verbose(False)
+        def fail(elem, sessionID):
+            raise ValueError("boom")
+        k._elementProcessors['bot'] = fail
+        k.learn(os.path.join(os.path.dirname(__file__), "self-test.aiml"))
+        with self.assertRaises(RuntimeError) as cm:
+            list(k.respondMany([("s", u"test bot")] * 5, processes=2))
+        self.assertIn("boom", str(cm.exception))
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import json
+import os
+import os.path
+import shutil
+import signal
+import socket
+import tempfile
+import time
+import unittest
+
+from aiml import Kernel
+
+
+@unittest.skipUnless(hasattr(os, 'fork') and hasattr(socket, 'AF_UNIX'),
+                     "needs fork() and Unix sockets")
+class TestServer( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        from aiml.script import server
+        self.server = server
+        self.tmpdir = tempfile.mkdtemp()
+        self.address = os.path.join(self.tmpdir, 'aiml.sock')
+        k = Kernel()
+        k.verbose(False)
+        k.learn(os.path.join(os.path.dirname(__file__), "self-test.aiml"))
+        def fail(elem, sessionID):
+            raise RuntimeError("broken element")
+        k._elementProcessors['date'] = fail
+        self.pid = os.fork()
+        if self.pid == 0:
+            try:
+                server.serve(k, self.address, workers=2)
+            finally:
+                os._exit(0)
+        while not os.path.exists(self.address):
+            time.sleep(0.01)
+
+    def tearDown(self):
+        if self.pid is not None:
+            os.kill(self.pid, signal.SIGINT)
+            os.waitpid(self.pid, 0)
+        shutil.rmtree(self.tmpdir)
+
+    def _connect(self):
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(self.address)
+        return conn, conn.makefile('rwb')
+
+    def _request(self, stream, request):
+        stream.write(json.dumps(request).encode('utf-8') + b'\n')
+        stream.flush()
+        return json.loads(stream.readline().decode('utf-8'))
+
+    def _workers(self):
+        """Return the pids of the workers, each kept busy by a connection
+        while the other is asked."""
+        connections = [self._connect() for i in range(2)]
+        try:
+            return set(self._request(stream, {'stats': True})['pid'] for conn, stream in connections)
+        finally:
+            for conn, stream in connections:
+                stream.close()
+                conn.close()
+
+    def _alive(self, pid):
+        try:
+            os.kill(pid, 0)
+            return True
+        except OSError:
+            return False
+
+    def test01_respond( self ):
+        self.assertEqual(u"srai test passed", self.server.ask(self.address, u"test srai"))
+        self.assertEqual(u"Your id is tom", self.server.ask(self.address, u"test id", session=u"tom"))
+
+    def test02_error( self ):
+        # a response that fails is answered with an error, on the same
+        # connection
+        conn, stream = self._connect()
+        try:
+            pid = self._request(stream, {'stats': True})['pid']
+            reply = self._request(stream, {'input': u"test date"})
+            self.assertIn(u"broken element", reply['error'])
+            self.assertEqual(u"srai test passed", self._request(stream, {'input': u"test srai"})['response'])
+            self.assertEqual(pid, self._request(stream, {'stats': True})['pid'])
+        finally:
+            stream.close()
+            conn.close()
+
+    def test03_respawn( self ):
+        # workers that die are replaced
+        workers = self._workers()
+        self.assertEqual(2, len(workers))
+        for pid in workers:
+            os.kill(pid, signal.SIGKILL)
+        self.assertEqual(u"srai test passed", self.server.ask(self.address, u"test srai"))
+        respawned = self._workers()
+        self.assertEqual(2, len(respawned))
+        self.assertFalse(workers & respawned)
+
+    def test04_terminate( self ):
+        # SIGTERM stops the workers, and removes the socket
+        workers = self._workers()
+        os.kill(self.pid, signal.SIGTERM)
+        os.waitpid(self.pid, 0)
+        self.pid = None
+        self.assertFalse(os.path.exists(self.address))
+        self.assertEqual([], [pid for pid in workers if self._alive(pid)])
+
+    def test05_memory_stats( self ):
+        stats = self.server.memory_stats('no-such-process')
+        self.assertEqual({}, stats)
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os.path
+import shutil
+import tempfile
+import time
+import unittest
+from collections import deque
+
+from aiml import Kernel
+from aiml.SessionStore import MemorySessionStore, SqliteSessionStore
+
+
+def new_kernel():
+    k = Kernel()
+    k.verbose(False)
+    k.learn(os.path.join(os.path.dirname(__file__), "self-test.aiml"))
+    return k
+
+
+class TestMemorySessionStore( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        self.k = new_kernel()
+
+    def test01_default( self ):
+        # every session is kept; the histories are bounded deques
+        for i in range(30):
+            self.k.respond(u"test input %d" % i, "user")
+        history = self.k.getPredicate(self.k._inputHistory, "user")
+        self.assertIsInstance(history, deque)
+        self.assertEqual([u"test input %d" % i for i in range(20, 30)], list(history))
+        self.assertEqual(u"You just said: test input", self.k.respond(u"test input"))
+        stats = self.k.sessionStats()
+        self.assertEqual((2, None, None, 0), (stats['sessions'], stats['maxSessions'],
+                                              stats['ttl'], stats['evictions']))
+        self.assertEqual((30, 2), (stats['hits'], stats['misses']), msg=stats)
+
+    def test02_lru( self ):
+        self.k.setSessionStore(MemorySessionStore(maxSessions=4))
+        for sessionID in "abc":
+            self.k.setPredicate("name", sessionID, sessionID)
+        self.k.respond(u"test bot", "a")
+        # the global session is kept: b, the least recently used, goes
+        self.k.respond(u"test bot", "d")
+        self.assertEqual(u"", self.k.getPredicate("name", "b"))
+        self.assertEqual([u"a", u"c"], [self.k.getPredicate("name", sessionID) for sessionID in "ac"])
+        self.assertNotIn("b", self.k._normalized)
+        stats = self.k.sessionStats()
+        self.assertEqual((4, 1), (stats['sessions'], stats['evictions']), msg=stats)
+        self.assertEqual(sorted(["_global", "a", "c", "d"]), sorted(self.k.getSessionData()))
+
+    def test03_ttl( self ):
+        store = MemorySessionStore(ttl=60)
+        self.k.setSessionStore(store)
+        now = [time.time()]
+        self.time, time.time = time.time, lambda: now[0]
+        try:
+            self.k.respond(u"test get and set", "old")
+            now[0] += 30
+            self.k.respond(u"test get and set", "new")
+            now[0] += 40
+            self.k.respond(u"test bot", "other")
+        finally:
+            time.time = self.time
+        self.assertEqual(u"", self.k.getPredicate("food", "old"))
+        self.assertEqual(u"cheese", self.k.getPredicate("food", "new"))
+        self.assertEqual(1, store.stats()['evictions'])
+
+    def test04_active( self ):
+        # the session of a response in progress is not forgotten
+        self.k.setSessionStore(MemorySessionStore(maxSessions=2))
+        def process(elem, sessionID):
+            self.k.respond(u"test bot", "other")
+            return self.k.getPredicate("name", sessionID)
+        self.k._elementProcessors['id'] = process
+        self.k.setTemplateEngine('interpreted')
+        self.k.setPredicate("name", u"kept", "user")
+        self.assertEqual(u"Your id is kept", self.k.respond(u"test id", "user"))
+        self.assertEqual(u"kept", self.k.getPredicate("name", "user"))
+
+    def test05_migrate( self ):
+        self.k.setPredicate("name", u"Ann", "user")
+        self.k.respond(u"test bot", "user")
+        self.k.setSessionStore(MemorySessionStore(maxSessions=10))
+        self.assertEqual(u"Ann", self.k.getPredicate("name", "user"))
+        self.assertEqual(u"I just said: My name is Nameless", self.k.respond(u"test that", "user"))
+
+
+class TestSqliteSessionStore( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "sessions.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test01_restart( self ):
+        k = new_kernel()
+        store = SqliteSessionStore(self.filename)
+        k.setSessionStore(store)
+        k.respond(u"test get and set", "user")
+        k.respond(u"test bot", "user")
+        store.close()
+
+        # a new kernel, as after a restart
+        k = new_kernel()
+        store = SqliteSessionStore(self.filename)
+        k.setSessionStore(store)
+        self.assertEqual(u"cheese", k.getPredicate("food", "user"))
+        self.assertEqual(u"I just said: My name is Nameless", k.respond(u"test that", "user"))
+        history = k.getPredicate(k._inputHistory, "user")
+        self.assertEqual([u"test get and set", u"test bot", u"test that"], list(history))
+        self.assertEqual(k._maxHistorySize, history.maxlen)
+        stats = k.sessionStats()
+        self.assertEqual((2, 0), (stats['loads'], stats['misses']), msg=stats)
+        store.close()
+
+    def test02_evict( self ):
+        # sessions leaving memory are written, and read back when needed
+        k = new_kernel()
+        store = SqliteSessionStore(self.filename, maxSessions=2, writeBatch=1)
+        k.setSessionStore(store)
+        for sessionID in ["a", "b", "c"]:
+            k.setPredicate("name", sessionID, sessionID)
+        self.assertNotIn("a", store)
+        self.assertEqual(u"a", k.getPredicate("name", "a"))
+        self.assertEqual(u"My name is Nameless", k.respond(u"test bot", "a"))
+        self.assertIn("a", store)
+        stats = store.stats()
+        self.assertEqual((2, 3, 1), (stats['sessions'], stats['stored'], stats['loads']), msg=stats)
+        self.assertEqual(sorted(["_global", "a", "b", "c"]), sorted(k.getSessionData()))
+        k._deleteSession("b")
+        self.assertEqual(u"", k.getPredicate("name", "b"))
+        store.close()
+
+
+class TestSessionSnapshots( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        self.k = new_kernel()
+
+    def test01_getSessionData( self ):
+        self.k.respond(u"test get and set", "user")
+        data = self.k.getSessionData("user")
+        self.assertEqual(u"cheese", data["food"])
+        # a copy: changing it does not change the session
+        data[self.k._inputHistory].append(u"changed")
+        self.assertEqual([u"test get and set"], list(self.k.getPredicate(self.k._inputHistory, "user")))
+        self.assertEqual({}, self.k.getSessionData("nobody"))
+        self.assertEqual(sorted(["_global", "user"]), sorted(self.k.getSessionData()))
+
+    def test02_snapshots( self ):
+        self.k.respond(u"test bot", "user")
+        snapshots = dict(self.k.sessionSnapshots())
+        self.assertEqual(sorted(["_global", "user"]), sorted(snapshots))
+        snapshot = snapshots["user"]
+        self.assertEqual((u"test bot",), snapshot[self.k._inputHistory])
+        with self.assertRaises(TypeError):
+            snapshot["name"] = u"Ann"
+        self.assertEqual(self.k.getSessionData("user"), snapshot.copy())
+        # taken when the generator gets to the session
+        self.k.respond(u"test input", "user")
+        self.assertEqual((u"test bot",), snapshot[self.k._inputHistory])
+
+    def test03_since( self ):
+        self.k.respond(u"test bot", "a")
+        self.k.respond(u"test bot", "b")
+        checkpoint = self.k.sessionCheckpoint()
+        self.assertEqual([], list(self.k.sessionSnapshots(checkpoint)))
+        self.k.respond(u"test bot", "b")
+        self.k.setPredicate("name", u"Ann", "c")
+        self.k._deleteSession("a")
+        changes = dict(self.k.sessionSnapshots(checkpoint))
+        self.assertEqual(sorted(["a", "b", "c"]), sorted(changes))
+        self.assertIsNone(changes["a"])
+        self.assertEqual(u"Ann", changes["c"]["name"])
+        checkpoint = self.k.sessionCheckpoint()
+        self.k.respond(u"test bot", "c")
+        self.assertEqual(["c"], [sessionID for sessionID, snapshot in self.k.sessionSnapshots(checkpoint)])
+
+    def test04_evicted( self ):
+        # sessions the store forgot are not reported as deleted (it
+        # keeps the global session, and two others)
+        self.k.setSessionStore(MemorySessionStore(maxSessions=3))
+        checkpoint = self.k.sessionCheckpoint()
+        for sessionID in ["a", "b", "c"]:
+            self.k.respond(u"test bot", sessionID)
+        self.assertNotIn("a", self.k._sessions)
+        self.assertEqual(["b", "c"], [sessionID for sessionID, snapshot in self.k.sessionSnapshots(checkpoint)])
+
+    def test05_bounded( self ):
+        # changes are only recorded for the checkpoints outstanding
+        self.k.setSessionStore(MemorySessionStore(maxSessions=10))
+        for i in range(100):
+            self.k.respond(u"test bot", "session-%d" % i)
+        self.assertEqual(0, len(self.k._sessionChanges))
+        checkpoint = self.k.sessionCheckpoint()
+        for i in range(100):
+            self.k.respond(u"test bot", "session-%d" % i)
+        following = self.k.sessionCheckpoint()
+        self.assertEqual(9, len(list(self.k.sessionSnapshots(checkpoint))))
+        self.assertEqual(100, len(self.k._sessionChanges))
+        self.k.respond(u"test bot", "session-0")
+        # the first checkpoint is let go of, with the changes before the
+        # second one
+        self.assertEqual(["session-0"], [sessionID for sessionID, snapshot in self.k.sessionSnapshots(following)])
+        self.assertEqual([following], self.k._checkpoints)
+        self.assertEqual(["session-0"], list(self.k._sessionChanges))
+
+
+if __name__ == '__main__':
+    unittest.main()
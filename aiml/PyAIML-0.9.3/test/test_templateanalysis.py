@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os.path
+import random
+import unittest
+
+from aiml import Kernel
+from aiml.PatternMgr import PatternMgr
+from aiml.TemplateAnalysis import PURE, PREDICATES, NONDETERMINISTIC, SIDE_EFFECTS
+
+from .test_patternmgr import load_brain, sample_inputs
+
+
+class TestTemplateAnalysis( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        self.k = Kernel()
+        self.k.verbose(False)
+        self.k.learn(os.path.join(os.path.dirname(__file__), "cache-test.aiml"))
+
+    def _info(self, pattern, that=u"*", topic=u"*"):
+        return self.k.analyzeTemplates()[(pattern, that, topic)]
+
+    def test01_kinds( self ):
+        info = self._info(u"WELCOME")
+        self.assertEqual((PREDICATES, set([u"name"]), True), (info.kind, info.predicates, info.complete))
+        self.assertEqual(PURE, self._info(u"GREETING", u"* THERE").kind)
+        self.assertEqual(NONDETERMINISTIC, self._info(u"PICK").kind)
+        self.assertEqual(SIDE_EFFECTS, self._info(u"INCREMENT").kind)
+        self.assertFalse(self._info(u"INCREMENT").cacheable())
+
+    def test02_srai( self ):
+        # static <srai> targets are followed...
+        info = self._info(u"HOWDY")
+        self.assertEqual((PREDICATES, set([u"name"]), True), (info.kind, info.predicates, info.complete))
+        self.assertEqual(NONDETERMINISTIC, self._info(u"TOSS").kind)
+        self.assertEqual(SIDE_EFFECTS, self._info(u"COUNT TWICE").kind)
+        # ... unless the target depends on 'that', or the <srai> recurses
+        self.assertFalse(self._info(u"HI").complete)
+        self.assertFalse(self._info(u"HELLO *").complete)
+        self.assertFalse(self._info(u"LOOP").complete)
+
+    def test03_kernel( self ):
+        self.assertEqual(PREDICATES, self.k.templateInfo(u"howdy").kind)
+        self.assertIsNone(self.k.templateInfo(u"no such input"))
+        # replaced element processors may do anything
+        self.k._elementProcessors['get'] = lambda elem, sessionID: u"?"
+        self.k.setTemplateEngine('compiled')
+        self.assertEqual(SIDE_EFFECTS, self.k.templateInfo(u"howdy").kind)
+
+    def test04_context( self ):
+        brain = PatternMgr()
+        brain.add((u"*", u"ARE YOU OK", u""), ['template', {}])
+        brain.add((u"YES", u"", u""), ['template', {}])
+        brain.add((u"_ YES", u"", u""), ['template', {}])
+        # found before the '*' category with a <that> would be tried
+        self.assertFalse(brain.dependsOnContext(u"yes", brain.matchContext(u"yes", u"", u"")))
+        self.assertTrue(brain.dependsOnContext(u"no", brain.matchContext(u"no", u"", u"")))
+        self.assertFalse(brain.dependsOnContext(u"oh yes", brain.matchContext(u"oh yes", u"", u"")))
+        # without a match, any category with a <that> may come first
+        self.assertTrue(brain.dependsOnContext(u"yes"))
+
+    def test05_brains( self ):
+        # the templates found pure are: two fresh sessions get the same
+        # answers
+        for name, step in (('alice', 10), ('alisochka', 1)):
+            k = load_brain(name)
+            checked = 0
+            for words, that, topic in sample_inputs(k._brain)[::step]:
+                input_ = u" ".join(words)
+                k._deleteSession("probe")
+                info = k.templateInfo(input_, "probe")
+                if info is None or not (info.complete and info.cacheable()):
+                    continue
+                responses = []
+                for seed in (1, 2):
+                    random.seed(seed)
+                    k._deleteSession("probe")
+                    responses.append(k.respond(input_, "probe"))
+                self.assertEqual(responses[0], responses[1], msg="brain=%s input=%s" % (name, input_))
+                checked += 1
+            k._deleteSession("probe")
+            self.assertGreater(checked, 0)
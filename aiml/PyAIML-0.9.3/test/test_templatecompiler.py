@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import os.path
+import random
+import time
+import unittest
+
+from aiml import Kernel
+
+from .test_patternmgr import load_brain, sample_inputs
+
+
+class TestTemplateCompiler( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        # <date/> must not tick between the two conversations
+        self.asctime = time.asctime
+        time.asctime = lambda *args: u"Sat Oct 17 12:00:00 2026"
+
+    def tearDown(self):
+        time.asctime = self.asctime
+
+    def _converse(self, k, inputs):
+        """Return the responses to inputs in a new session, and the
+        session's data at the end."""
+        responses = []
+        for input_ in inputs:
+            random.seed(input_)
+            responses.append(k.respond(input_, "user"))
+        data = k.getSessionData("user")
+        k._deleteSession("user")
+        return responses, data
+
+    def _testEquivalence(self, name, step):
+        """Hold the same conversation with the interpreted and the compiled
+        templates."""
+        k = load_brain(name)
+        inputs = [u" ".join(words) for words, that, topic in sample_inputs(k._brain)[::step]]
+        try:
+            k.setTemplateEngine('interpreted')
+            expected, expectedData = self._converse(k, inputs)
+            k.setTemplateEngine('compiled')
+            responses, data = self._converse(k, inputs)
+        finally:
+            k.setTemplateEngine('compiled')
+        for input_, e, r in zip(inputs, expected, responses):
+            self.assertEqual(e, r, msg="brain=%s input=%s" % (name, input_))
+        self.assertEqual(expectedData, data)
+
+    def test01_alice( self ):
+        self._testEquivalence('alice', 5)
+
+    def test02_sara( self ):
+        self._testEquivalence('sara', 1)
+
+    def test03_alisochka( self ):
+        self._testEquivalence('alisochka', 1)
+
+    def test04_engine( self ):
+        k = Kernel()
+        k.verbose(False)
+        k.learn(os.path.join(os.path.dirname(__file__), "self-test.aiml"))
+        self.assertEqual(u"srai test passed", k.respond(u"test srai"))
+        self.assertEqual(2, len(k._compiler._cache))  # TEST SRAI and SRAI TARGET
+        k.setTemplateEngine('interpreted')
+        self.assertIsNone(k._compiler)
+        self.assertEqual(u"srai test passed", k.respond(u"test srai"))
+        self.assertRaises(ValueError, k.setTemplateEngine, 'jit')
+
+    def test05_custom_processor( self ):
+        # replaced element processors keep being used
+        k = Kernel()
+        k.verbose(False)
+        k.learn(os.path.join(os.path.dirname(__file__), "self-test.aiml"))
+        k._elementProcessors['bot'] = lambda elem, sessionID: u"Robby"
+        self.assertEqual(u"My name is Robby", k.respond(u"test bot"))
@@ -22,3 +22,21 @@ class TestUtils( unittest.TestCase ):
         sents = Utils.sentences("First.  Second, still?  Third and Final!  Well, not really")
         self.assertEqual( 4, len(sents) )
 
+    def test_sentences_empty( self ):
+        self.assertEqual( ["hi"], Utils.sentences("hi!!!") )
+        self.assertEqual( ["Why", "Because"], Utils.sentences("  Why?!?  Because... ") )
+        self.assertEqual( [], Utils.sentences("") )
+        self.assertEqual( [], Utils.sentences(" ?! ") )
+
+    def test_sentences_spanish( self ):
+        text = u"Hola \xbfc\xf3mo est\xe1s? \xa1Bien!"
+        self.assertEqual( [u"Hola \xbfc\xf3mo est\xe1s", u"\xa1Bien"], Utils.sentences(text) )
+        self.assertEqual( [u"Hola", u"c\xf3mo est\xe1s", u"Bien"],
+                          Utils.sentences(text, u".?!\xbf\xa1") )
+        self.assertEqual( ["a", "b c"], Utils.sentences("a; b c", ";") )
+
+    def test_iter_sentences( self ):
+        sents = Utils.iterSentences("First.  Second")
+        self.assertEqual( "First", next(sents) )
+        self.assertEqual( ["Second"], list(sents) )
+        self.assertRaises( TypeError, Utils.sentences, 42 )
@@ -1,17 +1,27 @@
 # -*- coding: latin-1 -*-
 
 from __future__ import print_function
+import os
+import random
+import shutil
+import tempfile
+import time
 import unittest
 
-from aiml.WordSub import WordSub
+from aiml import DefaultSubs, Kernel
+from aiml.PatternMgr import PatternMgr
+from aiml.WordSub import TrieWordSub, WordSub
+
+from .test_patternmgr import load_brain, sample_inputs
 
 
 class TestWordSub( unittest.TestCase ):
 
     longMessage = True
+    engine = WordSub
 
     def setUp(self):
-        self.subber = WordSub()
+        self.subber = self.engine()
         self.subber["apple"] = "banana"
         self.subber["orange"] = "pear"
         self.subber["banana" ] = "apple"
@@ -33,3 +43,168 @@ class TestWordSub( unittest.TestCase ):
         outStr = "I Would like one banana, one Pear and one APPLE."
         self.assertEqual( outStr, self.subber.sub(inStr) )
 
+
+
+class TestTrieWordSub( TestWordSub ):
+
+    def engine(self, *args):
+        subber = TrieWordSub(*args)
+        subber.minTrieKeys = 0
+        return subber
+
+    def test03_words( self ):
+        self.subber["mr."] = "mister"
+        self.subber["he"] = "it"
+        # as with the regex, a key ending with a non-word character must
+        # be followed by a word character
+        self.assertEqual( "It met Mr. Smith.", self.subber.sub("He met Mr. Smith.") )
+        self.assertEqual( "it met misterSmith", self.subber.sub("he met mr.Smith") )
+
+    def test04_order( self ):
+        # the first key added wins, not the longest
+        self.subber["he is"] = "he's"
+        self.assertEqual( "she is", self.subber.sub("he is") )
+        self.subber = self.engine()
+        self.subber["he is"] = "he's"
+        self.subber["he"] = "she"
+        self.assertEqual( "he's", self.subber.sub("he is") )
+
+    def test05_small( self ):
+        # small tables keep the regex
+        subber = TrieWordSub(DefaultSubs.defaultGender)
+        self.assertEqual( "she said", subber.sub("he said") )
+        self.assertIsNone( subber._trie )
+        subber = TrieWordSub(DefaultSubs.defaultNormal)
+        self.assertEqual( "i am", subber.sub("i'm") )
+        self.assertIsNotNone( subber._trie )
+
+    def test06_defaults( self ):
+        # the same substitutions as WordSub, on random text made of the
+        # words of the default tables
+        rnd = random.Random(1)
+        separators = [" ", "", " , ", "'", "-", ".", "!", "_"]
+        for name in ("defaultGender", "defaultNormal", "defaultPerson", "defaultPerson2"):
+            table = getattr(DefaultSubs, name)
+            regex, trie = WordSub(table), self.engine(table)
+            words = [w for key in table for w in (key, key.upper(), key.capitalize(), key.title())]
+            words += ["x", "hello", "Mr.", u"\xe9t\xe9", "'", "42"]
+            for i in range(5000):
+                text = "".join(rnd.choice(words) + rnd.choice(separators)
+                               for j in range(rnd.randrange(8)))
+                self.assertEqual(regex.sub(text), trie.sub(text), msg="%s: %r" % (name, text))
+
+
+class TestSubstitutionEngine( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        # <date/> must not tick between the two conversations
+        self.asctime = time.asctime
+        time.asctime = lambda *args: u"Sat Oct 17 12:00:00 2026"
+
+    def tearDown(self):
+        time.asctime = self.asctime
+
+    def _converse(self, k, inputs):
+        responses = []
+        for input_ in inputs:
+            random.seed(input_)
+            responses.append(k.respond(input_, "user"))
+        k._deleteSession("user")
+        return responses
+
+    def test01_alice( self ):
+        k = load_brain('alice')
+        inputs = [u" ".join(words) for words, that, topic in sample_inputs(k._brain)[::10]]
+        try:
+            expected = self._converse(k, inputs)
+            person = dict(k._subbers['person'])
+            k.setSubstitutionEngine('trie')
+            self.assertIsInstance(k._subbers['person'], TrieWordSub)
+            self.assertEqual(person, dict(k._subbers['person']))
+            responses = self._converse(k, inputs)
+        finally:
+            k.setSubstitutionEngine('regex')
+        for input_, e, r in zip(inputs, expected, responses):
+            self.assertEqual(e, r, msg="input=%s" % input_)
+        self.assertRaises(ValueError, k.setSubstitutionEngine, 're2')
+
+
+class TestSavedSubs( unittest.TestCase ):
+
+    longMessage = True
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.subsFile = os.path.join(self.tmpdir, "subs.ini")
+        with open(self.subsFile, "w") as f:
+            f.write("[normal]\nwanna = want to\n\n[custom]\nhi = hello\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _kernel(self, engine='trie'):
+        k = Kernel()
+        k.verbose(False)
+        k.setSubstitutionEngine(engine)
+        return k
+
+    def _save(self, k, mapped=False):
+        k.learn(os.path.join(os.path.dirname(__file__), "self-test.aiml"))
+        filename = os.path.join(self.tmpdir, "test.brm" if mapped else "test.brn")
+        k.saveBrain(filename, mapped)
+        return filename
+
+    def test01_restore( self ):
+        # the saved trie is used instead of being built again
+        for mapped in (False, True):
+            filename = self._save(self._kernel(), mapped)
+            k = self._kernel()
+            self.assertTrue(k._subbers['normal']._regexIsDirty)
+            k.loadBrain(filename)
+            normal = k._subbers['normal']
+            self.assertFalse(normal._regexIsDirty, msg="mapped=%s" % mapped)
+            self.assertEqual(TrieWordSub(DefaultSubs.defaultNormal).getState(), normal.getState())
+            self.assertEqual(u"I just said: My name is Nameless",
+                             k.respond(u"test bot") and k.respond(u"test that"))
+
+    def test02_different( self ):
+        # tables that differ from the saved ones are kept
+        filename = self._save(self._kernel())
+        k = self._kernel()
+        k.loadSubs(self.subsFile)
+        normal = k._subbers['normal']
+        k.loadBrain(filename)
+        self.assertIs(normal, k._subbers['normal'])
+        self.assertTrue(normal._regexIsDirty)
+        self.assertEqual(u"want to", normal["wanna"])
+        # the regex engine saves no tables, and gets nothing from saved
+        # tries
+        for mapped in (False, True):
+            filename = self._save(self._kernel('regex'), mapped)
+            restore = PatternMgr().restoreMapped if mapped else PatternMgr().restore
+            self.assertNotIn(u"subs", restore(filename), msg="mapped=%s" % mapped)
+        filename = self._save(self._kernel())
+        k = self._kernel('regex')
+        k.loadBrain(filename)
+        self.assertNotIsInstance(k._subbers['normal'], TrieWordSub)
+        self.assertTrue(k._subbers['normal']._regexIsDirty)
+
+    def test03_loadSubs( self ):
+        # loading the same substitutions again changes nothing
+        k = self._kernel()
+        k.loadSubs(self.subsFile)
+        subbers = dict(k._subbers)
+        k._normalized["_global"]["that"] = (u"x", None)
+        k.loadSubs(self.subsFile)
+        self.assertEqual(subbers, k._subbers)
+        for name in subbers:
+            self.assertIs(subbers[name], k._subbers[name])
+        self.assertIn("that", k._normalized["_global"])
+        with open(self.subsFile, "a") as f:
+            f.write("hey = hello\n")
+        k.loadSubs(self.subsFile)
+        self.assertIsNot(subbers["custom"], k._subbers["custom"])
+        self.assertIs(subbers["normal"], k._subbers["normal"])
+        self.assertEqual({}, k._normalized["_global"])
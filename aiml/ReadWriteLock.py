@@ -0,0 +1,99 @@
+"""
+A lock that lets many threads read at once, but writers have it to
+themselves.  The Kernel uses one in its 'session' locking mode (see
+Kernel.setLockingMode()): responses read the brain, <learn> and the
+configuration methods write it.
+"""
+
+import threading
+
+
+class _Side(object):
+    """One side of a ReadWriteLock, with the interface of a plain lock:
+    acquire(), release(), and the with statement."""
+
+    def __init__(self, acquire, release):
+        self.acquire = acquire
+        self.release = release
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class ReadWriteLock(object):
+    """A readers-writer lock, whose reader and writer attributes are the
+    two locks to acquire.
+
+    Both sides are reentrant, and the writer may read.  A thread holding
+    the reader side may also acquire the writer side (a <learn> element
+    in the middle of a response): it then gives up reading until it
+    releases the writer side, so that two threads doing so cannot
+    deadlock.  Once a writer waits, no more threads start reading.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0       # reader holds, across all threads
+        self._waiting = 0       # threads waiting for the writer side
+        self._writer = None     # the thread holding the writer side
+        self._writes = 0        # ... and how many times
+        self._local = threading.local()
+        self.reader = _Side(self.acquireRead, self.releaseRead)
+        self.writer = _Side(self.acquireWrite, self.releaseWrite)
+
+    def _reads(self):
+        return getattr(self._local, 'reads', 0)
+
+    def acquireRead(self):
+        with self._cond:
+            if ((self._writer is not None or self._waiting) and
+                    self._writer is not threading.current_thread() and
+                    self._reads() == 0):
+                while self._writer is not None or self._waiting:
+                    self._cond.wait()
+            self._readers += 1
+            self._local.reads = self._reads() + 1
+
+    def releaseRead(self):
+        with self._cond:
+            if self._reads() == 0:
+                raise RuntimeError("release of an unacquired reader lock")
+            self._local.reads -= 1
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquireWrite(self):
+        me = threading.current_thread()
+        with self._cond:
+            if self._writer is me:
+                self._writes += 1
+                return
+            # stop reading meanwhile
+            reads = self._reads()
+            self._readers -= reads
+            if self._readers == 0:
+                self._cond.notify_all()
+            self._waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting -= 1
+            self._writer = me
+            self._writes = 1
+            # (reading again once done)
+            self._readers += reads
+
+    def releaseWrite(self):
+        with self._cond:
+            if self._writer is not threading.current_thread():
+                raise RuntimeError("release of an unacquired writer lock")
+            self._writes -= 1
+            if self._writes == 0:
+                self._writer = None
+                self._cond.notify_all()
@@ -0,0 +1,332 @@
+"""
+Where the Kernel keeps its sessions: the predicates, histories and input
+stack of each user.  See Kernel.setSessionStore().
+
+A store maps session IDs to session dictionaries, which the Kernel reads
+and changes in place.  The Kernel asks for a session with session() once
+per response (and when it sets a predicate of a session it does not
+hold); that is when stores count hits and misses, and may forget the
+sessions least recently asked for.
+
+ - MemorySessionStore keeps the sessions in memory, up to a number of
+   them and for a time if asked to (the default store keeps them all,
+   forever, as the Kernel always did);
+ - SqliteSessionStore keeps them in a sqlite database, which survives
+   restarts, with the most recently used ones in memory.
+
+Kernel.sessionSnapshots() exports sessions as SessionSnapshots.
+"""
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+class SessionSnapshot(Mapping):
+    """A read-only copy of a session, taken between two responses: a
+    mapping of its predicates, and of the histories and input stack as
+    tuples.  copy() returns a session dictionary made from it, e.g. to
+    restore it in a session store."""
+
+    __slots__ = ('_data',)
+
+    def __init__(self, session):
+        data = {}
+        for name, value in session.items():
+            if isinstance(value, (list, deque)):
+                value = tuple(value)
+            data[name] = value
+        self._data = data
+
+    def __getitem__(self, name):
+        return self._data[name]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return "SessionSnapshot(%r)" % self._data
+
+    def copy(self, maxHistorySize=10):
+        """Return a session dictionary with the same data."""
+        session = dict(self._data)
+        for name in ("_inputHistory", "_outputHistory"):
+            if name in session:
+                session[name] = deque(session[name], maxHistorySize)
+        if "_inputStack" in session:
+            session["_inputStack"] = list(session["_inputStack"])
+        return session
+
+
+class MemorySessionStore(object):
+    """Sessions kept in memory.
+
+    If maxSessions is given, the least recently used sessions are
+    forgotten to keep no more than that; if ttl is given, sessions not
+    used for ttl seconds are.  Sessions with a response in progress are
+    kept (see setEvictable()).
+    """
+
+    def __init__(self, maxSessions=None, ttl=None):
+        if maxSessions is not None and maxSessions < 1:
+            raise ValueError("maxSessions must be positive")
+        if ttl is not None and ttl <= 0:
+            raise ValueError("ttl must be positive")
+        self.maxSessions = maxSessions
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # sessionID -> session, least recently used first, and the time
+        # each was last used
+        self._sessions = OrderedDict()
+        self._used = {}
+        self._lock = threading.RLock()
+        self._evictable = None
+        self._onEvict = None
+
+    def setEvictable(self, evictable, onEvict=None):
+        """Have the store call evictable(sessionID) before forgetting a
+        session, which it keeps if the result is false, and
+        onEvict(sessionID) once it has."""
+        self._evictable = evictable
+        self._onEvict = onEvict
+
+    # Access without bookkeeping, for the predicates of the sessions in use
+    def __getitem__(self, sessionID):
+        return self._sessions[sessionID]
+
+    def __contains__(self, sessionID):
+        return sessionID in self._sessions
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def peek(self, sessionID):
+        """Return the session, or None, without marking it as used."""
+        return self._sessions.get(sessionID)
+
+    def session(self, sessionID, create=None):
+        """Return the session, marked as the most recently used one.  If
+        there is none, return the result of create() if given (after
+        storing it), else None."""
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            session = self._sessions.pop(sessionID, None)
+            if session is None:
+                session = self._load(sessionID)
+            if session is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                if create is None:
+                    return None
+                session = create()
+            self._sessions[sessionID] = session
+            self._used[sessionID] = now
+            self._evictOver()
+            return session
+
+    def add(self, sessionID, session):
+        """Store session under sessionID, replacing any other."""
+        with self._lock:
+            self._sessions.pop(sessionID, None)
+            self._sessions[sessionID] = session
+            self._used[sessionID] = time.time()
+            self._evictOver()
+
+    def delete(self, sessionID):
+        """Forget the session, if there is one."""
+        with self._lock:
+            self._used.pop(sessionID, None)
+            return self._sessions.pop(sessionID, None) is not None
+
+    def sessionIDs(self):
+        """Return a list of the IDs of all the sessions."""
+        with self._lock:
+            return list(self._sessions)
+
+    def items(self):
+        """Generate the (sessionID, session) pairs of all the sessions."""
+        for sessionID in self.sessionIDs():
+            session = self.peek(sessionID)
+            if session is not None:
+                yield sessionID, session
+
+    def stats(self):
+        """Return a dictionary of the number of sessions, the limits, and
+        the counts of hits, misses and evictions."""
+        with self._lock:
+            return {'sessions': len(self._sessions), 'maxSessions': self.maxSessions,
+                    'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions}
+
+    def flush(self):
+        """Save the sessions, for stores that do."""
+
+    def close(self):
+        """Save the sessions and release the store's resources."""
+        self.flush()
+
+    def _load(self, sessionID):
+        """Return the stored session not in memory, or None."""
+        return None
+
+    def _evict(self, sessionID):
+        """Forget a session kept in memory, if it may be."""
+        if self._evictable is not None and not self._evictable(sessionID):
+            return False
+        session = self._sessions.pop(sessionID)
+        self._used.pop(sessionID)
+        self._evicted(sessionID, session)
+        self.evictions += 1
+        if self._onEvict is not None:
+            self._onEvict(sessionID)
+        return True
+
+    def _evicted(self, sessionID, session):
+        """Called with each session forgotten."""
+
+    def _evictOver(self):
+        if self.maxSessions is None:
+            return
+        # (never the session just used)
+        for sessionID in list(self._sessions)[:-1]:
+            if len(self._sessions) <= self.maxSessions:
+                break
+            self._evict(sessionID)
+
+    def _expire(self, now):
+        if self.ttl is None:
+            return
+        limit = now - self.ttl
+        for sessionID in list(self._sessions):
+            if self._used[sessionID] > limit:
+                break
+            self._evict(sessionID)
+
+
+class SqliteSessionStore(MemorySessionStore):
+    """Sessions kept in the sqlite database filename, so that they
+    survive restarts.
+
+    Up to maxSessions sessions are kept in memory, and those not used
+    for ttl seconds are not (if ttl is given); sessions leaving memory
+    are written to the database, writeBatch at a time, from which the
+    session() method reads them back.  flush() writes all the sessions,
+    and must be called, or close(), before the process exits.  Hits
+    count the sessions found in memory or in the database, loads the
+    latter.
+    """
+
+    def __init__(self, filename, maxSessions=1000, ttl=None, writeBatch=100):
+        MemorySessionStore.__init__(self, maxSessions, ttl)
+        self.filename = filename
+        self.writeBatch = writeBatch
+        self.loads = 0
+        self.saves = 0
+        # the sessions that left memory, not written yet
+        self._pending = {}
+        self._db = None
+        self._pid = None
+        with self._database() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS sessions "
+                       "(id TEXT PRIMARY KEY, data BLOB)")
+
+    def _database(self):
+        """Return the connection to the database, of this process (the
+        workers of Kernel.respondMany() are forked)."""
+        if self._pid != os.getpid():
+            self._db = sqlite3.connect(self.filename, check_same_thread=False)
+            self._pid = os.getpid()
+        return self._db
+
+    def peek(self, sessionID):
+        with self._lock:
+            session = self._sessions.get(sessionID)
+            if session is None:
+                session = self._pending.get(sessionID)
+            return session if session is not None else self._read(sessionID)
+
+    def delete(self, sessionID):
+        with self._lock:
+            deleted = MemorySessionStore.delete(self, sessionID)
+            deleted = self._pending.pop(sessionID, None) is not None or deleted
+            with self._database() as db:
+                cursor = db.execute("DELETE FROM sessions WHERE id = ?", (sessionID,))
+            return deleted or cursor.rowcount > 0
+
+    def sessionIDs(self):
+        with self._lock:
+            self._writePending()
+            stored = [row[0] for row in self._database().execute("SELECT id FROM sessions")]
+            inMemory = list(self._sessions)
+        known = set(inMemory)
+        return inMemory + [sessionID for sessionID in stored if sessionID not in known]
+
+    def items(self):
+        for sessionID in self.sessionIDs():
+            session = self.peek(sessionID)
+            if session is not None:
+                yield sessionID, session
+
+    def stats(self):
+        stats = MemorySessionStore.stats(self)
+        with self._lock:
+            self._writePending()
+            stats['stored'] = self._database().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            stats['loads'] = self.loads
+            stats['saves'] = self.saves
+        return stats
+
+    def flush(self):
+        with self._lock:
+            self._writePending()
+            self._write(list(self._sessions.items()))
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self._database().close()
+            self._db = self._pid = None
+
+    def _read(self, sessionID):
+        row = self._database().execute("SELECT data FROM sessions WHERE id = ?", (sessionID,)).fetchone()
+        return pickle.loads(bytes(row[0])) if row is not None else None
+
+    def _write(self, sessions):
+        with self._database() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO sessions (id, data) VALUES (?, ?)",
+                [(sessionID, sqlite3.Binary(pickle.dumps(session, 2)))
+                 for sessionID, session in sessions])
+        self.saves += len(sessions)
+
+    def _writePending(self):
+        if self._pending:
+            self._write(list(self._pending.items()))
+            self._pending.clear()
+
+    def _load(self, sessionID):
+        session = self._pending.pop(sessionID, None)
+        if session is None:
+            session = self._read(sessionID)
+            if session is not None:
+                self.loads += 1
+        return session
+
+    def _evicted(self, sessionID, session):
+        self._pending[sessionID] = session
+        if len(self._pending) >= self.writeBatch:
+            self._writePending()
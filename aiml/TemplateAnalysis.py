@@ -0,0 +1,166 @@
+"""
+Find out what the text produced by AIML templates depends on.
+
+A template is classified, from the elements it contains, as:
+
+ - PURE: its text only depends on the matched input (and on the brain,
+   the bot predicates and the substitutions, which caches must watch
+   anyway);
+ - PREDICATES: it also reads session predicates, through <get> and
+   <condition>;
+ - NONDETERMINISTIC: its text may vary even for the same input and
+   predicates: <random>, <date>, and the elements reading the session's
+   history or identity (<input>, <that>, <id>);
+ - SIDE_EFFECTS: it changes the session or the world: <set>, <learn>,
+   <system>, and any element whose processor the application replaced.
+
+Each kind includes the ones before it, and a template gets the last kind
+of all its elements.  <srai> elements whose input is plain text are
+followed: the template they lead to is analyzed too, unless categories
+with a <that> or <topic> pattern could match that input, since then
+the template reached depends on the conversation.  Inputs built at run
+time (<srai> around a <star/>, <sr/>) cannot be followed, which the
+result records.
+"""
+
+PURE = "pure"
+PREDICATES = "predicates"
+NONDETERMINISTIC = "nondeterministic"
+SIDE_EFFECTS = "side-effects"
+
+_KINDS = (PURE, PREDICATES, NONDETERMINISTIC, SIDE_EFFECTS)
+_RANKS = dict((kind, rank) for rank, kind in enumerate(_KINDS))
+
+# the kind of the elements that are not pure
+_ELEMENT_KINDS = {
+    "condition":    PREDICATES,
+    "get":          PREDICATES,
+    "date":         NONDETERMINISTIC,
+    "id":           NONDETERMINISTIC,
+    "input":        NONDETERMINISTIC,
+    "random":       NONDETERMINISTIC,
+    "that":         NONDETERMINISTIC,
+    "learn":        SIDE_EFFECTS,
+    "set":          SIDE_EFFECTS,
+    "system":       SIDE_EFFECTS,
+}
+
+
+class TemplateInfo(object):
+    """The result of the analysis of a template.
+
+    kind is one of PURE, PREDICATES, NONDETERMINISTIC and SIDE_EFFECTS;
+    predicates is the set of the names of the predicates read; context
+    is true if the text may depend on the words of 'that' or the topic
+    (<thatstar>, <topicstar>); complete is false if some <srai> could
+    not be followed, in which case the template may do more than kind
+    says.
+    """
+    __slots__ = ('kind', 'predicates', 'context', 'complete')
+
+    def __init__(self, kind=PURE, predicates=frozenset(), context=False, complete=True):
+        self.kind = kind
+        self.predicates = predicates
+        self.context = context
+        self.complete = complete
+
+    def cacheable(self):
+        """Is the text of the template a function of the input and of
+        the predicates (and context) it reads?  Only as far as the
+        analysis went if it is not complete."""
+        return self.kind == PURE or self.kind == PREDICATES
+
+    def __repr__(self):
+        return "TemplateInfo(%r, %r, context=%r, complete=%r)" % (
+            self.kind, sorted(self.predicates), self.context, self.complete)
+
+
+class TemplateAnalyzer(object):
+    """Analyzes the templates of a Kernel's brain, and keeps the results.
+
+    Like compiled templates, results are cached by the identity of the
+    template; clear() forgets them, and must be called whenever the
+    templates, the element processors, the bot name or the 'normal'
+    substitutions change, as <srai> targets may then be different.
+    """
+
+    def __init__(self, kernel):
+        self._kernel = kernel
+        self._cache = {}
+
+    def clear(self):
+        """Forget every analysis."""
+        self._cache.clear()
+
+    def analyze(self, template):
+        """Return the TemplateInfo of template."""
+        try:
+            return self._cache[id(template)][1]
+        except KeyError:
+            return self._analyze(template, set())
+
+    def _analyze(self, template, visiting):
+        try:
+            return self._cache[id(template)][1]
+        except KeyError:
+            pass
+        kernel = self._kernel
+        visiting.add(id(template))
+        rank = 0
+        names = set()
+        context = False
+        complete = True
+        elements = [template]
+        while elements:
+            elem = elements.pop()
+            tag = elem[0]
+            if tag == "text":
+                continue
+            if tag not in kernel._elementProcessors:
+                # unknown elements produce nothing, not even their contents
+                continue
+            if not kernel._isBuiltinProcessor(tag):
+                rank = _RANKS[SIDE_EFFECTS]
+                continue
+            rank = max(rank, _RANKS[_ELEMENT_KINDS.get(tag, PURE)])
+            if tag in ("get", "condition", "li") and 'name' in elem[1]:
+                names.add(elem[1]['name'])
+            elif tag in ("thatstar", "topicstar"):
+                context = True
+            elif tag == "sr":
+                complete = False
+            elif tag == "srai":
+                resolved, target = self._target(elem)
+                if not resolved or (target is not None and id(target) in visiting):
+                    # built at run time, depends on the context, or
+                    # recursive
+                    complete = False
+                elif target is not None:
+                    info = self._analyze(target, visiting)
+                    rank = max(rank, _RANKS[info.kind])
+                    names.update(info.predicates)
+                    context = context or info.context
+                    complete = complete and info.complete
+            elements.extend(elem[2:])
+        visiting.discard(id(template))
+        info = TemplateInfo(_KINDS[rank], frozenset(names), context, complete)
+        # keep the template alive, so that its id is not reused
+        self._cache[id(template)] = (template, info)
+        return info
+
+    def _target(self, elem):
+        """Return (resolved, template): the template the <srai> element
+        elem leads to, if it can be found without running it (None if
+        its input matches nothing)."""
+        kernel = self._kernel
+        brain = kernel._brain
+        if any(e[0] != "text" for e in elem[2:]):
+            return False, None
+        text = u"".join(e[2] for e in elem[2:])
+        if len(text.strip()) == 0:
+            return True, None
+        normalized = brain.normalize(kernel._subbers['normal'].sub(text))
+        context = brain.matchContext(normalized, u"", u"")
+        if brain.dependsOnContext(normalized, context):
+            return False, None
+        return True, context.template if context is not None else None
@@ -0,0 +1,453 @@
+"""
+Compile AIML templates into trees of Python closures.
+
+The Kernel's element processors interpret a template, the nested
+[tag, attributes, children...] lists built by the AIML parser, every time
+it is used: each element costs a dictionary lookup to find its handler,
+its attributes are looked up and converted again, and the results are
+glued together with repeated string concatenation.  A TemplateCompiler
+does that work once per template.  Every element becomes a function
+
+    f(sessionID, out)
+
+which appends the element's text to the list 'out', with the handler
+chosen, the attributes parsed and the text whitespace collapsed in
+advance.  Elements whose text cannot change, such as plain text or
+<uppercase> around plain text, are compiled to that text, and adjacent
+pieces of fixed text are merged.  Compiled templates produce exactly the
+same responses as the interpreted ones, down to the calls made to the
+random number generator.
+
+Elements whose handler in Kernel._elementProcessors has been replaced,
+and elements the compiler does not know, are handed to their handler as
+before.
+"""
+
+from __future__ import print_function
+
+import random
+import re
+import string
+import sys
+import time
+
+
+def _isConstant(part):
+    return not callable(part)
+
+
+def _merge(parts):
+    """Join adjacent constant parts."""
+    merged = []
+    for part in parts:
+        if merged and _isConstant(part) and _isConstant(merged[-1]):
+            merged[-1] = merged[-1] + part
+        else:
+            merged.append(part)
+    return merged
+
+
+def _emitter(part):
+    """Return a function appending the output of a compiled part."""
+    if _isConstant(part):
+        return lambda sessionID, out: out.append(part)
+    return part
+
+
+def _sequence(parts):
+    """Compile the concatenation of parts, to a constant if possible."""
+    parts = _merge(parts)
+    if len(parts) == 0:
+        return u""
+    if len(parts) == 1:
+        return parts[0]
+    fns = [_emitter(part) for part in parts]
+    def sequence(sessionID, out):
+        for fn in fns:
+            fn(sessionID, out)
+    return sequence
+
+
+def _collector(parts):
+    """Return either the constant text of parts, or a function of the
+    session ID evaluating them into a new string."""
+    parts = _merge(parts)
+    if len(parts) == 0:
+        return u""
+    if len(parts) == 1:
+        if _isConstant(parts[0]):
+            return parts[0]
+        fn = parts[0]
+        def collect(sessionID):
+            out = []
+            fn(sessionID, out)
+            return u"".join(out)
+        return collect
+    fns = [_emitter(part) for part in parts]
+    def collect(sessionID):
+        out = []
+        for fn in fns:
+            fn(sessionID, out)
+        return u"".join(out)
+    return collect
+
+
+class TemplateCompiler(object):
+    """Compiles the templates used by a Kernel, and keeps the results.
+
+    Compiled templates are cached by the identity of the template, which
+    is kept alive alongside its compiled form so that the identity cannot
+    be reused.  clear() forgets them all, and must be called whenever
+    templates are replaced or the Kernel's element processors change.
+    """
+
+    def __init__(self, kernel):
+        self._kernel = kernel
+        self._cache = {}
+        self._compilers = {
+            "bot":          self._compileBot,
+            "condition":    self._compileCondition,
+            "date":         self._compileDate,
+            "formal":       self._compileFormal,
+            "gender":       self._compileGender,
+            "get":          self._compileGet,
+            "gossip":       self._compileThink,
+            "id":           self._compileId,
+            "input":        self._compileInput,
+            "javascript":   self._compileThink,
+            "learn":        self._compileLearn,
+            "li":           self._compileContents,
+            "lowercase":    self._compileLowercase,
+            "person":       self._compilePerson,
+            "person2":      self._compilePerson,
+            "random":       self._compileRandom,
+            "text":         self._compileText,
+            "sentence":     self._compileSentence,
+            "set":          self._compileSet,
+            "size":         self._compileSize,
+            "sr":           self._compileSr,
+            "srai":         self._compileSrai,
+            "star":         self._compileStar,
+            "system":       self._compileSystem,
+            "template":     self._compileContents,
+            "that":         self._compileThat,
+            "thatstar":     self._compileStar,
+            "think":        self._compileThink,
+            "topicstar":    self._compileStar,
+            "uppercase":    self._compileUppercase,
+            "version":      self._compileVersion,
+        }
+
+    def clear(self):
+        """Forget every compiled template."""
+        self._cache.clear()
+
+    def compiled(self, template):
+        """Return the compiled form of template, compiling it if needed:
+        either its text, if it never changes, or a function of the
+        session ID returning the text."""
+        try:
+            return self._cache[id(template)][1]
+        except KeyError:
+            compiled = _collector([self._compileElement(template)])
+            self._cache[id(template)] = (template, compiled)
+            return compiled
+
+    def render(self, template, sessionID):
+        """Return the response produced by template."""
+        try:
+            compiled = self._cache[id(template)][1]
+        except KeyError:
+            compiled = self.compiled(template)
+        if _isConstant(compiled):
+            return compiled
+        return compiled(sessionID)
+
+    def _compileElement(self, elem):
+        """Compile elem, to either its constant text or a function
+        f(sessionID, out)."""
+        kernel = self._kernel
+        tag = elem[0]
+        try:
+            handler = kernel._elementProcessors[tag]
+        except Exception:
+            # Oops -- there's no handler function for this element type!
+            def missing(sessionID, out):
+                if kernel._verboseMode:
+                    err = "WARNING: No handler found for <%s> element\n" % kernel._cod.enc(tag)
+                    sys.stderr.write(err)
+            return missing
+        compiler = self._compilers.get(tag)
+        if compiler is not None and kernel._isBuiltinProcessor(tag):
+            try:
+                return compiler(elem)
+            except Exception:
+                # malformed element: let the handler report it, if and
+                # when it gets used.
+                pass
+        return lambda sessionID, out: out.append(handler(elem, sessionID))
+
+    def _children(self, elem):
+        return [self._compileElement(e) for e in elem[2:]]
+
+    def _contents(self, elem):
+        """Compile the contents of elem into a collector (see
+        _collector())."""
+        return _collector(self._children(elem))
+
+    def _compileContents(self, elem):
+        # <template>, <li>: the concatenation of the contents
+        return _sequence(self._children(elem))
+
+    def _compileTransform(self, elem, transform, constant=False):
+        """Compile an element whose text is transform(contents).  If
+        constant is true, transform only depends on its argument, and is
+        applied right away to constant contents."""
+        collect = self._contents(elem)
+        if _isConstant(collect):
+            if constant:
+                return transform(collect)
+            return lambda sessionID, out: out.append(transform(collect))
+        return lambda sessionID, out: out.append(transform(collect(sessionID)))
+
+    def _compileAction(self, elem, action):
+        """Compile an element whose text is action(contents, sessionID)."""
+        collect = self._contents(elem)
+        if _isConstant(collect):
+            return lambda sessionID, out: out.append(action(collect, sessionID))
+        return lambda sessionID, out: out.append(action(collect(sessionID), sessionID))
+
+    # <bot>
+    def _compileBot(self, elem):
+        name = elem[1]['name']
+        getBotPredicate = self._kernel.getBotPredicate
+        return lambda sessionID, out: out.append(getBotPredicate(name))
+
+    # <condition>
+    def _compileCondition(self, elem):
+        kernel = self._kernel
+        getPredicate = kernel.getPredicate
+        attr = elem[1]
+
+        # Case #1: test the value of a specific predicate for a
+        # specific value.
+        if 'name' in attr and 'value' in attr:
+            name, value = attr['name'], attr['value']
+            emit = _emitter(_sequence(self._children(elem)))
+            def condition(sessionID, out):
+                if getPredicate(name, sessionID) == value:
+                    emit(sessionID, out)
+            return condition
+
+        # Case #2 and #3: Cycle through <li> contents, testing a name and
+        # value pair for each one.
+        name = attr.get('name', None)
+        listitems = [e for e in elem[2:] if e[0] == 'li']
+        if len(listitems) == 0:
+            return u""
+        tests = []
+        for li in listitems:
+            liAttr = li[1]
+            # if this is the last list item, it's allowed to have no
+            # attributes.  We just skip it for now.
+            if len(liAttr) == 0 and li == listitems[-1]:
+                continue
+            liName = name if name is not None else liAttr.get('name')
+            tests.append((li, liName, liAttr.get('value'), _emitter(self._compileElement(li))))
+        last = listitems[-1]
+        default = None
+        if not ('name' in last[1] or 'value' in last[1]):
+            default = _emitter(self._compileElement(last))
+
+        def condition(sessionID, out):
+            try:
+                for li, liName, liValue, fn in tests:
+                    try:
+                        # a missing attribute raises KeyError, as the
+                        # interpreter does.
+                        if liName is None: liName = li[1]['name']
+                        if liValue is None: liValue = li[1]['value']
+                        if getPredicate(liName, sessionID) == liValue:
+                            fn(sessionID, out)
+                            return
+                    except Exception:
+                        if kernel._verboseMode: print("Something amiss -- skipping listitem", li)
+                        raise
+                if default is not None:
+                    try:
+                        default(sessionID, out)
+                    except Exception:
+                        if kernel._verboseMode: print("error in default listitem")
+                        raise
+            except Exception:
+                if kernel._verboseMode: print("catastrophic condition failure")
+                raise
+        return condition
+
+    # <date>
+    def _compileDate(self, elem):
+        return lambda sessionID, out: out.append(time.asctime())
+
+    # <formal>
+    def _compileFormal(self, elem):
+        return self._compileTransform(elem, string.capwords, constant=True)
+
+    # <gender>
+    def _compileGender(self, elem):
+        subbers = self._kernel._subbers
+        return self._compileTransform(elem, lambda text: subbers['gender'].sub(text))
+
+    # <get>
+    def _compileGet(self, elem):
+        name = elem[1]['name']
+        getPredicate = self._kernel.getPredicate
+        return lambda sessionID, out: out.append(getPredicate(name, sessionID))
+
+    # <id>
+    def _compileId(self, elem):
+        return lambda sessionID, out: out.append(sessionID)
+
+    # <input>, <that>
+    def _compileHistory(self, historyKey, index, tag):
+        kernel = self._kernel
+        def history(sessionID, out):
+            try:
+                out.append(kernel.getPredicate(historyKey, sessionID)[-index])
+            except IndexError:
+                if kernel._verboseMode:
+                    err = "No such index %d while processing <%s> element.\n" % (index, tag)
+                    sys.stderr.write(err)
+                out.append("")
+        return history
+
+    def _compileInput(self, elem):
+        try: index = int(elem[1]['index'])
+        except: index = 1
+        return self._compileHistory(self._kernel._inputHistory, index, "input")
+
+    def _compileThat(self, elem):
+        index = 1
+        try:
+            # "x" or "x,y": only x, how far back to go, is supported.
+            index = int(elem[1]['index'].split(',')[0])
+        except Exception:
+            pass
+        return self._compileHistory(self._kernel._outputHistory, index, "that")
+
+    # <learn>
+    def _compileLearn(self, elem):
+        kernel = self._kernel
+        def learn(filename, sessionID):
+            kernel.learn(filename)
+            return u""
+        return self._compileAction(elem, learn)
+
+    # <lowercase>
+    def _compileLowercase(self, elem):
+        return self._compileTransform(elem, lambda text: text.lower(), constant=True)
+
+    # <person>, <person2>
+    def _compilePerson(self, elem):
+        kernel = self._kernel
+        subber = elem[0]
+        if len(elem[2:]) == 0:
+            # atomic <person/> = <person><star/></person>
+            def person(sessionID, out):
+                star = kernel._matchStack[sessionID][-1].star('star', 1)
+                out.append(kernel._subbers[subber].sub(star))
+            return person
+        return self._compileTransform(elem, lambda text: kernel._subbers[subber].sub(text))
+
+    # <random>
+    def _compileRandom(self, elem):
+        fns = [_emitter(self._compileElement(e)) for e in elem[2:] if e[0] == 'li']
+        if len(fns) == 0:
+            return u""
+        def random_(sessionID, out):
+            # shuffle the whole list, as the interpreter does, so that the
+            # same random numbers are drawn.
+            listitems = list(fns)
+            random.shuffle(listitems)
+            listitems[0](sessionID, out)
+        return random_
+
+    # <sentence>
+    def _compileSentence(self, elem):
+        def sentence(text):
+            words = text.strip().split(" ", 1)
+            words[0] = words[0].capitalize()
+            return ' '.join(words)
+        return self._compileTransform(elem, sentence, constant=True)
+
+    # <set>
+    def _compileSet(self, elem):
+        name = elem[1]['name']
+        setPredicate = self._kernel.setPredicate
+        def set_(value, sessionID):
+            setPredicate(name, value, sessionID)
+            return value
+        return self._compileAction(elem, set_)
+
+    # <size>
+    def _compileSize(self, elem):
+        kernel = self._kernel
+        return lambda sessionID, out: out.append(str(kernel.numCategories()))
+
+    # <sr>
+    def _compileSr(self, elem):
+        kernel = self._kernel
+        def sr(sessionID, out):
+            star = kernel._matchStack[sessionID][-1].star('star', 1)
+            out.append(kernel._respond(star, sessionID))
+        return sr
+
+    # <srai>
+    def _compileSrai(self, elem):
+        return self._compileAction(elem, self._kernel._respond)
+
+    # <star>, <thatstar>, <topicstar>
+    def _compileStar(self, elem):
+        kernel = self._kernel
+        starType = elem[0]
+        try: index = int(elem[1]['index'])
+        except KeyError: index = 1
+        def star(sessionID, out):
+            out.append(kernel._matchStack[sessionID][-1].star(starType, index))
+        return star
+
+    # <system>
+    def _compileSystem(self, elem):
+        # (looked up each time: AsyncKernel replaces it)
+        kernel = self._kernel
+        return self._compileAction(elem, lambda command, sessionID: kernel._runSystem(command))
+
+    # text
+    def _compileText(self, elem):
+        try:
+            elem[2] + ""
+        except TypeError:
+            raise TypeError("Text element contents are not text")
+        text = elem[2]
+        if elem[1]["xml:space"] == "default":
+            text = re.sub(r"\s+", " ", text)
+        return text
+
+    # <think>, <gossip>, <javascript>
+    def _compileThink(self, elem):
+        fns = [part for part in self._children(elem) if not _isConstant(part)]
+        if len(fns) == 0:
+            return u""
+        def think(sessionID, out):
+            scratch = []
+            for fn in fns:
+                fn(sessionID, scratch)
+        return think
+
+    # <uppercase>
+    def _compileUppercase(self, elem):
+        return self._compileTransform(elem, lambda text: text.upper(), constant=True)
+
+    # <version>
+    def _compileVersion(self, elem):
+        version = self._kernel.version
+        return lambda sessionID, out: out.append(version())
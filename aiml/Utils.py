@@ -3,25 +3,96 @@ modules in the PyAIML package.
 
 """
 
-def sentences(s):
-    """Split the string s into a list of sentences."""
+import re
+import sys
+
+try:
+    _intern = sys.intern
+except AttributeError:
+    _intern = intern
+
+
+def canonicalCopier():
+    """Return a function copying objects made of dictionaries, lists and
+    tuples of strings and numbers, so that the marshal dump of a copy
+    depends on its value only.
+
+    Since version 3, marshal writes an object once and then refers to it,
+    but only objects referenced more than once, and it marks interned
+    strings: two equal trees of objects parsed in different ways, or
+    unmarshalled, need not have the same dump.  In the copies containers
+    are new, and equal strings and numbers are one object (str ones
+    interned), which the function keeps as long as it lives: it must not
+    be dropped before the copies are dumped.
+    """
+    # one dictionary per type, as 1 == 1.0 == True
+    memo = {}
+    strings = memo[str] = {}
+    def copy(obj):
+        t = type(obj)
+        if t is str:
+            try:
+                return strings[obj]
+            except KeyError:
+                strings[obj] = obj = _intern(obj)
+                return obj
+        if t is list:
+            return [copy(item) for item in obj]
+        if t is dict:
+            return dict([(copy(k), copy(v)) for k, v in obj.items()])
+        if t is tuple:
+            return tuple([copy(item) for item in obj])
+        if obj is None or t is bool:
+            return obj
+        try:
+            return memo[t][obj]
+        except KeyError:
+            memo.setdefault(t, {})[obj] = obj
+            return obj
+    return copy
+
+
+# the marks that end a sentence, by default
+SENTENCE_TERMINATORS = u".?!"
+
+# the regular expressions matching the sentences between the marks of each
+# set of terminators, and of each type of string (see _sentenceRE())
+_sentenceREs = {}
+
+def _sentenceRE(terminators, byteString):
+    """Return the regular expression matching the text between the marks
+    in terminators.  Byte strings (Python 2) are split at the ASCII marks
+    only."""
+    key = (terminators, byteString)
+    try:
+        return _sentenceREs[key]
+    except KeyError:
+        marks = terminators
+        if byteString:
+            marks = u"".join(c for c in terminators if c < u"\x80").encode("ascii")
+            regex = re.compile(b"[^" + re.escape(marks) + b"]+")
+        else:
+            regex = re.compile(u"[^" + re.escape(marks) + u"]+")
+        _sentenceREs[key] = regex
+        return regex
+
+def iterSentences(s, terminators=SENTENCE_TERMINATORS):
+    """Generate the sentences of the string s, stripped of surrounding
+    whitespace and of the marks in terminators, which separate them.
+    Empty sentences, e.g. between the marks of "hi!!!", are skipped.
+
+    Marks that open a sentence count as well, e.g. the inverted question
+    and exclamation marks of Spanish: with them, "hola" and "como estas"
+    are two sentences when the latter is asked the Spanish way.
+    """
     try: s+""
-    except: raise TypeError( "s must be a string" )
-    pos = 0
-    sentenceList = []
-    l = len(s)
-    while pos < l:
-        try: p = s.index('.', pos)
-        except: p = l+1
-        try: q = s.index('?', pos)
-        except: q = l+1
-        try: e = s.index('!', pos)
-        except: e = l+1
-        end = min(p,q,e)
-        sentenceList.append( s[pos:end].strip() )
-        pos = end+1
-    # If no sentences were found, return a one-item list containing
-    # the entire input string.
-    if len(sentenceList) == 0: sentenceList.append(s)
-    return sentenceList
+    except TypeError: raise TypeError( "s must be a string" )
+    regex = _sentenceRE(terminators, isinstance(s, bytes))
+    for match in regex.finditer(s):
+        sentence = match.group().strip()
+        if sentence:
+            yield sentence
 
+def sentences(s, terminators=SENTENCE_TERMINATORS):
+    """Split the string s into a list of sentences (see iterSentences())."""
+    return list(iterSentences(s, terminators))
@@ -20,6 +20,9 @@ The following example illustrates this point:
     she says she'd like to help her
 Note that "he" and "he'd" were replaced, but "help" and "her" were
 not.
+
+TrieWordSub is a drop-in replacement that finds the 'before' words with
+a trie of tokens instead of a regular expression.
 """
 
 from __future__ import print_function
@@ -73,9 +76,9 @@ class WordSub(dict):
     def __setitem__(self, i, y):
         self._regexIsDirty = True
         # for each entry the user adds, we actually add three entrys:
-        super(type(self),self).__setitem__(i.lower(),y.lower()) # key = value
-        super(type(self),self).__setitem__(string.capwords(i), string.capwords(y)) # Key = Value
-        super(type(self),self).__setitem__(i.upper(), y.upper()) # KEY = VALUE
+        super(WordSub, self).__setitem__(i.lower(),y.lower()) # key = value
+        super(WordSub, self).__setitem__(string.capwords(i), string.capwords(y)) # Key = Value
+        super(WordSub, self).__setitem__(i.upper(), y.upper()) # KEY = VALUE
 
     def sub(self, text):
         """Translate text, returns the modified text."""
@@ -83,3 +86,107 @@ class WordSub(dict):
             self._update_regex()
         return self._regex.sub(self, text)
 
+
+
+class TrieWordSub(WordSub):
+    """WordSub that looks the words up in a trie instead of scanning the
+    text with a regex made of all of them.
+
+    The text is split into runs of word and non-word characters, the
+    tokens, once; a 'before' word can only match a sequence of whole
+    tokens, since it must start and end at word boundaries.  Lookups
+    then cost a dict access per token, whatever the number of words.
+    The substitutions are those of WordSub: the leftmost match wins, and
+    among the words matching there, the first one added.
+
+    Tables with fewer than minTrieKeys keys (counting the case variants)
+    keep the regex, which is faster for them.
+
+    """
+
+    minTrieKeys = 100
+
+    _tokenRegex = re.compile(r"\w+|\W+")
+    _wordRegex = re.compile(r"\w")
+
+    def _update_regex(self):
+        """Build the trie of the tokens of the current keys."""
+        # node: token -> node, and None -> (rank, value, whether the key
+        # starts with a non-word token, whether it ends with one)
+        self._trie = root = {}
+        for rank, key in enumerate(self.keys()):
+            tokens = self._tokenRegex.findall(key)
+            if not tokens or len(self) < self.minTrieKeys:
+                # (an empty key matches between words)
+                self._trie = None
+                WordSub._update_regex(self)
+                return
+            node = root
+            for token in tokens:
+                node = node.setdefault(token, {})
+            if None not in node:
+                node[None] = (rank, self[key], not self._wordRegex.match(tokens[0]),
+                              not self._wordRegex.match(tokens[-1]))
+        self._firstTokens = frozenset(root)
+        self._regexIsDirty = False
+
+    def getState(self):
+        """Return the entries, in order, and the trie built from them
+        (None for a table that keeps the regex), as data marshal can
+        save.  See setState()."""
+        if self._regexIsDirty:
+            self._update_regex()
+        return (list(self.items()), self._trie)
+
+    def setState(self, state):
+        """Replace the entries, and the trie built from them, with those
+        of a state returned by getState()."""
+        items, trie = state
+        dict.clear(self)
+        dict.update(self, items)
+        self._regexIsDirty = True
+        if trie is not None and len(self) >= self.minTrieKeys:
+            self._trie = trie
+            self._firstTokens = frozenset(trie)
+            self._regexIsDirty = False
+
+    def sub(self, text):
+        """Translate text, returns the modified text."""
+        if self._regexIsDirty:
+            self._update_regex()
+        root = self._trie
+        if root is None:
+            return WordSub.sub(self, text)
+        tokens = self._tokenRegex.findall(text)
+        if self._firstTokens.isdisjoint(tokens):
+            return text
+        n = len(tokens)
+        out = []
+        done = 0
+        get = root.get
+        for i, token in enumerate(tokens):
+            node = get(token)
+            if node is None or i < done:
+                continue
+            # the first added of the keys starting here
+            best = None
+            j = i
+            while True:
+                j += 1
+                entry = node.get(None)
+                if (entry is not None and (best is None or entry[0] < best[0]) and
+                    not (entry[2] and i == 0) and not (entry[3] and j == n)):
+                    best, end = entry, j
+                if j == n:
+                    break
+                node = node.get(tokens[j])
+                if node is None:
+                    break
+            if best is not None:
+                out.extend(tokens[done:i])
+                out.append(best[1])
+                done = end
+        if not out:
+            return text
+        out.extend(tokens[done:])
+        return "".join(out)
@@ -0,0 +1,66 @@
+"""
+Build a brain file from AIML files, incrementally: the categories parsed
+from each file are kept in a cache (see aiml.BrainCache), and only the
+files whose contents changed since the last build are parsed again.  The
+brain file is the same, byte for byte, as that of a build from scratch
+(--clean).
+"""
+from __future__ import print_function
+
+import argparse
+import glob
+import shutil
+import time
+
+import aiml
+from aiml.BrainCache import BrainCache
+
+
+def read_args(argv=None):
+    '''
+    Read command-line arguments
+    '''
+    parser = argparse.ArgumentParser(description='Build a brain file from AIML files')
+    parser.add_argument( 'output', metavar='OUTFILE',
+                         help='Name of the brain file to write' )
+    parser.add_argument( 'aiml', metavar='AIMLFILE', nargs='+',
+                         help='AIML files, or patterns of them, learned in this order '
+                              '(the files matching a pattern in the order of their names)' )
+    parser.add_argument( '--cache', metavar='DIRECTORY',
+                         help='Directory of the parsed files (default: OUTFILE.cache); '
+                              'entries no longer used by the build are removed' )
+    parser.add_argument( '--clean', action='store_true',
+                         help='Empty the cache first, parsing every file' )
+    parser.add_argument( '--workers', '-w', type=int, default=1,
+                         help='Number of processes parsing the files (default: 1)' )
+    parser.add_argument( '--parser', choices=('sax', 'expat'), default='sax',
+                         help='AIML parser backend (default: sax)' )
+    parser.add_argument( '--mapped', action='store_true',
+                         help='Write the memory-mapped brain format' )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = read_args(argv)
+    start = time.time()
+    directory = args.cache or args.output + '.cache'
+    if args.clean:
+        shutil.rmtree(directory, ignore_errors=True)
+    cache = BrainCache(directory)
+    files = [f for pattern in args.aiml for f in sorted(glob.glob(pattern))]
+
+    kern = aiml.Kernel()
+    kern.verbose(False)
+    kern.setParserBackend(args.parser)
+    kern.learnParallel(files, args.workers, cache)
+    kern.saveBrain(args.output, mapped=args.mapped)
+    cache.prune()
+
+    stats = cache.stats()
+    print( "Built %s: %d categories from %d files (%d parsed) in %.2f seconds" %
+           (args.output, kern.numCategories(), len(files), stats['misses'],
+            time.time() - start) )
+
+
+if __name__ == '__main__':
+    main()
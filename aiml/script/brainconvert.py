@@ -0,0 +1,35 @@
+"""
+Convert a brain file saved by Kernel.saveBrain() into the memory-mapped
+format (see aiml.MappedBrain), which Kernel.loadBrain() maps in place
+instead of reading into memory.
+"""
+from __future__ import print_function
+
+import argparse
+import time
+
+from aiml import MappedBrain
+
+
+def read_args():
+    '''
+    Read command-line arguments
+    '''
+    parser = argparse.ArgumentParser(description='Convert a brain file to the memory-mapped format')
+    parser.add_argument( 'brain', metavar='BRAINFILE',
+                         help='Brain file saved by Kernel.saveBrain()' )
+    parser.add_argument( 'output', metavar='OUTFILE',
+                         help='Name of the mapped brain file to write' )
+    return parser.parse_args()
+
+
+def main():
+    args = read_args()
+    start = time.time()
+    MappedBrain.convert( args.brain, args.output )
+    print( "Converted %s to %s in %.2f seconds" % (args.brain, args.output,
+                                                   time.time() - start) )
+
+
+if __name__ == '__main__':
+    main()
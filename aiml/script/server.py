@@ -0,0 +1,253 @@
+"""
+A pre-forking AIML server.
+
+The brain is loaded once, in the parent process, which then forks a
+number of workers.  The workers share the parent's memory pages, so the
+brain is held in memory only once however many of them there are.  Each
+worker accepts connections on a local (Unix domain) socket and answers
+requests with Kernel.respond().
+
+The protocol is one JSON object per line in each direction:
+
+    > {"input": "hello", "session": "tom"}
+    < {"response": "Hi there!"}
+    > {"stats": true}
+    < {"pid": 1234, "Rss": 12345, "Pss": 2345, ...}
+
+"session" is optional.  Sessions live in the memory of the worker that
+serves the connection, so the traffic of a session should be kept on a
+single connection.
+
+Pages stay shared only as long as nobody writes to them.  Before forking,
+the loaded objects are moved out of reach of the garbage collector with
+gc.freeze() (Python 3.7 and later), so that collections do not touch them;
+reference counting still dirties the pages of the nodes a worker visits.
+A brain saved with Kernel.saveBrain(filename, mapped=True) avoids that
+entirely, since its pattern tree is read straight from the mapped file.
+"""
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import os
+import signal
+import socket
+import time
+import traceback
+
+import aiml
+
+
+def read_args():
+    '''
+    Read command-line arguments
+    '''
+    parser = argparse.ArgumentParser(description='Pre-forking AIML server')
+
+    g1 = parser.add_argument_group( 'Bot definition' )
+    g11 = g1.add_mutually_exclusive_group( required=True )
+    g11.add_argument( '--aiml', nargs='+', help='Load AIML file(s)' )
+    g11.add_argument( '--brain', metavar='BRAINFILE',
+                      help='Load a dumped brain file' )
+    g1.add_argument( '--chdir', metavar='DIRECTORY',
+                     help='Directory to change to before loading AIML files' )
+    g1.add_argument( '--bot', metavar='NAME=VALUE', nargs='+', default=[],
+                     help='Bot predicate(s) to set' )
+
+    g2 = parser.add_argument_group( 'Server' )
+    g2.add_argument( '--socket', metavar='PATH', default='aiml.sock',
+                     help='Unix socket to listen on (default: %(default)s)' )
+    g2.add_argument( '--workers', '-w', type=int, default=4,
+                     help='Number of worker processes (default: %(default)s)' )
+
+    return parser.parse_args()
+
+
+def memory_stats(pid='self'):
+    """Return the memory counters (in KiB) of a process, as reported by
+    /proc/PID/smaps_rollup (Linux only: none elsewhere)."""
+    stats = {}
+    try:
+        f = open('/proc/%s/smaps_rollup' % pid)
+    except (IOError, OSError):
+        # not Linux, or a kernel older than 4.14
+        return stats
+    with f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 3 and fields[2] == 'kB':
+                stats[fields[0].rstrip(':')] = int(fields[1])
+    return stats
+
+
+def freeze():
+    """Keep the garbage collector away from everything allocated so far,
+    so that forked workers keep sharing those pages."""
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+
+def handle(kernel, conn):
+    """Answer the requests arriving on a connection until it is closed."""
+    stream = conn.makefile('rwb')
+    try:
+        for line in stream:
+            try:
+                request = json.loads(line.decode('utf-8'))
+                if request.get('stats'):
+                    reply = memory_stats()
+                    reply['pid'] = os.getpid()
+                else:
+                    session = request.get('session', kernel._globalSessionID)
+                    reply = {'response': kernel.respond(request['input'], session)}
+            except (ValueError, KeyError, TypeError) as err:
+                reply = {'error': str(err)}
+            except Exception as err:
+                # a failed response must not take the worker down
+                traceback.print_exc()
+                reply = {'error': 'internal error: %s' % err}
+            stream.write(json.dumps(reply).encode('utf-8') + b'\n')
+            stream.flush()
+    finally:
+        stream.close()
+        conn.close()
+
+
+def worker(kernel, listener):
+    """Worker main loop: serve one connection at a time."""
+    while True:
+        conn, address = listener.accept()
+        try:
+            handle(kernel, conn)
+        except socket.error:
+            pass
+
+
+SIGNALS = (signal.SIGINT, signal.SIGTERM)
+
+
+def interrupt(signum, frame):
+    """Signal handler of the parent process: SIGTERM stops the server as
+    SIGINT does."""
+    raise KeyboardInterrupt()
+
+
+def fork_worker(kernel, listener, children):
+    """Fork a worker answering the connections of listener with kernel,
+    and add its pid to children, with the time it started."""
+    # An interrupt delivered while os.fork() runs its at-fork hooks would be
+    # swallowed by them, so hold signals back until the worker is started.
+    masked = hasattr(signal, 'pthread_sigmask')
+    if masked:
+        signal.pthread_sigmask(signal.SIG_BLOCK, SIGNALS)
+    try:
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                signal.signal(signal.SIGINT, signal.default_int_handler)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                if masked:
+                    signal.pthread_sigmask(signal.SIG_UNBLOCK, SIGNALS)
+                worker(kernel, listener)
+            except KeyboardInterrupt:
+                pass
+            except Exception:
+                traceback.print_exc()
+                status = 1
+            finally:
+                os._exit(status)
+        # (before an interrupt held back can get in between)
+        children[pid] = time.time()
+    finally:
+        if masked:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, SIGNALS)
+
+
+def serve(kernel, address, workers=4):
+    """Listen on the Unix socket at address and fork workers to answer
+    requests with kernel, until interrupted (SIGINT or SIGTERM).  Workers
+    that exit are replaced; on the way out, they are terminated and
+    waited for, and the socket is removed."""
+    if os.path.exists(address):
+        os.unlink(address)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(address)
+    listener.listen(128)
+
+    handlers = [(signum, signal.signal(signum, interrupt)) for signum in SIGNALS]
+    children = {}
+    try:
+        freeze()
+        for i in range(workers):
+            fork_worker(kernel, listener, children)
+        while True:
+            pid, status = os.wait()
+            started = children.pop(pid, None)
+            if started is None:
+                continue
+            print( "Worker %d exited (status %d), starting another" % (pid, status) )
+            # do not spin on a worker that cannot start
+            if time.time() - started < 1:
+                time.sleep(1)
+            fork_worker(kernel, listener, children)
+    except KeyboardInterrupt:
+        print( 'Interrupted!' )
+    finally:
+        for signum in SIGNALS:
+            signal.signal(signum, signal.SIG_IGN)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        listener.close()
+        os.unlink(address)
+        for signum, handler in handlers:
+            signal.signal(signum, handler)
+
+
+def ask(address, input_, session=None):
+    """Send a single input to a server and return its response."""
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.connect(address)
+    stream = conn.makefile('rwb')
+    try:
+        request = {'input': input_}
+        if session is not None:
+            request['session'] = session
+        stream.write(json.dumps(request).encode('utf-8') + b'\n')
+        stream.flush()
+        return json.loads(stream.readline().decode('utf-8'))['response']
+    finally:
+        stream.close()
+        conn.close()
+
+
+def main():
+    args = read_args()
+
+    kern = aiml.Kernel()
+    kern.setTextEncoding( None )
+    if args.aiml:
+        kern.bootstrap(learnFiles=args.aiml, chdir=args.chdir)
+    else:
+        kern.bootstrap(brainFile=args.brain)
+    for predicate in args.bot:
+        name, value = predicate.split('=', 1)
+        kern.setBotPredicate(name, value)
+    kern.verbose(False)
+
+    print( "Serving on %s with %d workers (ctrl-c to exit)" % (args.socket, args.workers) )
+    serve(kern, args.socket, args.workers)
+
+
+if __name__ == '__main__':
+    main()
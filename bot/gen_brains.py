@@ -18,23 +18,11 @@
 # A simple hack to attach a chatterbot to speak activity
 #coding=utf-8
 
-from aiml.Kernel import Kernel
-import glob
+# Rebuilds sara.brn, alice.brn and alisochka.brn, parsing again only the
+# AIML files that changed since the last run (see aiml-build-brain, which
+# takes more options, e.g. --clean to parse every file).
 
-k = Kernel()
-laiml = glob.glob("sara/*.aiml") #devuelve lista con ficheros *.aiml
-for fichero in laiml:
-    k.learn(str(fichero))
-k.saveBrain("sara.brn")
+from aiml.script.brainbuild import main
 
-k = Kernel()
-laiml = glob.glob("alice/*.aiml") #devuelve lista con ficheros *.aiml
-for fichero in laiml:
-    k.learn(str(fichero))
-k.saveBrain("alice.brn")
-
-k = Kernel()
-laiml = glob.glob("alisochka/*.aiml")
-for fichero in laiml:
-    k.learn(str(fichero))
-k.saveBrain("alisochka.brn")
+for brain in ("sara", "alice", "alisochka"):
+    main(["%s.brn" % brain, "%s/*.aiml" % brain])
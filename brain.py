@@ -37,6 +37,8 @@ logger = logging.getLogger('speak')
 BOTS = {
     _('Spanish'): {'name': 'Sara',
                    'brain': 'bot/sara.brn',
+                   # questions and exclamations open with inverted marks
+                   'terminators': u'.?!\u00bf\u00a1',
                    'predicates': {'nombre_bot': 'Sara',
                                   'botmaster': 'La comunidad Azucar'}},
     _('English'): {'name': 'Alice',
@@ -123,6 +125,8 @@ def load(activity, voice, sorry=None):
                 return
 
             kernel.loadBrain(brain['brain'])
+            if 'terminators' in brain:
+                kernel.setSentenceTerminators(brain['terminators'])
             for name, value in list(brain['predicates'].items()):
                 kernel.setBotPredicate(name, value)
 